@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Times read_input against the former two-pass parsing (read_qchem and
+read_qsys, each lowercasing and splitting every line) on synthetic QM/MM
+inputs with large $external_charges blocks.
+
+    python benchmarks/bench_parser.py [--inputs N] [--charges N]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from qchem_send_slurm import read_input  # noqa: E402
+
+
+def write_inputs(directory, n_inputs, n_charges, atoms=30):
+    rng = random.Random(0)
+    paths = []
+    for i in range(n_inputs):
+        lines = ['! qsys wt 12:00:00', '! qsys scratch 20g', '$molecule', '0 1']
+        lines += [f'C {rng.uniform(-5, 5):.6f} {rng.uniform(-5, 5):.6f} '
+                  f'{rng.uniform(-5, 5):.6f}' for _ in range(atoms)]
+        lines += ['$end', '', '$rem', 'method b3lyp', 'basis def2-svp',
+                  'threads 8', 'mem_total 16000', 'qm_mm true', '$end', '',
+                  '$external_charges']
+        lines += [f'{rng.uniform(-40, 40):.6f} {rng.uniform(-40, 40):.6f} '
+                  f'{rng.uniform(-40, 40):.6f} {rng.uniform(-1, 1):.4f}'
+                  for _ in range(n_charges)]
+        lines += ['$end', '']
+        path = os.path.join(directory, f'qmmm{i:04d}.in')
+        with open(path, 'w') as fp:
+            fp.write('\n'.join(lines))
+        paths.append(path)
+    return paths
+
+
+def two_pass(path):
+    """The rem and qsys values as found by the former read_qchem and
+    read_qsys."""
+    rem = {}
+    with open(path) as qin:
+        rem_section = False
+        for line in qin:
+            line = line.lower()
+            if '$end' in line:
+                rem_section = False
+            if rem_section:
+                key, value, *_ = line.replace('=', ' ').split()
+                if key in ('threads', 'mem_total'):
+                    rem[key] = value
+            if '$rem' in line:
+                rem_section = True
+    qsys = {}
+    with open(path) as qin:
+        for line in qin:
+            line = line.lower()
+            if 'qsys' in line:
+                splits = line.replace('=', ' ').split('qsys')[-1].split()
+                if len(splits) == 2:
+                    qsys[splits[0]] = splits[1]
+    return rem, qsys
+
+
+def best_of(fn, paths, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            fn(path)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--inputs', type=int, default=200,
+                        help='number of inputs (default 200)')
+    parser.add_argument('--charges', type=int, default=50000,
+                        help='point charges per input (default 50000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs, the fastest one counts (default 3)')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_inputs(directory, args.inputs, args.charges)
+        size = sum(os.path.getsize(path) for path in paths) / 2**20
+        for path in paths[:1]:
+            inp = read_input(path)
+            rem, qsys = two_pass(path)
+            assert inp.rem['threads'] == rem['threads']
+            assert inp.qsys == qsys
+        print(f'{args.inputs} inputs, {size:.0f} MB, best of {args.repeat}')
+        for name, fn in (('two-pass', two_pass), ('read_input', read_input)):
+            seconds = best_of(fn, paths, args.repeat)
+            print(f'  {name:<12}{seconds:8.3f} s  '
+                  f'{1000 * seconds / args.inputs:8.2f} ms/input  '
+                  f'{size / seconds:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Times the startup of qchem_send_slurm.py in fresh interpreters,
+non-interactive, against a bare interpreter.
+
+    python benchmarks/bench_startup.py [--runs N] [ARGS ...]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'qchem_send_slurm.py')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10,
+                        help='number of runs (default 10)')
+    parser.add_argument('ARGS', nargs=argparse.REMAINDER,
+                        help='arguments of the timed calls (default --help)')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, QCHEM_SEND_SLURM_NONINTERACTIVE='1')
+    calls = [('python', [sys.executable, '-c', 'pass']),
+             ('qchem_send_slurm.py', [sys.executable, SCRIPT,
+                                      *(args.ARGS or ['--help'])])]
+    print(f'{"":<24}{"min":>10}{"median":>10}{"max":>10}')
+    for label, command in calls:
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, env=env)
+            times.append(1000 * (time.perf_counter() - start))
+        times.sort()
+        print(f'{label:<24}{times[0]:>8.0f}ms{times[len(times) // 2]:>8.0f}ms'
+              f'{times[-1]:>8.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
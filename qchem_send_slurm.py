@@ -4,13 +4,37 @@ import sys
 import argparse
 import configparser
 import datetime
+import difflib
+import fnmatch
+import glob
+import io
+import json
+import hashlib
+import contextlib
+import time
+import math
+import shlex
+import random
+import shutil
+import re
+import threading
+import getpass
 
 from subprocess import run
 from math import ceil
+from functools import lru_cache, partial
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
 
 
-jobscript_main_template = '''
+# stages of the jobscript in the order they are written after the #SBATCH
+# header, each is replaced by <stage>.sh and extended by <stage>.post.sh in
+# the site or user template directory (see the templates subcommand).
+# {field} placeholders are filled per job, all other braces are bash.
+jobscript_stage_names = ('prologue', 'stage_in', 'stage_out', 'error',
+                         'payload', 'run')
+
+jobscript_prologue_template = '''
 SUBMIT_HOST=$SLURM_SUBMIT_HOST
 SUBMIT_WORKDIR=$SLURM_SUBMIT_DIR
 JOBID=$SLURM_JOB_ID
@@ -21,10 +45,50 @@ NODES=$(< $SLURM_JOB_NODELIST)
 NODES_UNIQUE=$(echo "$NODES" | sort -u)
 RETURN_VALUE=0
 NODE_WORKDIR=$SCRATCH
-NODE_SCRATCHDIR=$TMPDIR
+# qchem scratch as placed by the scratch policy and the space it needs
+NODE_SCRATCHDIR={scratch_dir}
+SCRATCH_NEED_KB={scratch_need}
+# per-job directory created by the scratch placement, empty for $TMPDIR
+SCRATCH_CLEANUP={scratch_cleanup}
+# <input>.<job id as in the job index>, per input also for arrays and packs
+METRICS="$SUBMIT_WORKDIR/{metrics}.metrics.jsonl"
 #
 ###################################
 #
+metric() {
+    # appends one JSON line to $METRICS: metric <phase> [<key> <json value>]...
+    local LINE="{\\"job\\": \\"$JOBID\\", \\"name\\": \\"$JOBNAME\\", \\"phase\\": \\"$1\\", \\"time\\": $(date +%s.%N)"
+    shift
+    while [ $# -gt 1 ]; do
+        LINE="$LINE, \\"$1\\": $2"
+        shift 2
+    done
+    echo "$LINE}" >> "$METRICS"
+}
+
+timed() {
+    # runs a phase and records its start and end: timed <phase> <command>...
+    local PHASE="$1"
+    local START=$(date +%s.%N)
+    shift
+    "$@"
+    metric "$PHASE" start "$START" end "$(date +%s.%N)"
+}
+
+scratch_monitor() {
+    # records the peak size of the scratch directory in $1 every 30 s
+    local PEAK=0
+    local USED
+    while true; do
+        USED=$(du -sb "$NODE_SCRATCHDIR" 2>/dev/null | cut -f1)
+        if [ "${USED:-0}" -gt "$PEAK" ]; then
+            PEAK=$USED
+            echo "$PEAK" > "$1"
+        fi
+        sleep 30
+    done
+}
+
  print_info() {
     echo ------------------------------------------------------
     echo "Job is running on nodes"
@@ -39,12 +103,24 @@ NODE_SCRATCHDIR=$TMPDIR
     echo
 }
 
-stage_in() {
+'''
+
+jobscript_stage_in_template = '''stage_in() {
     rm -f "$SUBMIT_WORKDIR/job_not_successful"
 
     echo "Calculation working directory: $NODE_WORKDIR"
     echo "            scratch directory: $NODE_SCRATCHDIR"
 
+    # fail now instead of running out of scratch space hours later
+    mkdir -p "$NODE_SCRATCHDIR"
+    local FREE=$(df -Pk "$NODE_SCRATCHDIR" 2>/dev/null | awk 'NR == 2 {print $4}')
+    if [ -n "$FREE" ] && [ "$FREE" -lt "${SCRATCH_NEED_KB:-0}" ]; then
+        echo "** Error ** $FREE KB free in $NODE_SCRATCHDIR, the job needs $SCRATCH_NEED_KB KB"
+        metric scratch_check free_kb "$FREE" need_kb "$SCRATCH_NEED_KB"
+        touch "$SUBMIT_WORKDIR/job_not_successful"
+        exit 1
+    fi
+
     cd $NODE_WORKDIR
 
     echo
@@ -52,7 +128,10 @@ stage_in() {
     echo
 }
 
-stage_out() {
+'''
+
+# {stageout}: functions of the stage-out engine
+jobscript_stage_out_template = '''stage_out() {
     if [ "$RETURN_VALUE" != "0" ]; then
         touch "$SUBMIT_WORKDIR/job_not_successful"
     fi
@@ -77,8 +156,18 @@ stage_out() {
     fi
 
     echo
+
+    # $TMPDIR is cleaned up by slurm, /dev/shm and the workspace are not;
+    # only the directory of the placement, never one set by a site prologue
+    if [ -n "$SCRATCH_CLEANUP" ] && [ "$NODE_SCRATCHDIR" = "$SCRATCH_CLEANUP" ]; then
+        rm -rf "$SCRATCH_CLEANUP"
+    fi
 }
 
+{stageout}'''
+
+# {restart_hooks}: restart_hooks and the handle_error calling it in restart mode
+jobscript_error_template = '''
 handle_error() {
     # Make sure this function is only called once
     # and not once for each parallel process
@@ -89,13 +178,16 @@ handle_error() {
     echo "#-- Early termination signal caught --#"
     echo "#######################################"
     echo
+    metric handle_error
     error_hooks
     stage_out
 }
-'''
-jobscript_main02_template = '''
-payload_hooks() {{
+{restart_hooks}'''
+
+jobscript_payload_template = '''
+payload_hooks() {
 :
+T0=$(date +%s.%N)
 if [ -r "$SLURM_SUBMIT_DIR/{infile}.in" ]; then 
     CPARGS="--dereference" 
     [ -d "$SLURM_SUBMIT_DIR/{infile}.in" ] && CPARGS="--recursive"
@@ -103,16 +195,37 @@ if [ -r "$SLURM_SUBMIT_DIR/{infile}.in" ]; then
     mkdir -p "$NODE_WORKDIR/$DIR"
     cp $CPARGS "$SLURM_SUBMIT_DIR/{infile}.in" "$NODE_WORKDIR/$DIR"
 fi
+BYTES=$(du -sbL "$NODE_WORKDIR/{infile}.in" 2>/dev/null | cut -f1)
+metric payload_stage_in start "$T0" end "$(date +%s.%N)" bytes "${BYTES:-0}"
 
 export QCSCRATCH="$NODE_SCRATCHDIR"
-{qchem_version_path} -nt {ncpus} "{infile}.in" "{infile}.out"
+{pre_run}{live_start}scratch_monitor "$NODE_WORKDIR/.scratch_peak.$JOBID" &
+MONITOR_PID=$!
+T0=$(date +%s.%N)
+{qchem_version_path} -nt {ncpus} {qchem_args}"{infile}.in" "{infile}.out"{qchem_save}
 RETURN_VALUE=$?
+T1=$(date +%s.%N)
+kill $MONITOR_PID 2>/dev/null
+PEAK=$(du -sb "$NODE_SCRATCHDIR" 2>/dev/null | cut -f1)
+if [ -r "$NODE_WORKDIR/.scratch_peak.$JOBID" ] && [ "$(cat "$NODE_WORKDIR/.scratch_peak.$JOBID")" -gt "${PEAK:-0}" ]; then
+    PEAK=$(cat "$NODE_WORKDIR/.scratch_peak.$JOBID")
+fi
+metric qchem start "$T0" end "$T1" input "\\"{infile}\\"" exit_code "$RETURN_VALUE" peak_scratch_bytes "${PEAK:-0}"
+T0=$(date +%s.%N)
 
 # check if job terminated successfully
 if ! tail -n 30 "{infile}.out" | grep -q "Thank you very much for using Q-Chem.  Have a nice day."; then
     RETURN_VALUE=1
 fi
+{post_run}
+stageout "{infile}"
+{live_stop}metric payload_stage_out start "$T0" end "$(date +%s.%N)" bytes "${BYTES:-0}"
+
+
+}
 
+error_hooks() {
+:
 if [ -r "$NODE_WORKDIR/{infile}.out" ]; then 
     CPARGS="--dereference" 
     [ -d "$NODE_WORKDIR/{infile}.out" ] && CPARGS="--recursive"
@@ -120,51 +233,237 @@ if [ -r "$NODE_WORKDIR/{infile}.out" ]; then
     mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
     cp $CPARGS "$NODE_WORKDIR/{infile}.out" "$SLURM_SUBMIT_DIR/$DIR"
 fi
-if [ -r "$NODE_WORKDIR/{infile}.in.fchk" ]; then 
-    CPARGS="--dereference" 
-    [ -d "$NODE_WORKDIR/{infile}.in.fchk" ] && CPARGS="--recursive"
-    DIR=$(dirname "{infile}.in.fchk")
-    mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
-    cp $CPARGS "$NODE_WORKDIR/{infile}.in.fchk" "$SLURM_SUBMIT_DIR/$DIR"
+{live_stop}
+}
+'''
+
+# stage-out engine, the files matching the stage-out patterns are copied back
+# by parallel workers (skipping files with the same size and mtime at the
+# destination) or written into a single archive next to the output
+jobscript_stageout_template = '''
+stageout_list() {{
+    # files below $NODE_WORKDIR matching the stage-out patterns of input $1
+    local INFILE="$1"
+    (
+        cd "$NODE_WORKDIR" || exit
+        shopt -s nullglob
+        for F in {patterns}; do
+            if [ -d "$F" ]; then
+                find -L "$F" -type f
+            elif [ -e "$F" ]; then
+                echo "$F"
+            fi
+        done | sort -u
+    )
+}}
+
+copy_if_changed() {{
+    # copies $NODE_WORKDIR/$1 to $SLURM_SUBMIT_DIR/$1 unless size and mtime match
+    local SRC="$NODE_WORKDIR/$1"
+    local DST="$SLURM_SUBMIT_DIR/$1"
+    if [ -f "$DST" ] && [ "$(stat -L -c %s.%Y "$SRC")" = "$(stat -c %s.%Y "$DST")" ]; then
+        return
+    fi
+    mkdir -p "$(dirname "$DST")"
+    cp --dereference --preserve=timestamps "$SRC" "$DST"
+}}
+
+stageout() {{
+    local LIST="$NODE_WORKDIR/.stageout.$JOBID"
+    stageout_list "$1" > "$LIST"
+    BYTES=$(cd "$NODE_WORKDIR" && xargs -a "$LIST" -d '\\n' -r du -cbL | tail -n 1 | cut -f1)
+{body}}}
+'''
+
+jobscript_stageout_copy = '''    export -f copy_if_changed
+    export NODE_WORKDIR
+    xargs -a "$LIST" -d '\\n' -r -P {workers} -I{{}} bash -c 'copy_if_changed "$1"' _ {{}}
+'''
+
+jobscript_stageout_archive = '''    # the output itself is always copied, everything else goes into the archive
+    [ -e "$NODE_WORKDIR/$1.out" ] && copy_if_changed "$1.out"
+    grep -vxF "$1.out" "$LIST" > "$LIST.archive"
+    if [ -s "$LIST.archive" ]; then
+        mkdir -p "$(dirname "$SLURM_SUBMIT_DIR/$1")"
+        tar -C "$NODE_WORKDIR" {compress}-cf "$SLURM_SUBMIT_DIR/$1.stageout.{extension}" -T "$LIST.archive"
+    fi
+'''
+
+# live sync: a background loop appends the new bytes of the output to
+# <output>.live in the submit directory, removed once the output is copied
+jobscript_live_sync_template = '''
+live_sync() {{
+    # appends the new bytes of $NODE_WORKDIR/$1 to $SLURM_SUBMIT_DIR/$1.live every $2 s
+    local SRC="$NODE_WORKDIR/$1"
+    local DST="$SLURM_SUBMIT_DIR/$1.live"
+    local SENT=0
+    local SIZE
+    mkdir -p "$(dirname "$DST")"
+    : > "$DST"
+    while true; do
+        sleep "$2"
+        [ -r "$SRC" ] || continue
+        SIZE=$(stat -c %s "$SRC")
+        if [ "$SIZE" -lt "$SENT" ]; then
+            # output was rewritten, start over
+            : > "$DST"
+            SENT=0
+        fi
+        if [ "$SIZE" -gt "$SENT" ]; then
+            tail -c +$((SENT + 1)) "$SRC" | head -c $((SIZE - SENT)) >> "$DST"
+            SENT=$SIZE
+        fi
+    done
+}}
+
+live_sync_stop() {{
+    if [ -r "$NODE_WORKDIR/.live_sync.$JOBID" ]; then
+        kill $(cat "$NODE_WORKDIR/.live_sync.$JOBID") 2>/dev/null
+        rm -f "$NODE_WORKDIR/.live_sync.$JOBID" "$SLURM_SUBMIT_DIR/$1.out.live"
+    fi
+}}
+'''
+
+jobscript_live_sync_start = '''live_sync "{infile}.out" {interval} &
+echo $! > "$NODE_WORKDIR/.live_sync.$JOBID"
+'''
+
+# restart mode: qchem keeps its scratch files in $QCSCRATCH/$QCSAVE
+# workflow geometry hand-off: the last geometry in the output of the job this
+# one depends on is written into the copied input before qchem starts
+jobscript_handoff_pre_run = '''{python} {script} handoff "$SLURM_SUBMIT_DIR/{output}" "{infile}.in" || echo "** Warning ** no geometry handed off from {output}"
+'''
+
+jobscript_restart_pre_run = '''QCSAVE=qchem_restart
+if [ -r "$SLURM_SUBMIT_DIR/{infile}.restart.tar" ]; then
+    echo "restoring scratch files from {infile}.restart.tar"
+    tar -C "$QCSCRATCH" -xf "$SLURM_SUBMIT_DIR/{infile}.restart.tar"
 fi
-if [ -r "$NODE_WORKDIR/plots" ]; then 
-    CPARGS="--dereference" 
-    [ -d "$NODE_WORKDIR/plots" ] && CPARGS="--recursive"
-    DIR=$(dirname "plots")
-    mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
-    cp $CPARGS "$NODE_WORKDIR/plots" "$SLURM_SUBMIT_DIR/$DIR"
+'''
+
+jobscript_restart_post_run = '''if [ "$RETURN_VALUE" = "0" ]; then
+    rm -f "$SLURM_SUBMIT_DIR/{infile}.restart.tar"
 fi
-if [ -r "$NODE_WORKDIR/{infile}.out.plots" ]; then 
-    CPARGS="--dereference" 
-    [ -d "$NODE_WORKDIR/{infile}.out.plots" ] && CPARGS="--recursive"
-    DIR=$(dirname "{infile}.out.plots")
-    mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
-    cp $CPARGS "$NODE_WORKDIR/{infile}.out.plots" "$SLURM_SUBMIT_DIR/$DIR"
+'''
+
+jobscript_restart_template = '''
+restart_hooks() {{
+    if [ "${{SLURM_RESTART_COUNT:-0}}" -ge {restarts} ]; then
+        echo "restart limit of {restarts} reached, not requeueing"
+        return
+    fi
+    echo "saving scratch files to {infile}.restart.tar and requeueing"
+    tar -C "$NODE_SCRATCHDIR" -cf "$SLURM_SUBMIT_DIR/{infile}.restart.tar" qchem_restart \\
+        && {python} {script} restart "$SLURM_SUBMIT_DIR/{infile}.in" \\
+        && scontrol requeue "$SLURM_JOB_ID"
+}}
+
+handle_error() {{
+    # Make sure this function is only called once
+    # and not once for each parallel process
+    trap ':' 2 9 15
+
+    echo
+    echo "#######################################"
+    echo "#-- Early termination signal caught --#"
+    echo "#######################################"
+    echo
+    metric handle_error
+    error_hooks
+    restart_hooks
+    stage_out
+}}
+'''
+
+jobscript_array_template = '''
+# array task -> input file mapping, one input (without .in) per line
+INFILE=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" "{manifest}")
+if [ -z "$INFILE" ]; then
+    echo "no input found for array task $SLURM_ARRAY_TASK_ID in {manifest}"
+    exit 1
 fi
+'''
 
+jobscript_pack_template = '''
+PACK_RC="$NODE_WORKDIR/pack_returncodes.$SLURM_JOB_ID"
+
+run_input() {{
+    # runs one input of the pack in its own work and scratch directory
+    INFILE="$1"
+    NAME=$(echo "$INFILE" | tr '/' '_')
+    WORKDIR="$NODE_WORKDIR/pack/$NAME"
+    DIR=$(dirname "$INFILE")
+    mkdir -p "$WORKDIR/$DIR"
+    cd "$WORKDIR"
+    cp --dereference "$SLURM_SUBMIT_DIR/$INFILE.in" "$WORKDIR/$DIR"
+
+    export QCSCRATCH="$NODE_SCRATCHDIR/$NAME"
+    mkdir -p "$QCSCRATCH"
+    T0=$(date +%s.%N)
+    {qchem_version_path} -nt {ncpus} "$INFILE.in" "$INFILE.out"
+    RC=$?
+    T1=$(date +%s.%N)
+    PEAK=$(du -sb "$QCSCRATCH" 2>/dev/null | cut -f1)
+    if ! tail -n 30 "$INFILE.out" | grep -q "Thank you very much for using Q-Chem.  Have a nice day."; then
+        RC=1
+    fi
+    # the qchem metrics of each input go to <input>.<pack job id>
+    METRICS="$SLURM_SUBMIT_DIR/$(basename "$INFILE").$JOBID.metrics.jsonl"
+    metric qchem start "$T0" end "$T1" input "\\"$INFILE\\"" exit_code "$RC" peak_scratch_bytes "${{PEAK:-0}}"
+
+    # stage out as soon as the input is done, plots is renamed to
+    # <input>.plots as several inputs share the submit directory
+    mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
+    for F in "$INFILE.out" "$INFILE.in.fchk" "$INFILE.out.plots"; do
+        if [ -r "$F" ]; then
+            CPARGS="--dereference"
+            [ -d "$F" ] && CPARGS="--recursive"
+            cp $CPARGS "$F" "$SLURM_SUBMIT_DIR/$DIR"
+        fi
+    done
+    if [ -d plots ]; then
+        cp --recursive plots "$SLURM_SUBMIT_DIR/$INFILE.plots"
+    fi
+    rm -rf "$QCSCRATCH"
 
+    echo "$INFILE $RC" >> "$PACK_RC"
 }}
 
-error_hooks() {{
+payload_hooks() {{
 :
-if [ -r "$NODE_WORKDIR/{infile}.out" ]; then 
-    CPARGS="--dereference" 
-    [ -d "$NODE_WORKDIR/{infile}.out" ] && CPARGS="--recursive"
-    DIR=$(dirname "{infile}.out")
-    mkdir -p "$SLURM_SUBMIT_DIR/$DIR"
-    cp $CPARGS "$NODE_WORKDIR/{infile}.out" "$SLURM_SUBMIT_DIR/$DIR"
+export -f run_input metric
+export NODE_WORKDIR NODE_SCRATCHDIR PACK_RC METRICS JOBID JOBNAME
+: > "$PACK_RC"
+xargs -a "{manifest}" -d '\\n' -P {workers} -I{{}} bash -c 'run_input "$1"' _ {{}}
+
+cp "$PACK_RC" "$SLURM_SUBMIT_DIR/$SLURM_JOB_NAME.returncodes"
+if grep -qv ' 0$' "$PACK_RC"; then
+    RETURN_VALUE=1
 fi
+echo "$(grep -c ' 0$' "$PACK_RC") of $(wc -l < "{manifest}") inputs finished successfully"
+}}
 
+error_hooks() {{
+:
+# copy back the outputs of the inputs still running
+while read -r INFILE; do
+    NAME=$(echo "$INFILE" | tr '/' '_')
+    if [ -r "$NODE_WORKDIR/pack/$NAME/$INFILE.out" ]; then
+        mkdir -p "$SLURM_SUBMIT_DIR/$(dirname "$INFILE")"
+        cp --dereference "$NODE_WORKDIR/pack/$NAME/$INFILE.out" "$SLURM_SUBMIT_DIR/$INFILE.out"
+    fi
+done < "{manifest}"
+cp "$PACK_RC" "$SLURM_SUBMIT_DIR/$SLURM_JOB_NAME.returncodes"
 }}
 '''
 
-jobscript_foot_template = '''
+jobscript_run_template = '''
 ###################################
 #
 # Run the stuff:
 
-print_info
-stage_in
+timed print_info print_info
+timed stage_in stage_in
 
 echo $(pwd)
 for f in $(pwd)
@@ -174,12 +473,21 @@ done
 # If catch signals 2 9 15, run this function:
 trap 'handle_error' 2 9 15
 
-payload_hooks &
+timed payload payload_hooks &
 wait
-stage_out
+timed stage_out stage_out
 exit $RETURN_VALUE
 '''
 
+jobscript_stages = {
+    'prologue': jobscript_prologue_template,
+    'stage_in': jobscript_stage_in_template,
+    'stage_out': jobscript_stage_out_template,
+    'error': jobscript_error_template,
+    'payload': jobscript_payload_template,
+    'run': jobscript_run_template,
+}
+
 parser_epilog = """
 This script uses keywords from the QChem input file to generate the slurm jobscript.
 Two types of lines from the input file are evaluated: 
@@ -212,11 +520,25 @@ Two types of lines from the input file are evaluated:
 
     ressources request via the command line (via -l) should overwrite anything specified 
     in the input file. 
+    Without a thread count in the input or on the command line one thread is used.
+
+    Multi job inputs (jobs separated by @@@) request the maximum memory, scratch and
+    threads of all jobs and the sum of their walltimes. With --split-stages every job
+    is submitted on its own and chained with --dependency=afterok, jobs reading the
+    molecule or guess from the previous job stay together with it. Their inputs are
+    written to .stages/<input>_part<i>.in, qsys lines above the first section of the
+    file apply to all of them.
+
+    Workflows: 'qsys depends_on <input>[,<input>...]' lets the job wait for the jobs
+    of other inputs (paths relative to the input), 'qsys geometry_from <input>'
+    also starts it from the last geometry in the output of that input. All
+    inputs given together are submitted at once, chained with --dependency=afterok.
 
 ** Attention **
 Unlike our cluster JUSTUS2 does not automatically assign out of ram scratch space
 thus it is advised to request it if your calculations will write significant amount 
-of output data as otherwise it will be deducted from your ram limit! 
+of output data as otherwise it will be deducted from your ram limit! Jobs with a
+scratch request are placed by the scratch policy (see --scratch).
 
 Should you encounter any issues feel free to report them to me directly or open 
 an issue at https://github.com/ToKa96/qchem_send_slurm
@@ -250,14 +572,56 @@ def _timedelta_from_string(string: str):
     return time
 
 
-class SlurmMemory:
+class _SlurmResource:
+    """Base class of the resource descriptors of JobData.
+
+    The values are kept per instance in the slot '_<name>' as a tuple of at
+    most three entries in order of increasing precedence (qchem < qsys < cmd).
+    The last value which is not None is the one used.
+    """
+    # name used in the overwrite warning, no warning if None
+    label = None
+
+    def __set_name__(self, owner, name):
+        self.slot = '_' + name
+
+    def parse(self, value):
+        return value
 
-    def __init__(self):
-        self._data = [None, None, None]
+    def format(self, value):
+        return value
+
+    def raw(self, obj):
+        """Returns the unformatted value with the highest precedence."""
+        return _last_not_none(getattr(obj, self.slot))
 
     def __set__(self, obj, value):
+        data = self.parse(value)
+        values = getattr(obj, self.slot)
+        if (self.label is not None and data is not None
+                and _last_not_none(values) is not None):
+            print(
+                f'** Warning ** QSYS/CMD overwrites qchem variable {self.label}')
+        if len(values) < 3:
+            values = values + (data,)
+        else:
+            values = values[:2] + (data,)
+        setattr(obj, self.slot, values)
+
+    def __get__(self, obj, type):
+        if obj is None:
+            return self
+        ret = self.raw(obj)
+        if ret is None:
+            return ret
+        return self.format(ret)
+
+
+class SlurmMemory(_SlurmResource):
+    label = 'Memory'
+
+    def parse(self, value):
         data = None
-        i = 0
         if isinstance(value, str):
             value = value.lower()
             if value.endswith('m') or value.endswith('mb'):
@@ -276,40 +640,22 @@ class SlurmMemory:
         else:
             if value is not None:
                 print(f"** Warning Unusual memory encountered: {value}")
+        return data
 
-        for i, val in enumerate(self._data):
-            if val is None:
-                self._data[i] = data
-                break
-
-        if i >= 1:
-            print('** Warning ** QSYS/CMD overwrites qchem variable Memory')
-
-    def __get__(self, obj, type):
-        ret = None
-        if obj is None:
-            ret = _last_not_none(self._data)
-        else:
-            ret = _last_not_none(getattr(self, "_data"))
-
-        if ret is None:
-            return ret
-        elif ret % (1048576) == 0:
-            return f'{ret // 1048576}T'
-        elif ret % 1024 == 0:
-            return f"{ret // 1024}G"
+    def format(self, value):
+        if value % (1048576) == 0:
+            return f'{value // 1048576}T'
+        elif value % 1024 == 0:
+            return f"{value // 1024}G"
         else:
-            return f"{ret}M"
+            return f"{value}M"
 
 
-class SlurmScratch:
+class SlurmScratch(_SlurmResource):
+    label = 'Scratch'
 
-    def __init__(self):
-        self._data = [None, None, None]
-
-    def __set__(self, obj, value):
+    def parse(self, value):
         data = None
-        i = 0
         if isinstance(value, str):
             value = value.lower()
             if value.endswith('m') or value.endswith('mb'):
@@ -332,54 +678,28 @@ class SlurmScratch:
         else:
             if value is not None:
                 print(f"** Warning Unusual scratch encountered: {value}")
+        return data
 
-        for i, val in enumerate(self._data):
-            if val is None:
-                self._data[i] = data
-                break
-
-        if i >= 1:
-            print('** Warning ** QSYS/CMD overwrites qchem variable Scratch')
-
-    def __get__(self, obj, type):
-        ret = None
-        if obj is None:
-            ret = _last_not_none(self._data)
-        else:
-            ret = _last_not_none(getattr(self, "_data"))
-
-        if ret is None:
-            return ret
-        else:
-            return f'{ceil(ret / 1024)}'
+    def format(self, value):
+        return f'{ceil(value / 1024)}'
 
 
-class SlurmTime:
-    def __init__(self):
-        self._data = None
+class SlurmTime(_SlurmResource):
 
-    def __set__(self, obj, value):
+    def parse(self, value):
         if isinstance(value, str):
-            self._data = _timedelta_from_string(value)
+            return _timedelta_from_string(value)
         elif isinstance(value, datetime.datetime):
-            self._data = datetime.timedelta(
+            return datetime.timedelta(
                 days=value.day,
                 hours=value.hour,
                 minutes=value.minute,
                 seconds=value.second)
         elif isinstance(value, datetime.timedelta):
-            self._data = value
-        else:
-            pass
-
-    def __get__(self, obj, type):
-        if obj is None:
-            timedelta = self._data
-        else:
-            timedelta = getattr(self, '_data')
+            return value
+        return None
 
-        if timedelta is None:
-            return None
+    def format(self, timedelta):
         seconds = int(timedelta.total_seconds())
         hours = seconds // 3600
         minutes = (seconds // 60) - hours * 60
@@ -389,31 +709,135 @@ class SlurmTime:
         return f"{days:02d}-{hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
-@dataclass
-class JobData:
-    # init stuff
-    mail: str
-    mail_type: str
-    qchem_version_path: str = ''
+@dataclass(frozen=True)
+class StageOut:
+    """How the payload copies results back to the submit directory.
+
+    mode is 'copy' (parallel copy workers, unchanged files are skipped),
+    'tar' or 'tgz' (one archive <input>.stageout.tar[.gz], the output is
+    still copied). Patterns are bash globs relative to the work directory,
+    {infile} stands for the input path without .in. With live_sync > 0 the
+    new part of the output is appended to <input>.out.live every live_sync
+    seconds while qchem runs.
+    """
+    mode: str = 'copy'
+    workers: int = 4
+    patterns: tuple = ('{infile}.out', '{infile}.in.fchk', 'plots',
+                       '{infile}.out.plots')
+    live_sync: int = 0
+
+    @classmethod
+    def from_config(cls, section):
+        """Reads the [STAGEOUT] config section, extra patterns are added to
+        the default ones."""
+        if section is None:
+            return cls()
+        patterns = cls.patterns + tuple(
+            section.get('patterns', '').replace(',', ' ').split())
+        return cls(mode=section.get('mode', cls.mode),
+                   workers=int(section.get('workers', cls.workers)),
+                   patterns=patterns,
+                   live_sync=int(section.get('live_sync', cls.live_sync)))
+
+    def with_patterns(self, patterns):
+        new = tuple(p for p in patterns if p not in self.patterns)
+        return StageOut(self.mode, self.workers, self.patterns + new,
+                        self.live_sync)
+
+    def render(self):
+        # the input path is quoted, the globs of the patterns are not
+        patterns = ' '.join(p.replace('{infile}', '"$INFILE"')
+                            for p in self.patterns)
+        if self.mode in ('tar', 'tgz'):
+            compress = ''
+            if self.mode == 'tgz':
+                compress = '--use-compress-program="$(command -v pigz || echo gzip)" '
+            body = jobscript_stageout_archive.format(
+                compress=compress,
+                extension='tgz' if self.mode == 'tgz' else 'tar')
+        else:
+            if self.mode != 'copy':
+                print(f'** Warning ** unknown stage-out mode {self.mode}, using copy')
+            body = jobscript_stageout_copy.format(workers=self.workers)
+        ret = jobscript_stageout_template.format(patterns=patterns, body=body)
+        if self.live_sync > 0:
+            ret += jobscript_live_sync_template.format()
+        return ret
 
-    mem: SlurmMemory = SlurmMemory()
+    def live_hooks(self, infile):
+        """Returns the lines starting and stopping the live sync of the
+        output of infile, empty if it is disabled."""
+        if self.live_sync <= 0:
+            return '', ''
+        start = jobscript_live_sync_start.format(infile=infile,
+                                                 interval=self.live_sync)
+        return start, f'live_sync_stop "{infile}"\n'
 
-    # data from cmd/.in file
-    jobname: str = field(init=False)
-    scratch: SlurmScratch = SlurmScratch()
-    time: SlurmTime = SlurmTime()
-    ncpus: int = field(init=False)
 
-    def create_header(self):
+class JobData:
+    """Resources and settings of a single job.
+
+    Uses __slots__ so that large batches of jobs stay cheap, the resource
+    descriptors store their values per instance in the underscore slots.
+    """
+    __slots__ = ('mail', 'mail_type', 'qchem_version_path', 'jobname',
+                 'ncpus', 'restarts', 'stageout', 'geometry_from',
+                 'partition', 'template', 'scratch_dir', 'scratch_need',
+                 '_mem', '_scratch', '_time')
+
+    mem = SlurmMemory()
+    scratch = SlurmScratch()
+    time = SlurmTime()
+
+    def __init__(self, mail, mail_type, qchem_version_path=''):
+        # init stuff
+        self.mail = mail
+        self.mail_type = mail_type
+        self.qchem_version_path = qchem_version_path
+
+        # data from cmd/.in file
+        self.jobname = None
+        self.ncpus = None
+        # maximum number of automatic requeues, 0 disables the restart mode
+        self.restarts = 0
+        # StageOut settings
+        self.stageout = StageOut()
+        # output the geometry is handed off from, relative to the submit dir
+        self.geometry_from = None
+        # partition of the node class the job was fitted to
+        self.partition = None
+        # JobscriptTemplate, None for the builtin stages
+        self.template = None
+        # qchem scratch directory and volume (MB) chosen by place_scratch,
+        # None for $TMPDIR and the scratch request
+        self.scratch_dir = None
+        self.scratch_need = None
+        self._mem = ()
+        self._scratch = ()
+        self._time = ()
+
+    def __repr__(self):
+        return (f'JobData(jobname={self.jobname!r}, mem={self.mem!r}, '
+                f'scratch={self.scratch!r}, time={self.time!r}, '
+                f'ncpus={self.ncpus!r})')
+
+    def create_header(self, jobname=None, array=False):
+        if jobname is None:
+            jobname = self.jobname
         ret = '#!/bin/bash\n'
-        ret += f'#SBATCH --job-name={self.jobname}\n'
+        ret += f'#SBATCH --job-name={jobname}\n'
         ret += '#SBATCH --nodes=1\n'
         ret += '#SBATCH --signal=2@120\n'
+        if self.partition:
+            ret += f'#SBATCH --partition={self.partition}\n'
+        if self.restarts:
+            ret += '#SBATCH --requeue\n'
+            ret += '#SBATCH --open-mode=append\n'
 
         if self.mem is not None:
             ret += f'#SBATCH --mem={self.mem}\n'
-        if self.ncpus is not None:
-            ret += f'#SBATCH -n {self.ncpus}\n'
+        # qchem runs with one thread if neither input nor command line set any
+        ret += f'#SBATCH -n {self.ncpus or 1}\n'
         if self.scratch is not None:
             ret += f"#SBATCH --gres=scratch:{self.scratch}\n"
         if self.time is not None:
@@ -423,40 +847,76 @@ class JobData:
             if self.mail_type:
                 ret += f"#SBATCH --mail-type={self.mail_type.replace(' ','')}\n"
 
-        ret += '#SBATCH --output="%x.o%j"\n'
+        if array:
+            ret += '#SBATCH --output="%x.o%A_%a"\n'
+        else:
+            ret += '#SBATCH --output="%x.o%j"\n'
 
         return ret
 
+    def array_key(self):
+        """Key under which jobs can share one array jobscript: identical
+        resource header (ignoring the job name) and qchem version."""
+        return (self.create_header(jobname='', array=True),
+                self.qchem_version_path, self.stageout, self.scratch_dir)
+
     def check_data(self):
         if self.time is None:
             print('** Warning ** no walltime set')
         if self.mem is None:
             print('** Warning ** no ram memory set')
-        if self.scratch is None:
+        if self.scratch is None and self.scratch_dir is None:
             print('** Warning ** no scratch space set')
 
 
-def load_config():
-    """TODO: Docstring for load_config.
-    :returns: TODO
+def load_config(interactive=True):
+    """Reads the config file, offers to create it if it is missing.
+
+    :interactive: False never asks, a missing config file gives an empty
+        config
+    :returns: ConfigParser
 
     """
-    standard_path = f"{os.path.expanduser('~')}/.config/qchem_send_slurm.conf"
-    config = configparser.ConfigParser()
-    try:
-        if not os.path.isfile(standard_path):
-            raise FileNotFoundError
-        config.read(standard_path)
-    except FileNotFoundError:
-        print('No config File found')
+    standard_path = config_path()
+    if os.path.isfile(standard_path):
+        return read_config(standard_path)
+    print('No config File found')
+    if interactive:
         inp = input('Would you like to create one?\n')
         if inp.lower().startswith('y'):
             write_config()
-            load_config()
-        else:
-            print(
-                '** Warning this script might show unexpected behaviour without such a config file!')
+            return read_config(standard_path)
+    print(
+        '** Warning this script might show unexpected behaviour without such a config file!')
+    return configparser.ConfigParser()
+
+
+def interactive_session(argv):
+    """Prompts need a terminal and are switched off by --non-interactive
+    or QCHEM_SEND_SLURM_NONINTERACTIVE=1 for batch use."""
+    if '--non-interactive' in argv:
+        return False
+    if os.environ.get('QCHEM_SEND_SLURM_NONINTERACTIVE', '') not in ('', '0'):
+        return False
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
+def config_path():
+    return os.path.join(os.path.expanduser('~'), '.config/qchem_send_slurm.conf')
 
+
+def read_config(path=None):
+    """Reads the config file without any prompts, a missing file gives an
+    empty config.
+
+    :path: config file (default ~/.config/qchem_send_slurm.conf)
+    :returns: ConfigParser
+
+    """
+    if path is None:
+        path = config_path()
+    config = configparser.ConfigParser()
+    config.read(path)
     return config
 
 
@@ -465,7 +925,7 @@ def write_config(path=''):
     :returns: TODO
 
     """
-    version_path = '/lustre/work/ws/ws1/hd_ie450-dreuw_qchem/versions/'
+    version_path = default_version_dir
     standard_path = os.path.join(os.path.expanduser(
         '~'), '.config/qchem_send_slurm.conf')
     default_version = ''
@@ -499,30 +959,20 @@ def write_config(path=''):
             print(f'** Warning ** {inp} does not exist!')
         version_path = inp
 
-    config['PATHS'] = {'qchem_version_dir': version_path}
-
     if os.path.exists(version_path):
         if os.path.isdir(version_path):
             print('Following version scripts found:')
-            versions = []
-            for f in os.listdir(version_path):
-                if os.path.isfile(os.path.join(version_path, f)):
-                    vscript = os.path.basename(f)
-                    print(vscript)
-                    versions.append(vscript)
+            registry = VersionRegistry(version_path, refresh=True)
+            for vscript in sorted(registry.scripts):
+                print(vscript)
 
             inp = input(
                 'If you wish to set one of these as default please enter its name?\n')
 
             if inp:
-                if inp in versions:
-                    default_version = version_path + inp
-                else:
-                    for version in versions:
-                        if inp in version:
-                            default_version = version_path + version
+                default_version = registry.resolve(inp) or ''
                 if default_version == '':
-                    print('** Warning version script does not exist')
+                    print('** Warning version script does not exist or is ambiguous')
             else:
                 print('No default qchem version set')
 
@@ -531,7 +981,8 @@ def write_config(path=''):
                 f'{version_path} is a file using it as default qchem version script')
             default_version = version_path
 
-    config['PATHS'] = {'qchem_version': default_version}
+    config['PATHS'] = {'qchem_version_dir': version_path,
+                       'qchem_version': default_version}
 
     mail = input('Please enter mail address to use for slurm notifications?\n')
     print(f'Using {mail} as mail address for slurm')
@@ -552,204 +1003,3930 @@ def write_config(path=''):
         config.write(configfile)
 
 
-def read_qchem(path, data: JobData):
-    key_mapping = {
-        'ncpus': ['threads'],
-        'mem': ['mem_total'],
-    }
-    qchem_keys = ['threads', 'mem_total']
-    qchem = {}
-    with open(path) as qin:
-        rem_section = False
-        for line in qin:
-            line = line.lower()
+# JobData attribute -> qchem $rem keys
+qchem_key_mapping = {
+    'ncpus': ['threads'],
+    'mem': ['mem_total'],
+}
+
+# JobData attribute -> qsys keys
+qsys_key_mapping = {
+    'time': ['walltime', 'wt', 'time'],
+    'mem': ['memory', 'mem'],
+    'scratch': ['scratch'],
+    'ncpus': ['threads', 'ncpus'],
+}
+
+@dataclass
+class QChemInput:
+    """Everything read_input() extracts from a qchem input file."""
+    path: str
+    # $rem keywords, lowercase keys and values
+    rem: dict = field(default_factory=dict)
+    # qsys directives in order of appearance, lowercase keys and values
+    qsys: dict = field(default_factory=dict)
+    # (section name, start byte offset, end byte offset)
+    sections: list = field(default_factory=list)
+    # one QChemInput per job of a multi job input (separated by @@@)
+    stages: list = field(default_factory=list)
+    # start and end byte offset of this stage in the file
+    span: tuple = (0, 0)
+    # $molecule only contains 'read'
+    molecule_read: bool = False
+    # sha1 of the raw file content
+    digest: str = ''
+    # number of atoms in $molecule (maximum over the stages)
+    natoms: int = 0
+    # extra stage-out patterns from 'qsys stageout <pattern>' lines
+    stageout: list = field(default_factory=list)
+    # inputs whose jobs have to finish first, from 'qsys depends_on' lines
+    depends_on: list = field(default_factory=list)
+    # input whose final geometry this job starts from ('qsys geometry_from')
+    geometry_from: str = ''
+
+    @property
+    def method(self):
+        return self.rem.get('method', self.rem.get('exchange', ''))
+
+    @property
+    def basis(self):
+        return self.rem.get('basis', '')
+
+    def reads_scratch(self):
+        """Whether this stage reads molecule or guess from the scratch
+        files of the previous stage."""
+        if self.rem.get('scf_guess') == 'read':
+            return True
+        return self.molecule_read
+
+
+def _split_qsys_line(line: str):
+    line = line.replace("=", " ")
+    splits = line.split('qsys')[-1]
+    splits = splits.split()
+    if len(splits) == 2:
+        return splits
+    print('** Warning ** Unusual QSYS line detected ignoring it')
+    print(line)
+    print(splits)
+    return None
+
+
+def _line_bounds(buf, pos):
+    start = buf.rfind(b'\n', 0, pos) + 1
+    end = buf.find(b'\n', pos)
+    end = len(buf) if end < 0 else end + 1
+    return start, end
+
+
+def _parse_rem(block: bytes, rem: dict):
+    for line in block.decode(errors='replace').splitlines():
+        line = line.replace('=', ' ')
+        splits = line.split()
+        if len(splits) < 2 or splits[0].startswith('!'):
+            continue
+        key, value, *_ = splits
+        rem[key] = value
+
+
+def _stage_bounds(buf):
+    """Returns (start, end) byte offsets of the jobs separated by @@@."""
+    bounds = []
+    begin = 0
+    pos = buf.find(b'@@@')
+    while pos >= 0:
+        line_start, line_end = _line_bounds(buf, pos)
+        if buf[line_start:line_end].strip() == b'@@@':
+            bounds.append((begin, line_start))
+            begin = line_end
+        pos = buf.find(b'@@@', line_end)
+    bounds.append((begin, len(buf)))
+    return bounds
+
+
+# qsys keys with paths as values, these keep their case
+qsys_path_keys = ('stageout', 'depends_on', 'geometry_from')
+
+
+def _raw_qsys_value(raw, start, end):
+    line = raw[start:end].decode(errors='replace')
+    return line[line.lower().rfind('qsys') + 4:].replace('=', ' ').split()[-1]
+
+
+def _scan_stage(buf, inp: QChemInput, raw=None):
+    begin, end = inp.span
+    section = None
+    start = body = 0
+    pos = buf.find(b'$', begin, end)
+    while pos >= 0:
+        line_start, line_end = _line_bounds(buf, pos)
+        if not buf[line_start:pos].strip():
+            token = buf[pos + 1:line_end].split()
+            name = token[0].decode(errors='replace') if token else ''
+            if name == 'end':
+                if section is not None:
+                    inp.sections.append((section, start, line_end))
+                    if section == 'rem':
+                        _parse_rem(buf[body:line_start], inp.rem)
+                    elif section == 'molecule':
+                        molecule = buf[body:line_start].strip()
+                        inp.molecule_read = molecule == b'read'
+                        if not inp.molecule_read:
+                            # first line is charge and multiplicity
+                            inp.natoms = max(inp.natoms, molecule.count(b'\n'))
+                section = None
+            elif section is None:
+                section = name
+                start = line_start
+                body = line_end
+        pos = buf.find(b'$', line_end, end)
+
+    pos = buf.find(b'qsys', begin, end)
+    while pos >= 0:
+        line_start, line_end = _line_bounds(buf, pos)
+        splits = _split_qsys_line(
+            buf[line_start:line_end].decode(errors='replace'))
+        if splits is not None:
+            key, value = splits
+            if key in qsys_path_keys and raw is not None:
+                value = _raw_qsys_value(raw, line_start, line_end)
+            if key == 'stageout':
+                inp.stageout.append(value)
+            elif key == 'depends_on':
+                inp.depends_on.extend(v for v in value.split(',') if v)
+            elif key == 'geometry_from':
+                inp.geometry_from = value
+            else:
+                inp.qsys[key] = value
+        pos = buf.find(b'qsys', line_end, end)
 
-            if '$end' in line:
-                rem_section = False
 
-            if rem_section:
-                line = line.replace('=', ' ')
-                splits = line.split()
-                key, value, *_ = splits
-                if key in qchem_keys:
-                    qchem[key] = value
+def read_input(path):
+    """Reads a qchem input file in a single read.
 
-            if '$rem' in line:
-                rem_section = True
+    Instead of lowercasing and splitting every line in Python the lowercased
+    content is searched for '$' (section markers) and 'qsys' with
+    bytes.find, so large $molecule or $external_charges blocks are skipped
+    without being decoded. Only the $rem section and the qsys lines are
+    decoded.
 
-    try:
-        qchem['mem_total'] = int(qchem['mem_total']) * 1.05
-    except KeyError:
-        pass
+    Multi job inputs are split at the @@@ lines into stages, the rem, qsys
+    and sections of the returned record are the ones of all stages combined.
+
+    :path: path to the qchem input file
+    :returns: QChemInput
+
+    """
+    inp = QChemInput(path)
+    with open(path, 'rb') as qin:
+        buf = qin.read()
+    inp.digest = hashlib.sha1(buf).hexdigest()
+    raw, buf = buf, buf.lower()
+    inp.span = (0, len(buf))
+
+    for span in _stage_bounds(buf):
+        stage = QChemInput(path, span=span)
+        _scan_stage(buf, stage, raw)
+        inp.stages.append(stage)
+        inp.rem.update(stage.rem)
+        inp.qsys.update(stage.qsys)
+        inp.sections.extend(stage.sections)
+        inp.natoms = max(inp.natoms, stage.natoms)
+        inp.stageout.extend(stage.stageout)
+        inp.depends_on.extend(stage.depends_on)
+        inp.geometry_from = inp.geometry_from or stage.geometry_from
+
+    return inp
+
+
+# $rem keywords that only set resources and leave the results unchanged
+fingerprint_ignored_rem = ('threads', 'mem_total', 'mem_static', 'cc_memory',
+                           'ao2mo_disk')
+# decimals the coordinates are rounded to
+fingerprint_decimals = 5
+
+
+def _section_lines(body: bytes):
+    """Lines of a section without comments and blank lines, whitespace
+    collapsed."""
+    lines = []
+    for line in body.decode(errors='replace').splitlines():
+        line = ' '.join(line.split('!')[0].split())
+        if line:
+            lines.append(line)
+    return lines
+
+
+def _normalized_molecule(lines):
+    """Charge, multiplicity and atoms with rounded cartesian coordinates,
+    lines which are not cartesian (z-matrix, variables) are kept as they
+    are."""
+    ret = lines[:1]
+    for line in lines[1:]:
+        symbol, *values = line.split()
+        try:
+            # + 0.0 turns -0.0 into 0.0
+            coords = [round(float(value), fingerprint_decimals) + 0.0
+                      for value in values]
+        except ValueError:
+            ret.append(line)
+            continue
+        ret.append(' '.join([symbol] + [repr(value) for value in coords]))
+    return ret
+
+
+def input_fingerprint(path):
+    """Hash of what determines the results of a qchem input: per job the
+    $rem keywords (sorted, without fingerprint_ignored_rem), the $molecule
+    with rounded coordinates and all other sections in name order.
+    Comments, blank lines, whitespace, case, qsys lines and the file name
+    do not change it.
+    """
+    with open(path, 'rb') as qin:
+        buf = qin.read().lower()
+    stages = []
+    for span in _stage_bounds(buf):
+        stage = QChemInput(path, span=span)
+        _scan_stage(buf, stage)
+        sections = []
+        for name, start, end in stage.sections:
+            if name == 'rem':
+                continue
+            body_start = buf.find(b'\n', start) + 1
+            body_end = buf.rfind(b'\n', 0, end - 1) + 1
+            lines = _section_lines(buf[body_start:body_end])
+            if name == 'molecule':
+                lines = _normalized_molecule(lines)
+            sections.append([name, lines])
+        rem = sorted([key, value] for key, value in stage.rem.items()
+                     if key not in fingerprint_ignored_rem)
+        stages.append({'rem': rem, 'sections': sorted(sections)})
+    return hashlib.sha256(json.dumps(stages).encode()).hexdigest()
+
+
+def _apply_stage(inp: QChemInput, data: JobData):
+    qchem = {}
+    for key, rem_keys in qchem_key_mapping.items():
+        for rem_key in rem_keys:
+            if rem_key in inp.rem:
+                qchem[key] = inp.rem[rem_key]
+
+    if 'mem' in qchem:
+        qchem['mem'] = int(qchem['mem']) * 1.05
 
-    # print(qchem)
-    # qchem_keys = set(qchem.keys())
-    # i = 0
-    for key, value in key_mapping.items():
-        value = set(value)
-        intersec = value.intersection(qchem_keys)
-        if intersec:
-            qs_key = intersec.pop()
-            setattr(data, key, qchem[qs_key])
-
-
-def read_qsys(path, data: JobData):
-    key_mapping = {
-        'time': ['walltime', 'wt', 'time'],
-        'mem': ['memory', 'mem'],
-        'scratch': ['scratch'],
-        'ncpus': ['threads', 'ncpus'],
-    }
     qsys = {}
-    with open(path) as qin:
-        for line in qin:
-            line = line.lower()
-            if 'qsys' in line:
-                line = line.replace("=", " ")
-                splits = line.split('qsys')[-1]
-                splits = splits.split()
-                # for item in ['=', ':']:
-                #     try:
-                #         splits.remove(item)
-                #     except ValueError:
-                #         pass
-
-                if len(splits) == 2:
-                    key, value = splits
-                    qsys[key] = value
-                else:
-                    print('** Warning ** Unusual QSYS line detected ignoring it')
-                    print(line)
-                    print(splits)
+    for qs_key, value in inp.qsys.items():
+        for key, qsys_keys in qsys_key_mapping.items():
+            if qs_key in qsys_keys:
+                qsys[key] = value
+
+    for values in (qchem, qsys):
+        for key, value in values.items():
+            if key == 'ncpus':
+                try:
+                    value = int(value)
+                except ValueError:
+                    print(f'** Warning ** Unusual thread count encountered: {value}')
+                    continue
+            setattr(data, key, value)
+
+
+def apply_input(inp: QChemInput, data: JobData):
+    """Sets the resources of data from the parsed input, qsys directives
+    take precedence over the $rem keywords.
+
+    For multi job inputs the maximum memory, scratch and threads of all
+    stages are requested and the walltimes of the stages are summed up.
 
-    qsys_keys = set(qsys.keys())
-    for key, value in key_mapping.items():
-        value = set(value)
-        intersec = value.intersection(qsys_keys)
-        if intersec:
-            qs_key = intersec.pop()
-            setattr(data, key, qsys[qs_key])
+    """
+    if inp.stageout:
+        data.stageout = data.stageout.with_patterns(inp.stageout)
+    if inp.geometry_from:
+        data.geometry_from = infile_base(
+            workflow_path(inp.path, inp.geometry_from)) + '.out'
+    stages = inp.stages
+    if len(stages) <= 1:
+        _apply_stage(stages[0] if stages else inp, data)
+        return
+
+    mem, scratch, ncpus, time = [], [], [], []
+    for stage in stages:
+        tmp = JobData('', '')
+        _apply_stage(stage, tmp)
+        mem.append(JobData.mem.raw(tmp))
+        scratch.append(JobData.scratch.raw(tmp))
+        time.append(JobData.time.raw(tmp))
+        ncpus.append(tmp.ncpus)
+
+    mem = [x for x in mem if x is not None]
+    scratch = [x for x in scratch if x is not None]
+    time = [x for x in time if x is not None]
+    ncpus = [x for x in ncpus if x is not None]
+    if mem:
+        data.mem = max(mem)
+    if scratch:
+        data.scratch = max(scratch)
+    if time:
+        data.time = sum(time, datetime.timedelta())
+    if ncpus:
+        data.ncpus = max(ncpus)
+
+
+def apply_resources(data: JobData, resources):
+    """Sets resources given by the caller, they take precedence over the
+    input like the command line.
+
+    :resources: dict with JobData attributes (time, mem, scratch, ncpus) or
+        qsys keys (walltime, memory, threads, ...) as keys, numbers are
+        seconds for the walltime and MB for memory and scratch
+
+    """
+    for key, value in resources.items():
+        key = key.lower()
+        for attr, qsys_keys in qsys_key_mapping.items():
+            if key == attr or key in qsys_keys:
+                break
+        else:
+            print(f'** Warning ** unknown resource {key}')
+            continue
+        if attr == 'ncpus':
+            value = int(value)
+        elif attr == 'time' and isinstance(value, (int, float)):
+            value = datetime.timedelta(seconds=value)
+        setattr(data, attr, value)
 
 
 def read_qin(path, data: JobData):
-    """TODO: Docstring for read_qin.
+    """Parses the qchem input at path and sets the resources of data.
 
-    :path: TODO
-    :returns: TODO
+    :path: path to the qchem input file
+    :data: JobData to fill
+    :returns: QChemInput
 
     """
-    read_qchem(path, data)
-    read_qsys(path, data)
+    inp = read_input(path)
+    apply_input(inp, data)
+    return inp
 
 
-def choose_version(version_path):
-    versions = []
-    for f in os.listdir(version_path):
-        if os.path.isfile(f):
-            vscript = os.path.basename(f)
-            print(vscript)
-            versions.append(vscript)
+# used if the config names neither a version directory nor a version script
+default_version_dir = '/lustre/work/ws/ws1/hd_ie450-dreuw_qchem/versions/'
 
-    inp = input(
-        'If you wish to set one of these as default please enter its name?\n')
-    ret = version_path
-    for version in versions:
-        if inp in version:
-            version_path += version
 
-    return ret
+class VersionRegistry:
+    """The qchem version scripts of a directory with their mtimes.
 
+    The listing is cached in ~/.cache/qchem_send_slurm/versions.json and
+    only read again when the mtime of the directory changes, i.e. when
+    scripts were added, removed or renamed. Listing a busy Lustre directory
+    on every call is what made startup slow.
 
-def write_jobscript(path, data: JobData):
-    """TODO: Docstring for write_jobscript.
+    """
 
-    :path: TODO
-    :data: TODO
-    :returns: TODO
+    def __init__(self, directory, aliases=None, refresh=False):
+        self.directory = directory
+        self.aliases = dict(aliases or {})
+        self.scripts = self._load(refresh)
+
+    def _load(self, refresh):
+        try:
+            mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            return {}
+        path = cache_path('versions.json')
+        try:
+            with open(path) as fp:
+                directories = json.load(fp).get('directories', {})
+        except (OSError, ValueError):
+            directories = {}
+        entry = directories.get(self.directory)
+        if not refresh and entry is not None and entry['mtime'] == mtime:
+            return entry['scripts']
+        scripts = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for script in entries:
+                    if script.is_file():
+                        scripts[script.name] = script.stat().st_mtime
+        except OSError:
+            return {}
+        directories[self.directory] = dict(mtime=mtime, scripts=scripts)
+        try:
+            _write_cache(path, directories=directories)
+        except OSError as err:
+            print(f'** Warning ** could not cache the version scripts: {err}')
+        return scripts
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lookup(self, name):
+        """Names of the scripts matching name: an alias, the exact name, the
+        scripts containing name or else the closest names.
+
+        :returns: list of script names, best match first
+
+        """
+        name = self.aliases.get(name, name)
+        if name in self.scripts:
+            return [name]
+        matches = sorted(script for script in self.scripts if name in script)
+        if not matches:
+            matches = difflib.get_close_matches(name, self.scripts, n=3)
+        return matches
+
+    def resolve(self, name):
+        """Path of the version script given as path, alias or (part of a)
+        name, None if there is no unique match."""
+        if os.path.isfile(name):
+            return name
+        alias = self.aliases.get(name)
+        if alias is not None and os.path.isfile(alias):
+            return alias
+        matches = self.lookup(name)
+        if len(matches) == 1:
+            return self.path(matches[0])
+        return None
+
+
+def version_registry(config, refresh=False):
+    """The VersionRegistry of the qchem_version_dir of the config (default
+    the directory of the default version script) with the aliases of the
+    [VERSIONS] section."""
+    directory = None
+    if config.has_option('PATHS', 'qchem_version_dir'):
+        directory = config['PATHS']['qchem_version_dir']
+    elif config.has_option('PATHS', 'qchem_version'):
+        directory = os.path.dirname(config['PATHS']['qchem_version'])
+    aliases = dict(config['VERSIONS']) if config.has_section('VERSIONS') else {}
+    return VersionRegistry(directory or default_version_dir, aliases, refresh)
+
+
+def resolve_version(version, config, interactive=True):
+    """Path of the qchem version script: version (a path, alias or name)
+    or else the default of the config. Only asks if interactive and no
+    script was found, the version directory is not read for paths.
+
+    :returns: path or None
 
     """
-    jspath = os.path.join(os.path.dirname(
+    if version is not None and os.path.isfile(version):
+        return version
+    if version is None and config.has_option('PATHS', 'qchem_version'):
+        default = config['PATHS']['qchem_version']
+        if os.path.isfile(default):
+            return default
+    registry = version_registry(config)
+    if version is not None:
+        path = registry.resolve(version)
+        if path is not None:
+            return path
+        matches = registry.lookup(version)
+        if matches:
+            print(f'** Warning ** qchem version {version} is ambiguous: '
+                  f'{", ".join(matches)}')
+        else:
+            print(f'** Warning ** no qchem version script {version} '
+                  f'in {registry.directory}')
+    return choose_version(registry, interactive)
+
+
+def choose_version(registry, interactive=True):
+    """Asks for one of the version scripts of the registry.
+
+    :returns: path of the chosen script or None
+
+    """
+    if not interactive or not registry.scripts:
+        return None
+    for name in sorted(registry.scripts):
+        print(name)
+    while True:
+        inp = input('Please enter the name of the qchem version to use '
+                    '(empty to abort)\n')
+        if not inp:
+            return None
+        path = registry.resolve(inp)
+        if path is not None:
+            return path
+        print(f'** Warning ** matches: {", ".join(registry.lookup(inp)) or "none"}')
+
+
+def jobscript_path(path):
+    return os.path.join(os.path.dirname(
         path), os.path.basename(path).replace('.in', '.sh'))
-    infile = os.path.join(os.path.dirname(
-        path), os.path.basename(path).replace('.in', ''))
-    print(infile)
-    jobscript = ''
-    jobscript += data.create_header()
-    jobscript += jobscript_main_template
-    jobscript += jobscript_main02_template.format(
-        infile=infile, qchem_version_path=data.qchem_version_path, ncpus=data.ncpus)
-    jobscript += jobscript_foot_template
 
-    with open(jspath, 'w') as js:
-        js.write(jobscript)
 
-    return jspath
+def infile_base(path):
+    """Input path without the .in, the name used for all qchem files."""
+    return os.path.join(os.path.dirname(
+        path), os.path.basename(path).replace('.in', ''))
 
 
-def send_job(path, args, no_send):
-    if no_send:
-        run(f'sbatch {path} {args}', shell=True)
-    else:
-        run(f"echo sbatch {path} {args}", shell=True)
+def job_digest(inp: QChemInput, data: JobData):
+    """Hash of the input content, the resolved resources and the qchem
+    version, identifies a jobscript in the JobIndex."""
+    sha = hashlib.sha256(inp.digest.encode())
+    sha.update(data.create_header().encode())
+    sha.update(f'{data.qchem_version_path}\n{data.ncpus}'.encode())
+    if data.template is not None and data.template.digest is not None:
+        sha.update(data.template.digest.encode())
+    if data.scratch_dir is not None:
+        sha.update(data.scratch_dir.encode())
+    return sha.hexdigest()
 
 
-def cmd_args(argv):
-    config = load_config()
-    parser = argparse.ArgumentParser(description='A qchem jobscript creaion tool intended for the use on the JUSTUS2 bwhp cluster with Slurm.',
-                                     epilog=parser_epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument('-c', '--config', action='store_true',
-                        help="rewrite the config file")
-    # parser_config.add_argument('-p', '--path', help='sets the path for the config file')
-    # parser_jobscript = subparser.add_parser('', help='creates the jobscript')
-    parser.add_argument(
-        'INFILE', nargs='+', help='the qchem input files for which the jobscripts are to be generated.')
-    parser.add_argument('-l', action='append',
-                        help='specify resources for SLURM, will be forwarded to sbatch. use its syntax BUT leave out "--"!')
-    parser.add_argument('--no-send', action='store_false',
-                        help='flag to prevent sending the job to the cluster')
-    parser.add_argument(
-        '--version', help='give name or the path to a qchem version script.')
+def output_complete(path, size=4096):
+    """Whether the qchem output at path ends with the normal termination
+    message. Only the last size bytes are read.
 
-    parser.set_defaults(func=main)
-    args = parser.parse_args(argv)
-    args.func(vars(args), config)
+    :returns: True, False or None if there is no output file
 
+    """
+    try:
+        with open(path, 'rb') as out:
+            out.seek(0, os.SEEK_END)
+            out.seek(max(0, out.tell() - size))
+            return b'Thank you very much for using Q-Chem.' in out.read()
+    except OSError:
+        return None
 
-def main(cmd, config):
-    infiles = cmd['INFILE']
-    sbatch_args = cmd['l']
-    if sbatch_args is not None:
-        sbatch_args = ' '.join(['--' + string for string in sbatch_args])
-    no_send = cmd['no_send']
-    version = cmd['version']
 
-    if cmd['config']:
-        write_config()
+class JobIndex:
+    """Index of the jobs submitted from a directory.
 
-    if version is None:
+    Maps each input (path as given on the command line) to the digest of
+    the job, the jobscript, the slurm job id and the last known status
+    ('submitted', 'completed' or 'failed'). Stored as JSON in
+    the submit directory and only written if something changed.
+    """
+    filename = '.qchem_send_slurm.json'
+
+    def __init__(self, directory='.'):
+        self.path = os.path.join(directory, self.filename)
+        self.changed = False
+        try:
+            with open(self.path) as fp:
+                self.jobs = json.load(fp)
+        except FileNotFoundError:
+            self.jobs = {}
+        except ValueError:
+            print(f'** Warning ** ignoring corrupt job index {self.path}')
+            self.jobs = {}
+
+    @staticmethod
+    def key(path):
+        return os.path.normpath(path)
+
+    def get(self, path):
+        return self.jobs.get(self.key(path))
+
+    def update(self, path, **fields):
+        entry = self.jobs.setdefault(self.key(path), {})
+        for key, value in fields.items():
+            if entry.get(key) != value:
+                entry[key] = value
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.jobs, fp, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+class JobscriptTemplate:
+    """The stages of a jobscript, compiled once: each stage is split at its
+    {field} placeholders so that rendering a job only joins strings.
+    Braces around anything but a known field are left alone for bash.
+
+    :stages: dict stage name -> text, see jobscript_stage_names
+    :sources: dict stage name -> file the stage was read from (or extended
+        with), missing for the builtin stages
+    """
+
+    fields = ('infile', 'jobname', 'qchem_version_path', 'ncpus', 'pre_run',
+              'post_run', 'qchem_args', 'qchem_save', 'live_start',
+              'live_stop', 'stageout', 'restart_hooks', 'scratch_dir',
+              'scratch_need', 'scratch_cleanup', 'metrics')
+
+    def __init__(self, stages, sources=None):
+        self.sources = dict(sources or {})
+        pattern = re.compile('{(' + '|'.join(self.fields) + ')}')
+        # odd items of the split are field names
+        self.stages = {name: pattern.split(stages[name])
+                       for name in jobscript_stage_names}
+        # only templates with site or user stages change the job digests
+        self.digest = None
+        if self.sources:
+            sha = hashlib.sha256()
+            for name in jobscript_stage_names:
+                sha.update(stages[name].encode())
+            self.digest = sha.hexdigest()
+
+    def render(self, fields, **stages):
+        """Jobscript text after the #SBATCH header.
+
+        :fields: dict field -> value, missing fields are left empty
+        :stages: texts replacing stages for this job, e.g. payload of a pack
+
+        """
+        ret = []
+        for name in jobscript_stage_names:
+            if name in stages:
+                ret.append(stages[name])
+                continue
+            parts = self.stages[name]
+            ret.append(parts[0])
+            for i in range(1, len(parts), 2):
+                ret.append(str(fields.get(parts[i], '')))
+                ret.append(parts[i + 1])
+        return ''.join(ret)
+
+
+def template_dirs(config):
+    """Directories searched for jobscript stages, the [TEMPLATES] site
+    directory of the config before ~/.config/qchem_send_slurm/templates."""
+    section = config['TEMPLATES'] if 'TEMPLATES' in config else {}
+    dirs = []
+    if section.get('site'):
+        dirs.append(section['site'])
+    dirs.append(os.path.join(os.path.expanduser('~'), '.config',
+                             'qchem_send_slurm', 'templates'))
+    return tuple(dirs)
+
+
+@lru_cache(maxsize=None)
+def jobscript_template(dirs=()):
+    """The JobscriptTemplate of the builtin stages, replaced by <stage>.sh
+    and extended by <stage>.post.sh of the directories in dirs (later
+    directories win). Read and compiled once per process."""
+    stages = dict(jobscript_stages)
+    sources = {}
+    for directory in dirs:
+        for name in jobscript_stage_names:
+            for suffix in ('.sh', '.post.sh'):
+                path = os.path.join(directory, name + suffix)
+                try:
+                    with open(path) as fp:
+                        text = fp.read()
+                except FileNotFoundError:
+                    continue
+                if suffix == '.sh':
+                    stages[name] = text
+                    sources[name] = [path]
+                else:
+                    stages[name] += text
+                    sources.setdefault(name, ['builtin']).append(path)
+    return JobscriptTemplate(stages, sources)
+
+
+@lru_cache(maxsize=None)
+def _stageout_functions(stageout):
+    return stageout.render()
+
+
+def scratch_fields(data: JobData):
+    """Jobscript fields of the scratch placement of data."""
+    need = data.scratch_need
+    if need is None:
+        need = JobData.scratch.raw(data) or 0
+    return dict(scratch_dir=data.scratch_dir or '$TMPDIR',
+                scratch_need=need * 1024,
+                scratch_cleanup=data.scratch_dir or '')
+
+
+def jobscript_fields(data: JobData, infile):
+    """Fields of the jobscript template for the input infile (path without
+    .in), with the restart hooks if data.restarts is set."""
+    fields = dict(infile=infile, jobname=data.jobname,
+                  qchem_version_path=data.qchem_version_path,
+                  ncpus=data.ncpus or 1, pre_run='', post_run='', qchem_args='',
+                  qchem_save='', stageout=_stageout_functions(data.stageout),
+                  restart_hooks='', metrics='$JOBNAME.$JOBID',
+                  **scratch_fields(data))
+    fields['live_start'], fields['live_stop'] = data.stageout.live_hooks(infile)
+    handoff = ''
+    if data.geometry_from:
+        handoff = jobscript_handoff_pre_run.format(
+            python=sys.executable, script=os.path.abspath(__file__),
+            output=data.geometry_from, infile=infile)
+    fields['pre_run'] = handoff
+    if not data.restarts:
+        return fields
+
+    fields.update(
+        pre_run=handoff + jobscript_restart_pre_run.format(infile=infile),
+        post_run=jobscript_restart_post_run.format(infile=infile),
+        qchem_args='-save ', qchem_save=' "$QCSAVE"',
+        restart_hooks=jobscript_restart_template.format(
+            infile=infile, restarts=data.restarts, python=sys.executable,
+            script=os.path.abspath(__file__)))
+    return fields
+
+
+def write_jobscript(path, data: JobData):
+    """Writes the jobscript for the qchem input at path.
+
+    :path: path to the qchem input
+    :data: resources of the job
+    :returns: path of the jobscript
+
+    """
+    jspath = jobscript_path(path)
+    infile = infile_base(path)
+    print(infile)
+    template = data.template or jobscript_template()
+    jobscript = data.create_header()
+    jobscript += template.render(jobscript_fields(data, infile))
+
+    with open(jspath, 'w') as js:
+        js.write(jobscript)
+
+    return jspath
+
+
+def stage_groups(inp: QChemInput):
+    """Groups the stages of a multi job input into separately submittable
+    jobs. A stage reading molecule or guess from the scratch of its
+    predecessor stays in the same job as the predecessor.
+
+    :returns: list of lists of stages
+
+    """
+    groups = []
+    for stage in inp.stages:
+        if groups and stage.reads_scratch():
+            groups[-1].append(stage)
+        else:
+            groups.append([stage])
+    return groups
+
+
+# directory next to a multi job input holding the inputs of its stage groups,
+# hidden so that --recursive and --glob do not pick them up as inputs
+stage_input_dir = '.stages'
+
+
+def write_stage_inputs(inp: QChemInput):
+    """Writes one input file per stage group of a multi job input into the
+    .stages directory next to it. The qsys lines above the first section
+    of the file request the resources of every job, they are copied into
+    all of them before the qsys lines of the group itself.
+
+    :returns: list of paths
+
+    """
+    with open(inp.path, 'rb') as qin:
+        buf = qin.read()
+
+    first = inp.stages[0]
+    head_end = min((start for _, start, _ in first.sections),
+                   default=first.span[1])
+    head = b''.join(line for line in buf[:head_end].splitlines(keepends=True)
+                    if b'qsys' in line.lower())
+    directory = os.path.join(os.path.dirname(inp.path), stage_input_dir)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory,
+                        os.path.basename(inp.path).replace('.in', ''))
+    ret = []
+    for i, stages in enumerate(stage_groups(inp)):
+        path = f'{base}_part{i}.in'
+        with open(path, 'wb') as qout:
+            if i:
+                qout.write(head)
+            qout.write(b'\n@@@\n'.join(
+                buf[slice(*stage.span)].strip(b'\n') + b'\n' for stage in stages))
+        ret.append(path)
+    return ret
+
+
+def batch_name(kind, paths):
+    """Name of the jobscript and manifest of an array or a pack: submit time
+    and a hash of its inputs. Unique per submission, as the tasks of earlier
+    arrays and packs from the same directory only read their manifest when
+    they start.
+
+    :kind: 'array' or 'pack'
+    :paths: qchem input files of the array or pack
+
+    """
+    sha = hashlib.sha1('\n'.join(paths).encode()).hexdigest()
+    return f'qchem_{kind}_{time.strftime("%Y%m%d-%H%M%S")}_{sha[:8]}'
+
+
+def write_array_jobscript(paths, datas):
+    """Writes one Slurm array jobscript for several inputs sharing the same
+    resources together with the manifest mapping array task ids to inputs.
+
+    :paths: qchem input files, task i runs paths[i]
+    :datas: JobData objects belonging to paths, all with the same array_key()
+    :returns: path of the jobscript
+
+    """
+    data = datas[0]
+    outdir = os.path.dirname(paths[0])
+    jobname = batch_name('array', paths)
+    jspath = os.path.join(outdir, jobname + '.sh')
+    manifest = os.path.abspath(os.path.join(outdir, jobname + '.manifest'))
+
+    with open(manifest, 'w') as mf:
+        for path in paths:
+            infile = os.path.join(os.path.dirname(
+                path), os.path.basename(path).replace('.in', ''))
+            mf.write(infile + '\n')
+
+    template = data.template or jobscript_template()
+    jobscript = data.create_header(jobname=jobname, array=True)
+    jobscript += jobscript_array_template.format(manifest=manifest)
+    fields = jobscript_fields(data, '${INFILE}')
+    # the job index knows array tasks as <array id>_<task>
+    fields['metrics'] = ('$(basename "$INFILE")'
+                         '.${SLURM_ARRAY_JOB_ID}_$SLURM_ARRAY_TASK_ID')
+    jobscript += template.render(fields)
+
+    with open(jspath, 'w') as js:
+        js.write(jobscript)
+
+    return jspath
+
+
+def group_array_jobs(jobs):
+    """Groups jobs with identical resources in a single pass, keeps the
+    order of first appearance.
+
+    :jobs: PreparedJob objects
+    :returns: list of lists of PreparedJob
+
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.data.array_key(), []).append(job)
+    return list(groups.values())
+
+
+def sbatch_options(options):
+    """Joins the -l options of the command line into the sbatch options
+    string, None if there are none."""
+    if not options:
+        return None
+    return ' '.join('--' + option for option in options)
+
+
+def sbatch_command(path, args=None, array=None, dependency=None):
+    """Builds the sbatch --parsable argument list for the jobscript at path.
+
+    :args: further sbatch options as one string
+    :dependency: job id the job has to wait for (afterok)
+
+    """
+    command = ['sbatch', '--parsable']
+    if dependency is not None:
+        command.append(f'--dependency=afterok:{dependency}')
+    if array is not None:
+        command.append(f'--array={array}')
+    if args:
+        command.extend(shlex.split(args))
+    command.append(path)
+    return command
+
+
+def run_sbatch(command):
+    """Runs sbatch without a shell.
+
+    :returns: (job id or None, CompletedProcess)
+
+    """
+    proc = run(command, capture_output=True, text=True)
+    job_id = None
+    if proc.returncode == 0:
+        job_id = proc.stdout.strip().split(';')[0] or None
+    return job_id, proc
+
+
+# sbatch errors of a busy or restarting slurmctld that are worth a retry
+transient_sbatch_errors = (
+    'socket timed out',
+    'unable to contact slurm controller',
+    'temporarily unavailable',
+    'try again',
+    'connection refused',
+    'connection timed out',
+)
+
+
+class Submitter:
+    """Runs sbatch with a limited number of calls in flight and per second,
+    retrying transient failures with exponential backoff.
+
+    Jobs are handed to the thread pool with submit() so that the
+    submission overlaps with the parsing of the following inputs. The
+    outcome of every jobscript is kept in results for the final report.
+    """
+
+    def __init__(self, workers=4, rate=10.0, retries=5, backoff=1.0):
+        """
+        :workers: maximum number of sbatch calls in flight
+        :rate: maximum number of sbatch calls per second, 0 for no limit
+        :retries: retries of a transiently failed call
+        :backoff: delay in s before the first retry, doubled for each one
+
+        """
+        self.workers = max(1, workers)
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        # jobscript -> dict(job_id, attempts, error)
+        self.results = {}
+        self._pool = None
+        self._lock = threading.Lock()
+        self._next_call = 0.0
+
+    def _throttle(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_call - now
+            self._next_call = max(now, self._next_call) + 1 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def sbatch(self, command):
+        """Runs the sbatch command, blocking until it succeeded or failed
+        for good.
+
+        :returns: (job id or None, last CompletedProcess or None)
+
+        """
+        error = None
+        proc = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = min(60, self.backoff * 2**(attempt - 1))
+                time.sleep(delay + random.uniform(0, delay / 2))
+            self._throttle()
+            try:
+                job_id, proc = run_sbatch(command)
+            except OSError as err:
+                error = str(err)
+                break
+            if job_id is not None:
+                error = None
+                break
+            error = proc.stderr.strip() or f'sbatch exited with {proc.returncode}'
+            if not any(msg in error.lower() for msg in transient_sbatch_errors):
+                break
+        with self._lock:
+            self.results[command[-1]] = dict(
+                job_id=None if error else job_id, attempts=attempt + 1,
+                error=error)
+        if error:
+            return None, proc
+        return job_id, proc
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in the thread pool.
+
+        :returns: Future
+
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def error(self, jobscript):
+        result = self.results.get(jobscript)
+        if result is None:
+            return 'not submitted'
+        return result['error']
+
+
+def send_job(path, args, no_send, array=None, dependency=None,
+             submitter=None):
+    """Submits the jobscript at path.
+
+    :dependency: job id the job has to wait for (afterok)
+    :submitter: Submitter used for rate limiting and retries
+    :returns: slurm job id or None if nothing was submitted
+
+    """
+    command = sbatch_command(path, args, array, dependency)
+    if no_send:
+        if submitter is None:
+            job_id, proc = run_sbatch(command)
+        else:
+            job_id, proc = submitter.sbatch(command)
+        if proc is not None:
+            print(proc.stdout, end='')
+            print(proc.stderr, end='', file=sys.stderr)
+        if job_id is None and submitter is not None:
+            print(f'** Warning ** submission of {path} failed: '
+                  f'{submitter.error(path)}')
+        return job_id
+    else:
+        print(*command)
+        return None
+
+
+def last_geometry(path):
+    """Reads the last 'Standard Nuclear Orientation' of a qchem output.
+
+    :returns: list of (symbol, x, y, z) strings, empty if none found
+
+    """
+    with open(path, 'rb') as out:
+        buf = out.read()
+    pos = buf.rfind(b'Standard Nuclear Orientation')
+    if pos < 0:
+        return []
+    atoms = []
+    # skip the title, column header and dashes lines
+    lines = buf[pos:].split(b'\n')[3:]
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) != 5:
+            break
+        atoms.append(tuple(t.decode() for t in tokens[1:]))
+    return atoms
+
+
+def _is_cartesian(lines):
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) != 4:
+            return False
+        try:
+            [float(t) for t in tokens[1:]]
+        except ValueError:
+            return False
+    return True
+
+
+def _section_body(buf, section):
+    """(start, end) offsets of the lines between $name and $end."""
+    _, start, end = section
+    body_start = buf.find(b'\n', start) + 1
+    body_end = buf.rfind(b'\n', start, end - 1) + 1
+    return body_start, body_end
+
+
+def prepare_restart(path):
+    """Rewrites the input at path to continue a job killed at its walltime:
+    the SCF guess is read from the saved scratch files and the geometry of
+    optimizations is replaced by the last one in the output. The original
+    input is kept as <input>.orig, the output is moved to <output>.<n>.
+
+    :returns: True if the input was rewritten
+
+    """
+    out = infile_base(path) + '.out'
+    inp = read_input(path)
+    if len(inp.stages) > 1:
+        print(f'** Warning ** multi job input {path} is restarted unchanged')
+        return False
+
+    with open(path, 'rb') as qin:
+        buf = qin.read()
+    # replace from the end so the offsets stay valid
+    sections = sorted((sec for sec in inp.sections
+                       if sec[0] in ('rem', 'molecule')),
+                      key=lambda sec: sec[1], reverse=True)
+    geometry = []
+    if inp.rem.get('jobtype') in ('opt', 'ts') and os.path.isfile(out):
+        geometry = last_geometry(out)
+
+    for section in sections:
+        start, end = _section_body(buf, section)
+        lines = buf[start:end].splitlines(keepends=True)
+        if section[0] == 'rem':
+            lines = [line for line in lines
+                     if not line.lower().split()[:1] == [b'scf_guess']]
+            lines.append(b'   scf_guess read\n')
+        elif geometry:
+            if len(lines) - 1 != len(geometry) or not _is_cartesian(lines[1:]):
+                print('** Warning ** geometry is not in cartesian coordinates '
+                      'or does not match the output, it is not updated')
+                continue
+            lines = lines[:1] + [
+                f'{sym:<3} {x:>16} {y:>16} {z:>16}\n'.encode()
+                for sym, x, y, z in geometry]
+        buf = buf[:start] + b''.join(lines) + buf[end:]
+
+    if not os.path.isfile(path + '.orig'):
+        os.replace(path, path + '.orig')
+    with open(path, 'wb') as qin:
+        qin.write(buf)
+
+    if os.path.isfile(out):
+        n = 1
+        while os.path.exists(f'{out}.{n}'):
+            n += 1
+        os.replace(out, f'{out}.{n}')
+    print(f'{path} prepared for restart')
+    return True
+
+
+def restart_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py restart',
+        description='rewrite inputs to continue from the saved scratch files and the last geometry, called by the jobscript in --restart mode')
+    parser.add_argument('INFILE', nargs='+')
+    args = parser.parse_args(argv)
+    for path in args.INFILE:
+        prepare_restart(path)
+
+
+def handoff_geometry(output, path):
+    """Replaces the geometry in the first $molecule section of the input
+    at path by the last one in output, the charge and multiplicity line is
+    kept. Used by workflow jobs with 'qsys geometry_from'.
+
+    :returns: True if the input was rewritten
+
+    """
+    geometry = last_geometry(output) if os.path.isfile(output) else []
+    if not geometry:
+        print(f'** Warning ** no geometry found in {output}')
+        return False
+    inp = read_input(path)
+    molecules = [sec for sec in inp.sections if sec[0] == 'molecule']
+    if not molecules or inp.stages[0].molecule_read:
+        print(f'** Warning ** {path} has no $molecule to replace')
+        return False
+    with open(path, 'rb') as qin:
+        buf = qin.read()
+    start, end = _section_body(buf, molecules[0])
+    lines = buf[start:end].splitlines(keepends=True)
+    lines = lines[:1] + [f'{sym:<3} {x:>16} {y:>16} {z:>16}\n'.encode()
+                         for sym, x, y, z in geometry]
+    with open(path, 'wb') as qin:
+        qin.write(buf[:start] + b''.join(lines) + buf[end:])
+    return True
+
+
+def handoff_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py handoff',
+        description='write the last geometry of a qchem output into an input, called by the jobscripts of workflow jobs with qsys geometry_from')
+    parser.add_argument('OUTPUT')
+    parser.add_argument('INFILE')
+    args = parser.parse_args(argv)
+    if not handoff_geometry(args.OUTPUT, args.INFILE):
+        sys.exit(1)
+
+
+def read_metrics(paths):
+    """Reads the JSON lines written by the jobscripts, broken lines (e.g. of
+    a job killed while writing) are skipped."""
+    records = []
+    for path in paths:
+        with open(path) as fp:
+            for line in fp:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+
+def job_metrics(directory, path, job_id):
+    """Metrics records of the job of the input at path with its job id from
+    the job index, written to <input>.<job id>.metrics.jsonl in the submit
+    directory, also by array tasks (<array id>_<task>) and packs."""
+    name = os.path.basename(infile_base(path))
+    return read_metrics(glob.glob(os.path.join(
+        glob.escape(directory), f'{glob.escape(name)}.{job_id}.metrics.jsonl')))
+
+
+def aggregate_metrics(records):
+    """Sums up the metrics per phase.
+
+    :returns: dict phase -> dict with count, total and max duration (s),
+        bytes and for qchem the exit codes and the peak scratch usage
+
+    """
+    phases = {}
+    for record in records:
+        phase = phases.setdefault(record.get('phase'), {
+            'count': 0, 'total': 0.0, 'max': 0.0, 'bytes': 0,
+            'exit_codes': {}, 'peak_scratch_bytes': 0})
+        phase['count'] += 1
+        if 'start' in record and 'end' in record:
+            duration = record['end'] - record['start']
+            phase['total'] += duration
+            phase['max'] = max(phase['max'], duration)
+        phase['bytes'] += record.get('bytes', 0)
+        if 'exit_code' in record:
+            code = record['exit_code']
+            phase['exit_codes'][code] = phase['exit_codes'].get(code, 0) + 1
+        phase['peak_scratch_bytes'] = max(phase['peak_scratch_bytes'],
+                                          record.get('peak_scratch_bytes', 0))
+    return phases
+
+
+def stats_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py stats',
+        description='aggregate the per-phase metrics written by the jobscripts (<jobname>.<jobid>.metrics.jsonl)')
+    parser.add_argument('DIR', nargs='*', default=['.'],
+                        help='directories searched recursively for metrics files (default .)')
+    args = parser.parse_args(argv)
+
+    paths = []
+    for directory in args.DIR:
+        paths.extend(find_inputs(directory, '*.metrics.jsonl'))
+    records = read_metrics(paths)
+    if not records:
+        print('no metrics found')
+        return
+    phases = aggregate_metrics(records)
+
+    print(f'{len(paths)} jobs\n')
+    print(f'{"phase":<20}{"count":>8}{"total [h]":>12}{"mean [s]":>12}'
+          f'{"max [s]":>12}{"GB":>10}{"MB/s":>10}')
+    order = ['print_info', 'stage_in', 'payload_stage_in', 'qchem',
+             'payload_stage_out', 'stage_out', 'payload', 'handle_error']
+    for name in order + sorted(set(phases) - set(order), key=str):
+        if name not in phases:
+            continue
+        phase = phases[name]
+        rate = ''
+        if phase['bytes'] and phase['total']:
+            rate = f'{phase["bytes"] / phase["total"] / 1e6:.1f}'
+        print(f'{name:<20}{phase["count"]:>8}{phase["total"] / 3600:>12.2f}'
+              f'{phase["total"] / phase["count"]:>12.1f}{phase["max"]:>12.1f}'
+              f'{phase["bytes"] / 1e9:>10.2f}{rate:>10}')
+
+    staging = sum(phases[name]['total'] for name in
+                  ('stage_in', 'payload_stage_in', 'payload_stage_out',
+                   'stage_out') if name in phases)
+    compute = phases.get('qchem', {}).get('total', 0.0)
+    if staging + compute:
+        print(f'\nstaging {100 * staging / (staging + compute):.1f} %, '
+              f'qchem {100 * compute / (staging + compute):.1f} % of the time')
+    if 'qchem' in phases:
+        codes = ', '.join(f'{code}: {n}' for code, n in
+                          sorted(phases['qchem']['exit_codes'].items()))
+        print(f'qchem exit codes: {codes}')
+        print(f'largest scratch usage: '
+              f'{phases["qchem"]["peak_scratch_bytes"] / 1e9:.2f} GB')
+
+
+def history_path(config=None):
+    """Location of the resource history database, can be set with path in
+    the [HISTORY] section of the config."""
+    if config is not None and config.has_option('HISTORY', 'path'):
+        return os.path.expanduser(config['HISTORY']['path'])
+    return os.path.join(os.path.expanduser('~'), '.cache',
+                        'qchem_send_slurm', 'history.json')
+
+
+def _memory_mb(string):
+    """Converts sacct memory values like 2048K or 1.5G to MB."""
+    units = {'k': 1 / 1024, 'm': 1, 'g': 1024, 't': 1024 * 1024}
+    string = string.strip().lower()
+    if not string:
+        return None
+    try:
+        if string[-1] in units:
+            return float(string[:-1]) * units[string[-1]]
+        return float(string) / 1024 / 1024
+    except ValueError:
+        return None
+
+
+def _echoed_input(record, path, buf):
+    """Adds method, basis, atoms and threads of the input echoed into a
+    qchem output (lowercase bytes) to record."""
+    inp = QChemInput(path, span=(0, len(buf)))
+    _scan_stage(buf, inp)
+    record['method'] = inp.method
+    record['basis'] = inp.basis
+    record['natoms'] = inp.natoms
+    threads = inp.qsys.get('threads', inp.qsys.get(
+        'ncpus', inp.rem.get('threads', '1')))
+    record['threads'] = int(threads) if threads.isdigit() else 1
+
+
+def read_output(path):
+    """Extracts the features and the used resources of a finished qchem
+    output: method, basis, number of basis functions, atoms and threads
+    (from the echoed input of the first job) and the wall time of the
+    last job. The output is read line by line, only the echoed input is
+    kept in memory.
+
+    :returns: dict or None if the output did not finish normally
+
+    """
+    if output_complete(path) is not True:
+        return None
+
+    record = {'output': os.path.abspath(path),
+              'mtime': os.path.getmtime(path)}
+    with open(path, 'rb') as out:
+        for line in out:
+            if b'User input:' in line and 'method' not in record:
+                # the echoed input is framed by lines of dashes
+                next(out, None)
+                echo = []
+                for line in out:
+                    if line.startswith(b'-----'):
+                        break
+                    echo.append(line)
+                _echoed_input(record, path, b''.join(echo).lower())
+            elif b'basis functions' in line and 'nbasis' not in record:
+                words = line[:line.find(b'basis functions')].split()
+                if words and words[-1].isdigit():
+                    record['nbasis'] = int(words[-1])
+            elif b'Total job time:' in line:
+                wall = line.split(b'Total job time:')[1].split(b's(wall)')[0]
+                try:
+                    record['wall'] = float(wall)
+                except ValueError:
+                    pass
+    return record
+
+
+def _slurm_log_scratch(path):
+    """Scratch usage in MB from the du total printed by stage_out into the
+    slurm log (<jobname>.o<jobid>) next to the output, None if unknown."""
+    log_path = slurm_log_path(path)
+    if log_path is None:
+        return None
+    with open(log_path, errors='replace') as log:
+        totals = [line.split()[0] for line in log
+                  if line.strip().endswith('total')]
+    return _memory_mb(totals[-1]) if totals else None
+
+
+# job ids per sacct call, linux limits a single argument to 128 KiB
+# (MAX_ARG_STRLEN), about 10k array task ids
+sacct_chunk_size = 1000
+
+
+def run_sacct(options, job_ids):
+    """Runs sacct --noheader --parsable2 with options for the job ids, in
+    calls of at most sacct_chunk_size ids.
+
+    :returns: the output of all calls, None if sacct is not available or
+        failed
+
+    """
+    job_ids = list(job_ids)
+    output = []
+    for i in range(0, len(job_ids), sacct_chunk_size):
+        chunk = ','.join(job_ids[i:i + sacct_chunk_size])
+        try:
+            proc = run(['sacct', '--noheader', '--parsable2', *options,
+                        '-j', chunk], capture_output=True, text=True)
+        except FileNotFoundError:
+            return None
+        except OSError as error:
+            print(f'** Warning ** sacct failed: {error}')
+            return None
+        if proc.returncode != 0:
+            print(f'** Warning ** sacct failed: {proc.stderr.strip()}')
+            return None
+        output.append(proc.stdout)
+    return ''.join(output)
+
+
+def sacct_max_rss(job_ids):
+    """MaxRSS in MB of the given jobs from sacct, see run_sacct.
+
+    :returns: dict job id -> MB, empty if sacct is not available
+
+    """
+    job_ids = [str(job_id) for job_id in job_ids if job_id]
+    output = run_sacct(['--format=JobID,MaxRSS'], job_ids) if job_ids else None
+    ret = {}
+    for line in (output or '').splitlines():
+        job_id, _, rss = line.partition('|')
+        # the steps (<id>.batch, <id>.0) carry the MaxRSS
+        job_id = job_id.split('.')[0]
+        rss = _memory_mb(rss)
+        if rss is not None:
+            ret[job_id] = max(ret.get(job_id, 0), rss)
+    return ret
+
+
+class ResourceHistory:
+    """Observed resource usage of finished qchem jobs.
+
+    Stored as JSON, one record per output with method, basis, natoms,
+    nbasis, threads, wall (s), mem (MB MaxRSS) and scratch (MB).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as fp:
+                self.records = json.load(fp)
+        except FileNotFoundError:
+            self.records = {}
+        except ValueError:
+            print(f'** Warning ** ignoring corrupt history {path}')
+            self.records = {}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.records, fp)
+        os.replace(tmp, self.path)
+
+    def index(self, directories):
+        """Adds the finished outputs below directories, outputs which did not
+        change since the last indexing are skipped.
+
+        :returns: number of new or updated records
+
+        """
+        job_ids = {}
+        outputs = []
+        for directory in directories:
+            index = JobIndex(directory)
+            for key, entry in index.jobs.items():
+                out = os.path.abspath(os.path.join(
+                    directory, infile_base(key) + '.out'))
+                job_ids[out] = str(entry.get('job_id') or '')
+            outputs.extend(find_inputs(directory, '*.out'))
+
+        new = []
+        for path in outputs:
+            key = os.path.abspath(path)
+            old = self.records.get(key)
+            if old is not None and old.get('mtime') == os.path.getmtime(path):
+                continue
+            record = read_output(path)
+            if record is None:
+                continue
+            scratch = _slurm_log_scratch(path)
+            if scratch is not None:
+                record['scratch'] = scratch
+            self.records[key] = record
+            new.append(key)
+
+        rss = sacct_max_rss({job_ids.get(key) for key in new})
+        for key in new:
+            job_id = job_ids.get(key)
+            if job_id in rss:
+                self.records[key]['mem'] = rss[job_id]
+        return len(new)
+
+    def model(self):
+        """Compact form of the records used for predictions:
+        (method, basis) -> list of (natoms, core seconds, mem, scratch).
+        The wall time is kept as core seconds (wall time times threads) so
+        that jobs run with different thread counts can be compared."""
+        ret = {}
+        for record in self.records.values():
+            if not record.get('natoms'):
+                continue
+            key = (record.get('method', ''), record.get('basis', ''))
+            wall = record.get('wall')
+            if wall is not None:
+                wall *= record.get('threads') or 1
+            ret.setdefault(key, []).append(
+                (record['natoms'], wall, record.get('mem'),
+                 record.get('scratch')))
+        return ret
+
+
+def _fit_power_law(points, natoms, default_slope):
+    """Fits log(y) = a + b log(natoms) to the points and evaluates it at
+    natoms. With a single distinct atom count default_slope is used."""
+    points = [(n, y) for n, y in points if y]
+    if not points:
+        return None
+    xs = [math.log(n) for n, _ in points]
+    ys = [math.log(y) for _, y in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var = sum((x - mean_x) ** 2 for x in xs)
+    if var == 0:
+        slope = default_slope
+    else:
+        slope = sum((x - mean_x) * (y - mean_y)
+                    for x, y in zip(xs, ys)) / var
+        slope = min(max(slope, 0.0), 4.0)
+    return math.exp(mean_y + slope * (math.log(natoms) - mean_x))
+
+
+def predict_resources(inp: QChemInput, model, margin=1.3, threads=1):
+    """Predicts walltime (s), memory (MB) and scratch (MB) of an input from
+    jobs with the same method and basis in the history model.
+
+    The walltime is the predicted core seconds divided by threads. This
+    assumes perfect scaling, which is on the safe side for fewer threads
+    than the recorded jobs used, the margin covers the other way.
+
+    :threads: thread count of the job
+    :returns: dict with the predicted values, empty if there is no history
+
+    """
+    points = model.get((inp.method, inp.basis))
+    if not points or not inp.natoms:
+        return {}
+    ret = {}
+    # assumed scaling with the system size if there is only one size known
+    slopes = {'wall': 3.0, 'mem': 2.0, 'scratch': 2.0}
+    for i, key in enumerate(('wall', 'mem', 'scratch'), start=1):
+        value = _fit_power_law([(p[0], p[i]) for p in points], inp.natoms,
+                               slopes[key])
+        if value is not None:
+            ret[key] = value * margin
+    if 'wall' in ret:
+        ret['wall'] /= threads
+    return ret
+
+
+def apply_defaults(inp: QChemInput, data: JobData, config):
+    """Fills the resources the input does not set from the
+    [DEFAULTS <method>/<basis>] section written by the report subcommand."""
+    name = f'DEFAULTS {inp.method}/{inp.basis}'
+    if name not in config:
+        return
+    section = config[name]
+    if data.time is None and 'walltime' in section:
+        data.time = section['walltime']
+    if data.mem is None and 'mem' in section:
+        data.mem = section['mem']
+    if data.scratch is None and 'scratch' in section:
+        data.scratch = section['scratch']
+
+
+def fill_missing_resources(inp: QChemInput, data: JobData, model,
+                           margin=1.3, tuned=None):
+    """Sets walltime, memory and scratch of data from the history and the
+    thread count from the autotune results if the input does not specify
+    them.
+
+    :tuned: autotune results per method/basis, see autotune_classes
+
+    """
+    entry = (tuned or {}).get(f'{inp.method}/{inp.basis}')
+    if data.ncpus is None and entry:
+        data.ncpus = entry['threads']
+        print(f'auto resources: {data.ncpus} threads')
+    predicted = predict_resources(inp, model, margin, data.ncpus or 1)
+    if not predicted:
+        print(f'** Warning ** no resource history for {inp.method}/{inp.basis}')
+        return
+    if data.time is None and 'wall' in predicted:
+        # rounded up to 5 minutes
+        minutes = 5 * ceil(predicted['wall'] / 300)
+        data.time = datetime.timedelta(minutes=minutes)
+        print(f'auto resources: walltime {data.time}')
+    if data.mem is None and 'mem' in predicted:
+        data.mem = 100 * ceil(predicted['mem'] / 100)
+        print(f'auto resources: memory {data.mem}')
+    if data.scratch is None and 'scratch' in predicted:
+        data.scratch = 1024 * ceil(predicted['scratch'] / 1024)
+        print(f'auto resources: scratch {data.scratch}G')
+
+
+def history_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py history',
+        description='index finished qchem outputs into the resource history used by --auto-resources')
+    parser.add_argument('DIR', nargs='+',
+                        help='directories searched recursively for .out files')
+    args = parser.parse_args(argv)
+    history = ResourceHistory(history_path(config))
+    n = history.index(args.DIR)
+    history.save()
+    print(f'{n} outputs indexed, {len(history.records)} records in {history.path}')
+
+
+def cache_path(name):
+    return os.path.join(os.path.expanduser('~'), '.cache', 'qchem_send_slurm',
+                        name)
+
+
+def _write_cache(path, **data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(dict(time=time.time(), **data), fp)
+    os.replace(tmp, path)
+
+
+class ResultCache:
+    """Shared index input fingerprint -> finished output.
+
+    Every entry is its own json file <directory>/<fp[:2]>/<fp>.json written
+    by an atomic rename, so several users and campaigns can share the
+    directory without locking. An entry points at the output (and fchk) of
+    the input computed first, it is only used while that output exists and
+    finished normally.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, fingerprint):
+        return os.path.join(self.directory, fingerprint[:2],
+                            fingerprint + '.json')
+
+    def get(self, fingerprint):
+        """The entry of fingerprint, None if there is none or its output
+        is gone or unfinished."""
         try:
-            version = config['PATHS']['qchem_version']
-            if not os.path.isfile(version):
-                raise KeyError
-        except KeyError:
-            version = choose_version(config['PATHS']['qchem_version_path'])
-
-    for fn in infiles:
-        jobname = os.path.basename(fn).replace('.in', '')
-        mail_user = config['MAIL']['mail']
-        mail_type = config['MAIL']['mail-type']
-        jd = JobData(
-            mail=mail_user,
-            mail_type=mail_type,
-            qchem_version_path=version,
-        )
-        jd.jobname = jobname
-
-        read_qin(fn, jd)
-        jd.check_data()
-        jspath = write_jobscript(fn, jd)
-
-        send_job(jspath, sbatch_args, no_send)
+            with open(self.path(fingerprint)) as fp:
+                entry = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if output_complete(entry['output']) is not True:
+            return None
+        return entry
+
+    def add(self, fingerprint, path):
+        """Adds the finished output of the input at path unless the
+        fingerprint already has a usable entry.
+
+        :returns: True if an entry was written
+
+        """
+        if self.get(fingerprint) is not None:
+            return False
+        # an output reused from the cache is a link to the original one
+        output = os.path.realpath(infile_base(path) + '.out')
+        record = read_output(output)
+        if record is None:
+            return False
+        entry = dict(input=os.path.abspath(path), output=output,
+                     wall=record.get('wall'),
+                     threads=record.get('threads', 1))
+        fchk = os.path.realpath(infile_base(path) + '.in.fchk')
+        if os.path.isfile(fchk):
+            entry['fchk'] = fchk
+        _write_cache(self.path(fingerprint), **entry)
+        return True
+
+
+def result_cache(config):
+    """The ResultCache of the [CACHE] section (dir, default
+    ~/.cache/qchem_send_slurm/results) and how hits are reused (reuse:
+    symlink, copy or off).
+
+    :returns: (ResultCache, reuse), (None, 'off') without a [CACHE] section
+
+    """
+    if 'CACHE' not in config:
+        return None, 'off'
+    section = config['CACHE']
+    directory = os.path.expanduser(section.get('dir', '') or
+                                   cache_path('results'))
+    reuse = section.get('reuse', 'symlink')
+    if reuse not in ('symlink', 'copy', 'off'):
+        print(f'** Warning ** unknown reuse mode {reuse}, using symlink')
+        reuse = 'symlink'
+    return ResultCache(directory), reuse
+
+
+def reuse_result(path, entry, mode='symlink'):
+    """Links or copies the output and fchk of a cache entry next to the
+    input at path. An existing (unfinished) output is kept as .orig."""
+    base = infile_base(path)
+    for key, suffix in (('output', '.out'), ('fchk', '.in.fchk')):
+        source = entry.get(key)
+        if not source or not os.path.isfile(source):
+            continue
+        target = base + suffix
+        if os.path.lexists(target):
+            os.replace(target, target + '.orig')
+        if mode == 'copy':
+            shutil.copy2(source, target)
+        else:
+            os.symlink(source, target)
+
+
+def saved_core_hours(entry, ncpus=None):
+    """Core hours the job of a reused entry would have taken."""
+    return (entry.get('wall') or 0) * (ncpus or entry.get('threads') or 1) / 3600
+
+
+def squeue_snapshot(max_age=30):
+    """States of the jobs of the user from a single squeue call, array
+    tasks counted one by one as MaxSubmitJobs does. The result is cached
+    in ~/.cache/qchem_send_slurm/squeue.json for max_age seconds so that
+    frequent polls share one query.
+
+    :returns: dict job id -> state, None if squeue failed
+
+    """
+    path = cache_path('squeue.json')
+    try:
+        with open(path) as fp:
+            cache = json.load(fp)
+        if time.time() - cache['time'] < max_age:
+            return cache['jobs']
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        proc = run(['squeue', '--noheader', '--array',
+                    f'--user={getpass.getuser()}', '--format=%i|%T'],
+                   capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    if proc.returncode != 0:
+        print(f'** Warning ** squeue failed: {proc.stderr.strip()}')
+        return None
+    jobs = {}
+    for line in proc.stdout.splitlines():
+        job_id, _, state = line.strip().partition('|')
+        if job_id:
+            jobs[job_id] = state
+    _write_cache(path, jobs=jobs)
+    return jobs
+
+
+def invalidate_squeue_snapshot():
+    try:
+        os.remove(cache_path('squeue.json'))
+    except FileNotFoundError:
+        pass
+
+
+class Feeder:
+    """Local queue of rendered jobscripts waiting for room in the slurm
+    queue, used by --feed.
+
+    Stored as JSON in the submit directory next to the job index so that
+    the feed subcommand can resume it after a logout. Holds the watermark,
+    the sbatch options, the waiting jobs (input, jobscript, digest) and
+    the jobs sbatch rejected for good.
+    """
+    filename = '.qchem_send_slurm.feed.json'
+
+    def __init__(self, directory='.'):
+        self.path = os.path.join(directory, self.filename)
+        self.watermark = 0
+        self.sbatch_args = None
+        self.jobs = []
+        self.failed = []
+        try:
+            with open(self.path) as fp:
+                state = json.load(fp)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            print(f'** Warning ** ignoring corrupt feed state {self.path}')
+            return
+        self.watermark = state.get('watermark', 0)
+        self.sbatch_args = state.get('sbatch_args')
+        self.jobs = state.get('jobs', [])
+        self.failed = state.get('failed', [])
+
+    def add(self, job):
+        key = JobIndex.key(job.path)
+        self.jobs = [entry for entry in self.jobs if entry['input'] != key]
+        self.jobs.append(dict(input=key, jobscript=job.jobscript,
+                              digest=job.digest))
+
+    def save(self):
+        if not (self.jobs or self.failed):
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(dict(watermark=self.watermark,
+                           sbatch_args=self.sbatch_args, jobs=self.jobs,
+                           failed=self.failed), fp, indent=1)
+        os.replace(tmp, self.path)
+
+    def top_up(self, submitter: Submitter, index: JobIndex, max_age=30):
+        """Submits waiting jobs until the user has watermark jobs in the
+        slurm queue.
+
+        :returns: number of submitted jobs, None if squeue failed
+
+        """
+        queued = squeue_snapshot(max_age)
+        if queued is None:
+            return None
+        batch = self.jobs[:max(0, self.watermark - len(queued))]
+        if not batch:
+            return 0
+        futures = [submitter.submit(
+            submitter.sbatch, sbatch_command(entry['jobscript'],
+                                             self.sbatch_args))
+            for entry in batch]
+        now = time.time()
+        n_submitted = 0
+        for entry, future in zip(batch, futures):
+            job_id = future.result()[0]
+            if job_id is not None:
+                n_submitted += 1
+                index.update(entry['input'], digest=entry['digest'],
+                             job_id=job_id, jobscript=entry['jobscript'],
+                             status='submitted', submitted_at=now,
+                             sbatch_args=self.sbatch_args)
+                self.jobs.remove(entry)
+                continue
+            error = submitter.error(entry['jobscript'])
+            if not any(msg in error.lower() for msg in transient_sbatch_errors):
+                # e.g. an invalid account, it would fail every round
+                print(f'** Warning ** dropping {entry["input"]}: {error}')
+                self.jobs.remove(entry)
+                self.failed.append(dict(entry, error=error))
+        # the snapshot does not know the new jobs yet
+        invalidate_squeue_snapshot()
+        return n_submitted
+
+
+def feed(feeder: Feeder, submitter: Submitter, index: JobIndex, interval=60,
+         once=False):
+    """Tops up the slurm queue every interval seconds until all jobs of
+    the feeder are submitted, the state is saved after every round."""
+    while feeder.jobs:
+        n_submitted = feeder.top_up(submitter, index, max_age=interval / 2)
+        feeder.save()
+        index.save()
+        stamp = datetime.datetime.now().strftime('%H:%M:%S')
+        if n_submitted is None:
+            print(f'{stamp} squeue not available, retrying', flush=True)
+        elif n_submitted:
+            print(f'{stamp} submitted {n_submitted}, '
+                  f'{len(feeder.jobs)} waiting', flush=True)
+        if once or not feeder.jobs:
+            break
+        time.sleep(interval)
+    submitter.shutdown()
+    if feeder.failed:
+        print(f'{len(feeder.failed)} jobs were rejected by sbatch, '
+              f'see {feeder.path}')
+
+
+def feed_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py feed',
+        description=f'resume feeding the jobs queued with --feed in the current directory ({Feeder.filename}) to slurm')
+    parser.add_argument('--watermark', type=int, default=None,
+                        help='maximum number of own jobs in the slurm queue (default: the one given to --feed)')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='seconds between two squeue polls (default 60)')
+    parser.add_argument('--once', action='store_true',
+                        help='top up the queue once and exit, e.g. from cron')
+    args = parser.parse_args(argv)
+
+    feeder = Feeder()
+    if not feeder.jobs:
+        print('no jobs waiting')
+        return
+    if args.watermark is not None:
+        feeder.watermark = args.watermark
+    print(f'{len(feeder.jobs)} jobs waiting, '
+          f'keeping {feeder.watermark} jobs in the queue')
+    feed(feeder, Submitter(), JobIndex(), interval=args.interval,
+         once=args.once)
+
+
+# slurm states of jobs that ended without a usable result
+failed_states = ('FAILED', 'TIMEOUT', 'OUT_OF_MEMORY', 'NODE_FAIL',
+                 'CANCELLED', 'BOOT_FAIL', 'DEADLINE', 'PREEMPTED')
+
+
+def sacct_snapshot(job_ids, ttl=60):
+    """States of the given jobs from sacct (see run_sacct), cached in
+    ~/.cache/qchem_send_slurm/sacct.json for ttl seconds. Jobs sacct does
+    not know (yet) get an empty state.
+
+    :returns: dict job id -> state, None if sacct is not available
+
+    """
+    job_ids = sorted({str(job_id) for job_id in job_ids if job_id})
+    path = cache_path('sacct.json')
+    try:
+        with open(path) as fp:
+            cache = json.load(fp)
+        if (time.time() - cache['time'] < ttl
+                and all(job_id in cache['jobs'] for job_id in job_ids)):
+            return cache['jobs']
+    except (OSError, ValueError, KeyError):
+        pass
+    if not job_ids:
+        return {}
+    output = run_sacct(['--allocations', '--format=JobID,State'], job_ids)
+    if output is None:
+        return None
+    jobs = dict.fromkeys(job_ids, '')
+    for line in output.splitlines():
+        job_id, _, state = line.strip().partition('|')
+        # 'CANCELLED by 1234'
+        jobs[job_id] = state.split(' ')[0]
+    _write_cache(path, jobs=jobs)
+    return jobs
+
+
+def job_states(index: JobIndex, ttl=60):
+    """Slurm state of every job in the index, from sacct and one
+    squeue call for the jobs sacct does not know, e.g. pending array tasks
+    or clusters without accounting.
+
+    :returns: dict input -> state, empty for jobs slurm has forgotten
+
+    """
+    job_ids = {path: entry.get('job_id') for path, entry in index.jobs.items()}
+    states = sacct_snapshot(job_ids.values(), ttl) or {}
+    if not all(states.get(job_id) for job_id in job_ids.values() if job_id):
+        queued = squeue_snapshot(ttl) or {}
+        states = dict(states)
+        for job_id in job_ids.values():
+            if job_id and not states.get(job_id) and job_id in queued:
+                states[job_id] = queued[job_id]
+    return {path: states.get(job_id, '') if job_id else ''
+            for path, job_id in job_ids.items()}
+
+
+def settle_states(index: JobIndex, directory='.', ttl=60):
+    """Final state of every job in the index. For jobs slurm reports as
+    completed or has forgotten the end of the qchem output decides. The
+    status of finished jobs is updated in the index.
+
+    :returns: dict input -> state
+
+    """
+    ret = {}
+    for path, state in job_states(index, ttl).items():
+        entry = index.get(path)
+        if not state or state == 'COMPLETED':
+            output = os.path.join(directory, infile_base(path) + '.out')
+            finished = output_complete(output)
+            if finished:
+                state = 'COMPLETED'
+            elif finished is False or state == 'COMPLETED':
+                state = 'FAILED'
+            elif entry.get('status') in ('completed', 'failed'):
+                state = entry['status'].upper()
+            else:
+                state = 'UNKNOWN'
+        if state == 'COMPLETED':
+            index.update(path, status='completed')
+        elif state in failed_states:
+            index.update(path, status='failed')
+        ret[path] = state
+    return ret
+
+
+def status_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py status',
+        description=f'show the state of the jobs submitted from a directory, read from its job index ({JobIndex.filename})')
+    parser.add_argument('DIR', nargs='?', default='.',
+                        help='submit directory (default .)')
+    parser.add_argument('--ttl', type=float, default=None,
+                        help='seconds a sacct/squeue snapshot is reused (default 60 or ttl in the [STATUS] section of the config)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='ignore cached snapshots')
+    args = parser.parse_args(argv)
+
+    ttl = args.ttl
+    if ttl is None:
+        ttl = 60
+        if config.has_option('STATUS', 'ttl'):
+            ttl = config['STATUS'].getfloat('ttl')
+    if args.refresh:
+        ttl = 0
+
+    index = JobIndex(args.DIR)
+    if not index.jobs:
+        print(f'no jobs in {index.path}')
+        return
+    counts = {}
+    failed = []
+    for path, state in sorted(settle_states(index, args.DIR, ttl).items()):
+        if state in failed_states:
+            failed.append((path, index.get(path).get('job_id'), state))
+        counts[state] = counts.get(state, 0) + 1
+    index.save()
+
+    print(f'{len(index.jobs)} jobs in {index.path}\n')
+    for state, n in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f'{state:<16}{n:>8}')
+    if failed:
+        print('\nfailed inputs:')
+        for path, job_id, state in failed:
+            print(f'  {path:<40}{job_id or "":>14}  {state}')
+
+
+# failure classes of triage with the messages identifying them in the tail
+# of the qchem output or the slurm log, checked in this order
+failure_patterns = {
+    'scratch': ('no space left on device', 'disk quota exceeded'),
+    'memory': ('out of memory', 'oom-kill', 'oom_kill', 'bad_alloc',
+               'cannot allocate memory', 'insufficient memory'),
+    'walltime': ('due to time limit',),
+    'scf': ('scf failed to converge',),
+}
+
+# resource scaled when resubmitting a failure class, with the [TRIAGE]
+# options of its factor (and default) and of its upper limit
+failure_resources = {
+    'memory': ('mem', 'mem_factor', 1.5, 'max_mem'),
+    'scratch': ('scratch', 'scratch_factor', 2.0, 'max_scratch'),
+    'walltime': ('time', 'time_factor', 2.0, 'max_walltime'),
+}
+
+
+def slurm_log_path(path, job_id=None):
+    """Slurm log (<jobname>.o<jobid>) of the input or output at path, the
+    one of job_id if it exists, otherwise the latest one."""
+    base = os.path.basename(infile_base(path.replace('.out', '.in')))
+    directory = os.path.dirname(path)
+    if job_id:
+        log = os.path.join(directory, f'{base}.o{job_id}')
+        if os.path.isfile(log):
+            return log
+    logs = sorted(glob.glob(os.path.join(
+        directory, glob.escape(base) + '.o[0-9]*')), key=os.path.getmtime)
+    return logs[-1] if logs else None
+
+
+def _tail(path, size=16384):
+    try:
+        with open(path, 'rb') as fp:
+            fp.seek(0, os.SEEK_END)
+            fp.seek(max(0, fp.tell() - size))
+            return fp.read().decode(errors='replace').lower()
+    except (OSError, TypeError):
+        return ''
+
+
+def classify_failure(path, job_id=None, state=''):
+    """Failure class of the job of the input at path from the slurm state
+    and the tails of its output and slurm log.
+
+    :returns: 'memory', 'scratch', 'walltime', 'scf' or 'crash'
+
+    """
+    if state == 'OUT_OF_MEMORY':
+        return 'memory'
+    if state == 'TIMEOUT':
+        return 'walltime'
+    text = (_tail(infile_base(path) + '.out')
+            + _tail(slurm_log_path(path, job_id)))
+    for name, patterns in failure_patterns.items():
+        if any(pattern in text for pattern in patterns):
+            return name
+    return 'crash'
+
+
+def scaled_resources(job, entry, failure, config):
+    """Resources for the resubmission of a job that failed with failure,
+    scaled from those of its last submission up to the limit in the
+    [TRIAGE] section (max_mem, max_scratch, max_walltime).
+
+    :returns: dict for apply_resources, None if nothing can be scaled, i.e.
+        the resource is not requested or already at its limit
+
+    """
+    resources = dict(entry.get('scaled', {}))
+    if failure not in failure_resources:
+        return resources
+    key, option, factor, limit_option = failure_resources[failure]
+    if config.has_option('TRIAGE', option):
+        factor = config['TRIAGE'].getfloat(option)
+    value = resources.get(key)
+    if value is None:
+        value = getattr(JobData, key).raw(job.data)
+        if value is None:
+            return None
+        if key == 'time':
+            value = value.total_seconds()
+    scaled = int(ceil(value * factor))
+    if config.has_option('TRIAGE', limit_option):
+        limit = getattr(JobData, key).parse(config['TRIAGE'][limit_option])
+        if key == 'time':
+            limit = limit.total_seconds()
+        if value >= limit:
+            return None
+        scaled = min(scaled, int(limit))
+    resources[key] = scaled
+    return resources
+
+
+def triage_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py triage',
+        description='classify the failed jobs of the current directory (out of memory, scratch full, walltime, SCF not converged, crash) and optionally resubmit them with scaled resources')
+    parser.add_argument('--resubmit', action='store_true',
+                        help='resubmit the failed jobs, with 1.5x memory, 2x scratch or 2x walltime depending on the failure (factors and max_resubmits in the [TRIAGE] config section)')
+    parser.add_argument('--version', default=None,
+                        help='path or name of the qchem version script for resubmissions (default from the config)')
+    parser.add_argument('-l', action='append',
+                        help='sbatch options for resubmissions like -l of the main command (default: the ones of the last submission)')
+    parser.add_argument('--ttl', type=float, default=0,
+                        help='seconds a cached sacct/squeue snapshot is reused (default 0)')
+    args = parser.parse_args(argv)
+
+    index = JobIndex()
+    failed = [(path, state) for path, state in sorted(
+        settle_states(index, ttl=args.ttl).items()) if state in failed_states]
+    if not failed:
+        index.save()
+        print('no failed jobs')
+        return
+
+    max_resubmits = 3
+    if config.has_option('TRIAGE', 'max_resubmits'):
+        max_resubmits = config['TRIAGE'].getint('max_resubmits')
+    version = None
+    if args.resubmit:
+        version = resolve_version(args.version, config, interactive=False)
+    if args.resubmit and version is None:
+        print('** Warning ** no qchem version script, give one with --version')
+        args.resubmit = False
+
+    submitter = Submitter()
+    fit = fit_settings(config)
+    now = time.time()
+    counts = {}
+    for path, state in failed:
+        entry = index.get(path)
+        job_id = entry.get('job_id')
+        failure = classify_failure(path, job_id, state)
+        counts[failure] = counts.get(failure, 0) + 1
+        index.update(path, failure=failure)
+        action = ''
+        if failure == 'scf':
+            action = 'input needs changes'
+        elif args.resubmit and not os.path.isfile(path):
+            action = 'input missing'
+        elif args.resubmit and entry.get('resubmits', 0) >= max_resubmits:
+            action = f'gave up after {max_resubmits} resubmits'
+        elif args.resubmit:
+            # the digest of the unscaled job keeps main() from resubmitting
+            # it while the scaled one is queued
+            job = prepare_job(path, config, version, render=False, fit=fit)
+            resources = scaled_resources(job, entry, failure, config)
+            if resources is None:
+                action = (f'no {failure_resources[failure][0]} to scale '
+                          f'or at its limit')
+            else:
+                scaled = prepare_job(path, config, version,
+                                     resources=resources, fit=fit)
+                sbatch_args = sbatch_options(args.l) or entry.get('sbatch_args')
+                new_id = send_job(scaled.jobscript, sbatch_args, True,
+                                  submitter=submitter)
+                if new_id is None:
+                    action = 'resubmission failed'
+                else:
+                    index.update(path, digest=job.digest, job_id=new_id,
+                                 jobscript=scaled.jobscript,
+                                 status='submitted', submitted_at=now,
+                                 sbatch_args=sbatch_args, scaled=resources,
+                                 resubmits=entry.get('resubmits', 0) + 1)
+                    action = f'resubmitted as {new_id}'
+        print(f'{path:<40}{job_id or "":>14}  {state:<14}{failure:<10}{action}')
+    index.save()
+    print('\n' + ', '.join(f'{n} {failure}' for failure, n in
+                           sorted(counts.items(), key=lambda item: -item[1])))
+
+
+@dataclass(frozen=True)
+class NodeClass:
+    """One type of compute node, from a [NODES <name>] config section or a
+    line of sinfo. Memory and scratch in MB, scratch None if unknown."""
+    name: str
+    partition: str = None
+    cores: int = 48
+    mem: int = 180 * 1024
+    scratch: int = None
+    count: int = 0
+    # relative cost, defaults to the memory of the node
+    weight: float = None
+
+    def cost(self):
+        # cheaper and more plentiful nodes first, those have shorter waits
+        weight = self.mem if self.weight is None else self.weight
+        return (weight, self.cores, -self.count)
+
+    def fits(self, ncpus, mem, scratch):
+        return (ncpus <= self.cores and mem <= self.mem
+                and (self.scratch is None or scratch <= self.scratch))
+
+
+def parse_sinfo(text):
+    """Node classes from the output of
+    sinfo --noheader --format=%P|%c|%m|%D|%G
+
+    :returns: list of NodeClass, cheapest first
+
+    """
+    classes = []
+    for line in text.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) != 5:
+            continue
+        partition, cores, mem, count, gres = fields
+        partition = partition.rstrip('*')
+        if 'gpu' in gres:
+            # qchem jobs do not belong on gpu nodes
+            continue
+        scratch = None
+        for res in gres.split(','):
+            # scratch:<n>[unit] or scratch:<type>:<n>, plain numbers are GB
+            if res.startswith('scratch:'):
+                amount = res.split('(')[0].split(':')[-1]
+                if amount.isdigit():
+                    amount += 'G'
+                scratch = _memory_mb(amount)
+                if scratch is not None:
+                    scratch = int(scratch)
+        try:
+            node = NodeClass(partition, partition, int(cores.rstrip('+')),
+                             int(mem.rstrip('+')), scratch,
+                             int(count))
+        except ValueError:
+            continue
+        if any(c.name == node.name for c in classes):
+            node = NodeClass(f'{partition}:{node.mem // 1024}G', partition,
+                             node.cores, node.mem, node.scratch, node.count)
+        classes.append(node)
+    return sorted(classes, key=NodeClass.cost)
+
+
+def node_classes(config, ttl=86400):
+    """Node model of the cluster: the [NODES <name>] sections of the config
+    or, with source = sinfo in [FIT], the output of sinfo cached for ttl
+    seconds.
+
+    :returns: list of NodeClass, cheapest first, empty if unknown
+
+    """
+    if config.has_option('FIT', 'source') and config['FIT']['source'] == 'sinfo':
+        path = cache_path('sinfo.json')
+        try:
+            with open(path) as fp:
+                cache = json.load(fp)
+            if time.time() - cache['time'] < ttl:
+                return parse_sinfo(cache['sinfo'])
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            proc = run(['sinfo', '--noheader', '--format=%P|%c|%m|%D|%G'],
+                       capture_output=True, text=True)
+        except FileNotFoundError:
+            return []
+        if proc.returncode != 0:
+            print(f'** Warning ** sinfo failed: {proc.stderr.strip()}')
+            return []
+        _write_cache(path, sinfo=proc.stdout)
+        return parse_sinfo(proc.stdout)
+
+    classes = []
+    for name in config.sections():
+        if not name.startswith('NODES '):
+            continue
+        section = config[name]
+        tmp = JobData('', '')
+        tmp.mem = section.get('mem', '180G')
+        tmp.scratch = section.get('scratch')
+        weight = section.get('weight')
+        classes.append(NodeClass(
+            name.split(None, 1)[1], section.get('partition'),
+            section.getint('cores', 48), JobData.mem.raw(tmp),
+            JobData.scratch.raw(tmp), section.getint('count', 0),
+            float(weight) if weight is not None else None))
+    return sorted(classes, key=NodeClass.cost)
+
+
+# where qchem writes its scratch files, see place_scratch
+scratch_placements = ('auto', 'shm', 'local', 'workspace', 'off')
+
+
+def scratch_settings(config):
+    """(policy, shm_max, shm_fraction, local_max, workspace) from the
+    [SCRATCH] section, sizes in MB."""
+    section = config['SCRATCH'] if 'SCRATCH' in config else {}
+    policy = section.get('policy', 'auto')
+    if policy not in scratch_placements:
+        print(f'** Warning ** unknown scratch policy {policy}, using auto')
+        policy = 'auto'
+    parse = SlurmMemory().parse
+    return (policy, parse(section.get('shm_max', '2G')),
+            float(section.get('shm_fraction', 0.5)),
+            parse(section.get('local_max', '1800G')),
+            section.get('workspace') or None)
+
+
+def place_scratch(data: JobData, policy='auto', shm_max=2048, shm_fraction=0.5,
+                  local_max=1843200, workspace=None):
+    """Chooses where qchem writes its scratch files from the scratch volume
+    the job requests (or got predicted by --auto-resources or the report
+    defaults) and its memory request.
+
+    shm: up to shm_max and shm_fraction of the memory in /dev/shm, which
+        counts against the memory limit, so the memory request is raised
+        by the volume and no scratch is requested
+    local: the node-local $TMPDIR with --gres=scratch of the volume
+    workspace: volumes above local_max in the workspace directory
+
+    With policy auto a job without a scratch volume keeps the default
+    ($TMPDIR), off never changes anything.
+
+    :returns: the placement, None if unchanged
+
+    """
+    scratch = JobData.scratch.raw(data)
+    mem = JobData.mem.raw(data)
+    placement = policy
+    if policy == 'off' or (policy == 'auto' and scratch is None):
+        return None
+    if policy == 'auto':
+        if mem and scratch <= shm_max and scratch <= shm_fraction * mem:
+            placement = 'shm'
+        elif scratch > local_max and workspace:
+            placement = 'workspace'
+        else:
+            placement = 'local'
+            if scratch > local_max:
+                print(f'** Warning ** {data.scratch} GB scratch exceed the '
+                      'local disks, set a workspace in the [SCRATCH] section')
+    if placement == 'workspace' and not workspace:
+        print('** Warning ** no workspace in the [SCRATCH] section, '
+              'using the local disk')
+        placement = 'local'
+
+    # the values are set directly, the descriptors would warn about
+    # overwriting the input
+    if placement == 'shm':
+        if mem is None:
+            print('** Warning ** scratch in /dev/shm counts against the '
+                  'memory limit but no memory is requested')
+        elif scratch:
+            data._mem = (mem + scratch,)
+        data._scratch = ()
+        data.scratch_dir = '/dev/shm/qchem.$SLURM_JOB_ID'
+        data.scratch_need = scratch
+    elif placement == 'workspace':
+        data._scratch = ()
+        data.scratch_dir = f'"{workspace}"/qchem_scratch.$SLURM_JOB_ID'
+        data.scratch_need = scratch
+    else:
+        data.scratch_dir = data.scratch_need = None
+    return placement
+
+
+def fit_node(data: JobData, classes, mode='warn', waste=50.0, clip=5.0):
+    """Requests the partition of the cheapest node class the job fits on.
+
+    A memory request at most clip % above the memory of a cheaper class
+    is reported, in mode 'adjust' it is rounded down to that class. A job
+    blocking more than waste % of a node beyond its share of the cores
+    (e.g. most of the memory with a few threads) is reported, in mode
+    'adjust' the thread count is raised to the blocked share instead.
+
+    """
+    ncpus = data.ncpus or 1
+    mem = JobData.mem.raw(data) or 0
+    scratch = JobData.scratch.raw(data) or 0
+    fitting = [node for node in classes if node.fits(ncpus, mem, scratch)]
+    if not fitting:
+        print(f'** Warning ** {data.jobname} fits on no node class')
+        return None
+    node = fitting[0]
+    for cheaper in classes[:classes.index(node)]:
+        if (mem <= cheaper.mem * (1 + clip / 100)
+                and cheaper.fits(ncpus, cheaper.mem, scratch)):
+            if mode == 'adjust':
+                # set the value directly, the descriptor would warn about
+                # overwriting the input
+                data._mem = (cheaper.mem,)
+                mem = cheaper.mem
+                node = cheaper
+                print(f'** Warning ** memory rounded down to '
+                      f'{data.mem} to fit the {cheaper.name} nodes')
+            else:
+                print(f'** Warning ** memory {data.mem} is just above the '
+                      f'{cheaper.name} nodes ({cheaper.mem}M), the job '
+                      f'needs a {node.name} node')
+            break
+    if node.partition:
+        data.partition = node.partition
+
+    shares = [mem / node.mem]
+    if node.scratch:
+        shares.append(scratch / node.scratch)
+    blocked = max(shares)
+    if 100 * (blocked - ncpus / node.cores) > waste:
+        cores = min(node.cores, ceil(blocked * node.cores))
+        if mode == 'adjust':
+            data.ncpus = cores
+            print(f'** Warning ** threads raised from {ncpus} to {cores}, '
+                  f'the job blocks {100 * blocked:.0f} % of a {node.name} node')
+        else:
+            print(f'** Warning ** {ncpus} threads but {100 * blocked:.0f} % '
+                  f'of a {node.name} node blocked, consider {cores} threads')
+    return node
+
+
+def fit_settings(config, mode=None):
+    """(node classes, mode, waste, clip) from the [FIT] section, None if
+    fitting is off or no node model is known."""
+    section = config['FIT'] if config.has_section('FIT') else {}
+    if mode is None:
+        mode = section.get('mode', 'warn')
+    if mode == 'off':
+        return None
+    classes = node_classes(config, float(section.get('ttl', 86400)))
+    if not classes:
+        return None
+    return (classes, mode, float(section.get('waste', 50)),
+            float(section.get('clip', 5)))
+
+
+def nodes_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py nodes',
+        description='show the node classes jobs are fitted to, cheapest first')
+    parser.parse_args(argv)
+    classes = node_classes(config)
+    if not classes:
+        print('no node classes, add [NODES <name>] sections or set source = sinfo in [FIT]')
+        return
+    print(f'{"name":<20}{"partition":<16}{"cores":>6}{"mem":>10}{"scratch":>10}{"nodes":>7}')
+    for node in classes:
+        scratch = '' if node.scratch is None else f'{node.scratch // 1024}G'
+        print(f'{node.name:<20}{node.partition or "":<16}{node.cores:>6}'
+              f'{node.mem // 1024:>9}G{scratch:>10}{node.count:>7}')
+
+
+def _set_rem(buf, sections, values):
+    """Sets the $rem keywords in values (dict) in the given $rem sections of
+    buf, existing lines of these keywords are replaced.
+
+    :returns: the new content
+
+    """
+    keys = [key.encode() for key in values]
+    for section in sorted(sections, key=lambda sec: sec[1], reverse=True):
+        start, end = _section_body(buf, section)
+        lines = [line for line in buf[start:end].splitlines(keepends=True)
+                 if line.lower().replace(b'=', b' ').split()[:1]
+                 not in ([key] for key in keys)]
+        lines += [f'   {key} {value}\n'.encode()
+                  for key, value in values.items()]
+        buf = buf[:start] + b''.join(lines) + buf[end:]
+    return buf
+
+
+# directory next to the inputs holding the autotune variants, hidden like
+# .stages so that --recursive, --glob and the history do not find them
+autotune_dir = '.autotune'
+
+
+def autotune_variant(path, threads, cycles):
+    """Writes a short variant of the input at path as
+    .autotune/<input>.t<threads>.in next to it: only the first job, as a
+    single point with at most cycles SCF cycles on threads threads.
+
+    :returns: path of the variant
+
+    """
+    inp = read_input(path)
+    stage = inp.stages[0]
+    start, end = stage.span
+    with open(path, 'rb') as qin:
+        buf = qin.read()[:end]
+    buf = _set_rem(buf, [sec for sec in stage.sections if sec[0] == 'rem'],
+                   dict(jobtype='sp', max_scf_cycles=cycles, threads=threads))
+    directory = os.path.join(os.path.dirname(path), autotune_dir)
+    os.makedirs(directory, exist_ok=True)
+    variant = os.path.join(
+        directory, f'{os.path.basename(infile_base(path))}.t{threads}.in')
+    with open(variant, 'wb') as qin:
+        qin.write(buf[start:])
+    return variant
+
+
+def remove_autotune_variants(runs):
+    """Removes the variants of one input with everything their jobs wrote:
+    the files next to the variants and the slurm log and metrics in the
+    submit directory (the working directory, like the autotune state), and
+    the .autotune directory once it is empty."""
+    for measurement in runs.values():
+        base = infile_base(measurement['input'])
+        paths = glob.glob(glob.escape(base) + '.*')
+        if measurement.get('job_id'):
+            name = os.path.basename(base)
+            job_id = measurement['job_id']
+            paths += [f'{name}.o{job_id}', f'{name}.{job_id}.metrics.jsonl']
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+        try:
+            os.rmdir(os.path.dirname(base))
+        except OSError:
+            pass
+
+
+def autotune_timing(variant, job_id):
+    """Wall time in s of qchem in an autotune job, from the metrics of the
+    jobscript or else the 'Total job time' of the output. None if the job
+    has not finished."""
+    for record in job_metrics('.', variant, job_id):
+        if record.get('phase') == 'qchem':
+            return record['end'] - record['start']
+    text = _tail(infile_base(variant) + '.out')
+    pos = text.rfind('total job time:')
+    if pos >= 0:
+        wall = text[pos + 15:].split('s(wall)')[0].strip()
+        try:
+            return float(wall)
+        except ValueError:
+            pass
+    return None
+
+
+def fit_thread_scaling(timings):
+    """Least squares fit of Amdahl's law T(n) = a + b / n to the wall times.
+
+    :timings: dict threads -> wall time in s
+    :returns: (a, b), the serial and the parallel time
+
+    """
+    xs = [1 / n for n in timings]
+    ys = list(timings.values())
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    sxx = sum((x - mx)**2 for x in xs)
+    b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx if sxx else 0.0
+    a = my - b * mx
+    if b < 0:
+        return my, 0.0
+    if a < 0:
+        b = sum(x * y for x, y in zip(xs, ys)) / sum(x * x for x in xs)
+        return 0.0, b
+    return a, b
+
+
+def recommend_threads(a, b, max_threads, min_efficiency=0.7):
+    """Largest thread count up to max_threads whose parallel efficiency
+    T(1) / (n T(n)) is at least min_efficiency, the one with the best
+    trade-off of core hours and time to solution."""
+    if a <= 0:
+        return max_threads
+    # (a + b) / (a n + b) >= min_efficiency solved for n
+    n = int(((a + b) / min_efficiency - b) / a)
+    return max(1, min(max_threads, n))
+
+
+def autotune_classes():
+    """Cached autotune results, method/basis -> dict with threads,
+    serial_fraction, natoms and the measured timings."""
+    try:
+        with open(cache_path('autotune.json')) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def autotune_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py autotune',
+        description='measure the thread scaling of inputs with short single point variants (submit) and recommend the thread count (--collect)')
+    parser.add_argument('INFILE', nargs='*',
+                        help='inputs to measure, their variants are written next to them as .autotune/<input>.t<threads>.in and removed by --collect')
+    parser.add_argument('--threads', default='1,2,4,8,16,32',
+                        help='comma separated thread counts (default 1,2,4,8,16,32)')
+    parser.add_argument('--cycles', type=int, default=2,
+                        help='maximum number of SCF cycles of the variants (default 2)')
+    parser.add_argument('--walltime', default='00:30:00',
+                        help='walltime of the variants (default 00:30:00)')
+    parser.add_argument('-l', action='append',
+                        help='sbatch options of the variants like -l of the main command, e.g. -l partition=dev_single')
+    parser.add_argument('--no-send', action='store_true',
+                        help='only write the variants and their jobscripts')
+    parser.add_argument('--collect', action='store_true',
+                        help='fit the finished measurements, print the recommendation and cache it per method/basis')
+    parser.add_argument('--partial', action='store_true',
+                        help='with --collect, also fit inputs whose variants did not all finish')
+    parser.add_argument('--write', action='store_true',
+                        help='with --collect, write the recommended threads into the $rem of the inputs')
+    parser.add_argument('--min-efficiency', type=float, default=None,
+                        help='minimum parallel efficiency of the recommendation (default 0.7 or min_efficiency in [AUTOTUNE])')
+    args = parser.parse_args(argv)
+
+    state_path = '.qchem_send_slurm.autotune.json'
+    try:
+        with open(state_path) as fp:
+            state = json.load(fp)
+    except (OSError, ValueError):
+        state = {}
+
+    if args.collect:
+        min_efficiency = args.min_efficiency
+        if min_efficiency is None:
+            min_efficiency = 0.7
+            if config.has_option('AUTOTUNE', 'min_efficiency'):
+                min_efficiency = config['AUTOTUNE'].getfloat('min_efficiency')
+        classes = autotune_classes()
+        for path in list(state):
+            runs = state[path]
+            timings = {}
+            for threads, measurement in runs.items():
+                wall = autotune_timing(measurement['input'],
+                                       measurement['job_id'])
+                if wall is not None:
+                    timings[int(threads)] = wall
+            if len(timings) < len(runs) and not args.partial:
+                print(f'{path}: {len(timings)} of {len(runs)} measurements finished')
+                continue
+            if len(timings) < 2:
+                print(f'** Warning ** {path}: too few measurements to fit')
+                continue
+            a, b = fit_thread_scaling(timings)
+            threads = recommend_threads(a, b, max(timings), min_efficiency)
+            print(f'{path}: serial fraction {a / (a + b):.3f}')
+            print(f'{"threads":>9}{"wall [s]":>12}{"speedup":>10}{"efficiency":>12}')
+            for n, wall in sorted(timings.items()):
+                speedup = (a + b) / wall
+                print(f'{n:>9}{wall:>12.1f}{speedup:>10.2f}{speedup / n:>12.2f}')
+            print(f'recommended: {threads} threads\n')
+            # the variants measure the first job of multi job inputs
+            inp = read_input(path).stages[0] if os.path.isfile(path) else None
+            if inp is not None:
+                classes[f'{inp.method}/{inp.basis}'] = dict(
+                    threads=threads, serial_fraction=a / (a + b),
+                    natoms=inp.natoms,
+                    timings={str(n): t for n, t in sorted(timings.items())})
+            if args.write and inp is not None:
+                if any(key in inp.qsys for key in qsys_key_mapping['ncpus']):
+                    print(f'** Warning ** the qsys threads line of {path} '
+                          f'still takes precedence')
+                with open(path, 'rb') as qin:
+                    buf = qin.read()
+                buf = _set_rem(buf, [sec for sec in inp.sections
+                                     if sec[0] == 'rem'],
+                               dict(threads=threads))
+                with open(path, 'wb') as qin:
+                    qin.write(buf)
+            remove_autotune_variants(runs)
+            del state[path]
+        path = cache_path('autotune.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump(classes, fp, indent=1, sort_keys=True)
+    else:
+        if not args.INFILE:
+            parser.error('no inputs given')
+        version = resolve_version(None, config, interactive=False)
+        if version is None:
+            print('** Warning ** no qchem version script in the config')
+            return
+        thread_counts = sorted({int(n) for n in args.threads.split(',')})
+        submitter = Submitter()
+        for path in args.INFILE:
+            runs = {}
+            for n in thread_counts:
+                variant = autotune_variant(path, n, args.cycles)
+                job = prepare_job(variant, config, version, resources=dict(
+                    ncpus=n, time=args.walltime))
+                job_id = send_job(job.jobscript, sbatch_options(args.l),
+                                  not args.no_send, submitter=submitter)
+                runs[str(n)] = dict(input=variant, job_id=job_id)
+            if not args.no_send:
+                state[JobIndex.key(path)] = runs
+            print(f'{path}: {len(runs)} variants '
+                  f'{"written" if args.no_send else "submitted"}')
+        submitter.shutdown()
+
+    if state:
+        with open(state_path, 'w') as fp:
+            json.dump(state, fp, indent=1)
+    elif os.path.isfile(state_path):
+        os.remove(state_path)
+
+
+def _slurm_seconds(string):
+    """Seconds of sacct times like 1-02:03:04, 02:03:04 or 03:04.567, None
+    for UNLIMITED, Partition_Limit or empty fields."""
+    string = string.strip()
+    if not string or not string[0].isdigit():
+        return None
+    days = 0
+    if '-' in string:
+        days, string = string.split('-', 1)
+        days = int(days)
+    parts = [float(part) for part in string.split(':')]
+    while len(parts) < 3:
+        parts.insert(0, 0.0)
+    hours, minutes, seconds = parts
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+# fields of the sacct call of the report subcommand
+sacct_usage_format = 'JobID,State,Elapsed,Timelimit,TotalCPU,AllocCPUS,ReqMem,MaxRSS'
+
+
+def parse_sacct_usage(text):
+    """Parses sacct --parsable2 --noheader --format=<sacct_usage_format>
+    output, the allocation lines give the requested resources and the
+    step lines (<id>.batch, <id>.0) the MaxRSS.
+
+    :returns: dict job id -> dict(state, elapsed, timelimit, cpu (s),
+        ncpus, reqmem and maxrss (MB))
+
+    """
+    jobs = {}
+    for line in text.splitlines():
+        fields = line.strip().split('|')
+        if len(fields) != 8:
+            continue
+        job_id, state, elapsed, timelimit, cpu, ncpus, reqmem, maxrss = fields
+        base = job_id.split('.')[0]
+        job = jobs.setdefault(base, dict(maxrss=None))
+        rss = _memory_mb(maxrss)
+        if rss is not None:
+            job['maxrss'] = max(job['maxrss'] or 0, rss)
+        if '.' in job_id:
+            continue
+        ncpus = int(ncpus) if ncpus.isdigit() else 1
+        # older slurm: <n>Mc per cpu, <n>Mn per node
+        per_cpu = reqmem.endswith('c')
+        mem = _memory_mb(reqmem.rstrip('cn'))
+        if mem is not None and per_cpu:
+            mem *= ncpus
+        job.update(state=state.split(' ')[0], elapsed=_slurm_seconds(elapsed),
+                   timelimit=_slurm_seconds(timelimit),
+                   cpu=_slurm_seconds(cpu), ncpus=ncpus, reqmem=mem)
+    return jobs
+
+
+def sacct_usage(job_ids):
+    """Resource usage of the given jobs from sacct, see run_sacct.
+
+    :returns: see parse_sacct_usage, empty if sacct is not available
+
+    """
+    job_ids = sorted({str(job_id) for job_id in job_ids if job_id})
+    if not job_ids:
+        return {}
+    return parse_sacct_usage(
+        run_sacct([f'--format={sacct_usage_format}'], job_ids) or '')
+
+
+def _peak_scratch_mb(directory, path, job_id):
+    """Peak scratch usage in MB recorded in the metrics of the job."""
+    for record in job_metrics(directory, path, job_id):
+        if record.get('phase') == 'qchem' and 'peak_scratch_bytes' in record:
+            return record['peak_scratch_bytes'] / 1024 / 1024
+    return None
+
+
+def suggested_defaults(jobs, margin=1.2):
+    """Per method/basis defaults from the largest usage of finished jobs
+    with a safety margin.
+
+    :jobs: list of dicts with method, basis, elapsed, maxrss and scratch
+    :returns: dict method/basis -> dict(walltime, mem, scratch) strings
+
+    """
+    classes = {}
+    for job in jobs:
+        classes.setdefault(f'{job["method"]}/{job["basis"]}', []).append(job)
+    ret = {}
+    for name, members in sorted(classes.items()):
+        defaults = {}
+        elapsed = max(job['elapsed'] for job in members)
+        # rounded up to 5 minutes
+        minutes = 5 * ceil(elapsed * margin / 300)
+        defaults['walltime'] = SlurmTime().format(
+            datetime.timedelta(minutes=minutes))
+        rss = [job['maxrss'] for job in members if job['maxrss']]
+        if rss:
+            defaults['mem'] = f'{100 * ceil(max(rss) * margin / 100)}M'
+        scratch = [job['scratch'] for job in members if job['scratch']]
+        if scratch:
+            defaults['scratch'] = f'{ceil(max(scratch) * margin / 1024)}G'
+        ret[name] = defaults
+    return ret
+
+
+def write_config_sections(sections, path=None):
+    """Replaces or appends the given sections in the config file, comments
+    and all other sections are kept as they are.
+
+    :sections: dict section name -> dict of options
+
+    """
+    if path is None:
+        path = config_path()
+    try:
+        with open(path) as fp:
+            lines = fp.readlines()
+    except FileNotFoundError:
+        lines = []
+    kept = []
+    skip = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('[') and stripped.endswith(']'):
+            skip = stripped[1:-1] in sections
+        if not skip:
+            kept.append(line)
+    while kept and not kept[-1].strip():
+        kept.pop()
+    for name, options in sections.items():
+        kept.append(f'\n[{name}]\n')
+        kept.extend(f'{key} = {value}\n' for key, value in options.items())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fp:
+        fp.writelines(kept)
+
+
+def report_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py report',
+        description='compare the requested with the used resources of the finished jobs in the job index from sacct')
+    parser.add_argument('DIR', nargs='*', default=['.'],
+                        help='submit directories with a job index (default .)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of worst over-requesters shown (default 10)')
+    parser.add_argument('--margin', type=float, default=1.2,
+                        help='safety margin of the suggested defaults (default 1.2)')
+    parser.add_argument('--write-defaults', action='store_true',
+                        help='write the suggested defaults as [DEFAULTS <method>/<basis>] sections into the config file')
+    args = parser.parse_args(argv)
+
+    submitted = []
+    for directory in args.DIR:
+        for path, entry in JobIndex(directory).jobs.items():
+            if entry.get('job_id'):
+                submitted.append((directory, path, entry['job_id']))
+    usage = sacct_usage(job_id for _, _, job_id in submitted)
+
+    jobs = []
+    for directory, path, job_id in submitted:
+        job = usage.get(job_id)
+        if (job is None or not job.get('elapsed')
+                or job['state'] in ('PENDING', 'RUNNING', 'REQUEUED')):
+            continue
+        full_path = os.path.normpath(os.path.join(directory, path))
+        inp = read_input(full_path) if os.path.isfile(full_path) else QChemInput(path)
+        job = dict(job, path=full_path, job_id=job_id, method=inp.method,
+                   basis=inp.basis,
+                   scratch=_peak_scratch_mb(directory, path, job_id))
+        job['cpu_eff'] = (job['cpu'] or 0) / (job['elapsed'] * job['ncpus'])
+        job['mem_eff'] = (job['maxrss'] / job['reqmem']
+                          if job['maxrss'] and job['reqmem'] else None)
+        job['time_eff'] = (job['elapsed'] / job['timelimit']
+                           if job['timelimit'] else None)
+        hours = job['elapsed'] / 3600
+        job['wasted_core_h'] = (1 - job['cpu_eff']) * job['ncpus'] * hours
+        job['wasted_gb_h'] = ((job['reqmem'] - (job['maxrss'] or 0)) / 1024 * hours
+                              if job['reqmem'] else 0.0)
+        jobs.append(job)
+    if not jobs:
+        print('no finished jobs found')
+        return
+
+    def mean(key, members):
+        values = [job[key] for job in members if job[key] is not None]
+        return f'{100 * sum(values) / len(values):.0f} %' if values else '-'
+
+    print(f'{len(jobs)} finished jobs\n')
+    print(f'{"method/basis":<32}{"jobs":>6}{"cpu":>8}{"memory":>8}{"time":>8}')
+    classes = {}
+    for job in jobs:
+        classes.setdefault(f'{job["method"]}/{job["basis"]}', []).append(job)
+    for name, members in sorted(classes.items()):
+        print(f'{name:<32}{len(members):>6}{mean("cpu_eff", members):>8}'
+              f'{mean("mem_eff", members):>8}{mean("time_eff", members):>8}')
+
+    for key, label in (('wasted_gb_h', 'unused memory [GB h]'),
+                       ('wasted_core_h', 'idle cores [core h]')):
+        worst = sorted((job for job in jobs if job[key] > 0),
+                       key=lambda job: -job[key])[:args.top]
+        if not worst:
+            continue
+        print(f'\nworst over-requesters by {label}:')
+        for job in worst:
+            used = (f'{(job["maxrss"] or 0) / 1024:.1f} of '
+                    f'{(job["reqmem"] or 0) / 1024:.1f} GB'
+                    if key == 'wasted_gb_h' else
+                    f'{100 * job["cpu_eff"]:.0f} % of {job["ncpus"]} cores')
+            print(f'  {job["path"]:<40}{job["job_id"]:>12}{job[key]:>10.1f}  {used}')
+
+    defaults = suggested_defaults(jobs, args.margin)
+    print('\nsuggested defaults:')
+    for name, options in defaults.items():
+        print(f'  {name:<32}' + ', '.join(f'{key} {value}'
+                                          for key, value in options.items()))
+    if args.write_defaults:
+        write_config_sections({f'DEFAULTS {name}': options
+                               for name, options in defaults.items()})
+        print(f'written to {config_path()}')
+
+
+def versions_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py versions',
+        description='list the qchem version scripts of the version directory or resolve a name')
+    parser.add_argument('NAME', nargs='?',
+                        help='name, part of a name or alias of a version script')
+    parser.add_argument('--refresh', action='store_true',
+                        help='read the version directory even if it did not change')
+    args = parser.parse_args(argv)
+
+    registry = version_registry(config, refresh=args.refresh)
+    if args.NAME:
+        path = registry.resolve(args.NAME)
+        if path is None:
+            sys.exit(f'no unique qchem version {args.NAME}, matches: '
+                     f'{", ".join(registry.lookup(args.NAME)) or "none"}')
+        print(path)
+        return
+    aliases = {}
+    for alias, name in registry.aliases.items():
+        aliases.setdefault(os.path.basename(name), []).append(alias)
+    print(f'{registry.directory}:')
+    for name, mtime in sorted(registry.scripts.items()):
+        modified = datetime.datetime.fromtimestamp(mtime)
+        print(f'  {name:<40}{modified:%Y-%m-%d %H:%M}  '
+              f'{", ".join(sorted(aliases.get(name, [])))}')
+
+
+def templates_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py templates',
+        description='show where the jobscript stages come from or write the builtin stages as a starting point for site or user templates')
+    parser.add_argument('--dump', metavar='DIR',
+                        help='write the builtin stages as DIR/<stage>.sh, existing files are kept')
+    parser.add_argument('--show', metavar='STAGE', choices=jobscript_stage_names,
+                        help='print the stage as used for new jobscripts')
+    args = parser.parse_args(argv)
+
+    dirs = template_dirs(config)
+    template = jobscript_template(dirs)
+    if args.show:
+        parts = template.stages[args.show]
+        print(''.join(part if i % 2 == 0 else '{' + part + '}'
+                      for i, part in enumerate(parts)), end='')
+        return
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        for name in jobscript_stage_names:
+            path = os.path.join(args.dump, name + '.sh')
+            if os.path.exists(path):
+                print(f'** Warning ** {path} exists, not overwritten')
+                continue
+            with open(path, 'w') as fp:
+                fp.write(jobscript_stages[name])
+            print(path)
+        return
+    print('template directories: ' + ', '.join(dirs))
+    for name in jobscript_stage_names:
+        print(f'  {name:<12}{", ".join(template.sources.get(name, ["builtin"]))}')
+    print('fields: ' + ', '.join('{' + name + '}' for name in template.fields))
+
+
+def cache_main(argv, config):
+    parser = argparse.ArgumentParser(
+        prog='qchem_send_slurm.py cache',
+        description='add finished outputs to the result cache or look up inputs in it')
+    parser.add_argument('ACTION', choices=['add', 'find'],
+                        help='add: index the inputs with a finished output below the directories, find: show the cached result of the inputs')
+    parser.add_argument('PATH', nargs='+',
+                        help='directories (add) or input files (find)')
+    args = parser.parse_args(argv)
+
+    cache, _ = result_cache(config)
+    if cache is None:
+        cache = ResultCache(cache_path('results'))
+    if args.ACTION == 'add':
+        n = 0
+        for directory in args.PATH:
+            for path in find_inputs(directory):
+                if output_complete(infile_base(path) + '.out') is not True:
+                    continue
+                n += cache.add(input_fingerprint(path), path)
+        print(f'{n} outputs added to {cache.directory}')
+        return
+    for path in args.PATH:
+        entry = cache.get(input_fingerprint(path))
+        if entry is None:
+            print(f'{path}: not cached')
+        else:
+            print(f'{path}: {entry["output"]} '
+                  f'({saved_core_hours(entry):.1f} core hours)')
+
+
+# subcommands, dispatched on the first command line argument
+subcommands = {
+    'history': history_main,
+    'restart': restart_main,
+    'stats': stats_main,
+    'feed': feed_main,
+    'status': status_main,
+    'triage': triage_main,
+    'handoff': handoff_main,
+    'nodes': nodes_main,
+    'autotune': autotune_main,
+    'report': report_main,
+    'versions': versions_main,
+    'templates': templates_main,
+    'cache': cache_main,
+}
+
+
+def cmd_args(argv):
+    interactive = interactive_session(argv)
+    config = load_config(interactive)
+    if argv and argv[0] in subcommands:
+        subcommands[argv[0]]([arg for arg in argv[1:]
+                              if arg != '--non-interactive'], config)
+        return
+    parser = argparse.ArgumentParser(description='A qchem jobscript creaion tool intended for the use on the JUSTUS2 bwhp cluster with Slurm.',
+                                     epilog=parser_epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', action='store_true',
+                        help="rewrite the config file")
+    # parser_config.add_argument('-p', '--path', help='sets the path for the config file')
+    # parser_jobscript = subparser.add_parser('', help='creates the jobscript')
+    parser.add_argument(
+        'INFILE', nargs='*', help='the qchem input files for which the jobscripts are to be generated.')
+    parser.add_argument('-l', action='append',
+                        help='specify resources for SLURM, will be forwarded to sbatch. use its syntax BUT leave out "--"!')
+    parser.add_argument('--no-send', action='store_false',
+                        help='flag to prevent sending the job to the cluster')
+    parser.add_argument(
+        '--version', help='give name or the path to a qchem version script, names may be abbreviated or aliases from the [VERSIONS] section of the config.')
+    parser.add_argument('--non-interactive', action='store_true',
+                        help='never ask, fail if the config or the qchem version is missing (default without a terminal or with QCHEM_SEND_SLURM_NONINTERACTIVE=1)')
+    parser.add_argument('--array', action='store_true',
+                        help='submit inputs with identical resources as one slurm job array')
+    parser.add_argument('--pack', action='store_true',
+                        help='run small inputs concurrently in full node allocations')
+    parser.add_argument('--pack-max-cores', type=int, default=4,
+                        help='inputs with at most this many threads are packed (default 4)')
+    parser.add_argument('--pack-walltime', default=None,
+                        help='maximum walltime of a pack (default: 24h or the longest input)')
+    parser.add_argument('--split-stages', action='store_true',
+                        help='submit the jobs of a multi job (@@@) input as separate slurm jobs chained with afterok')
+    parser.add_argument('--throttle', type=int, default=None,
+                        help='maximum number of simultaneously running array tasks (only with --array)')
+    parser.add_argument('-r', '--recursive', action='append', metavar='DIR',
+                        help='search DIR recursively for input files matching --glob')
+    parser.add_argument('--glob', default=None,
+                        help='file name pattern for --recursive (default *.in), without --recursive a (** capable) glob of input files')
+    parser.add_argument('--stageout-mode', choices=['copy', 'tar', 'tgz'], default=None,
+                        help='copy results back with parallel workers (default) or as one (compressed) archive')
+    parser.add_argument('--live-sync', type=int, default=None, metavar='SECONDS',
+                        help='append the new part of the output to <input>.out.live in the submit directory every SECONDS while qchem runs (0: off)')
+    parser.add_argument('--reuse', choices=['symlink', 'copy', 'off'], default=None,
+                        help='link or copy the results of inputs computed before (same input fingerprint) from the result cache instead of submitting them (default: reuse in [CACHE], the cache is off without that section)')
+    parser.add_argument('--scratch', choices=scratch_placements, default=None,
+                        help='where qchem writes its scratch files: /dev/shm, the local disk or the workspace, auto chooses by the scratch volume (default: policy in [SCRATCH] or auto)')
+    parser.add_argument('--restart', type=int, default=0, metavar='N',
+                        help='on the walltime warning save the scratch files, rewrite the input to continue and requeue the job, at most N times')
+    parser.add_argument('--auto-resources', action='store_true',
+                        help='fill in missing walltime, memory and scratch from the resource history (see the history subcommand) and threads from the autotune results')
+    parser.add_argument('--fit', choices=['off', 'warn', 'adjust'], default=None,
+                        help='request the partition of the cheapest fitting node class and warn about (warn) or fix (adjust) requests just above a class or wasting a node (default: mode in [FIT] or warn, needs a node model, see the nodes subcommand)')
+    parser.add_argument('--feed', type=int, default=0, metavar='N',
+                        help='keep the jobs in a local queue and top up the slurm queue to N own jobs as they finish (resume with the feed subcommand)')
+    parser.add_argument('--feed-interval', type=float, default=60,
+                        help='seconds between two squeue polls with --feed (default 60)')
+    parser.add_argument('--submit-workers', type=int, default=4,
+                        help='maximum number of sbatch calls in flight (default 4)')
+    parser.add_argument('--submit-rate', type=float, default=10.0,
+                        help='maximum number of sbatch calls per second, 0 for no limit (default 10)')
+    parser.add_argument('--submit-retries', type=int, default=5,
+                        help='retries with exponential backoff when sbatch fails transiently, e.g. socket timeouts (default 5)')
+    parser.add_argument('--report', default='.qchem_send_slurm.report.json', metavar='PATH',
+                        help='json file listing the submitted and failed inputs (default .qchem_send_slurm.report.json)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='ignore the job index and rewrite and submit all inputs')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes used to parse inputs and write jobscripts (default: number of cpus)')
+
+    parser.set_defaults(func=main)
+    args = parser.parse_args(argv)
+    args.non_interactive = not interactive
+    args.func(vars(args), config)
+
+
+def find_inputs(directory, pattern='*.in'):
+    """Recursively collects the files below directory whose name matches
+    pattern, sorted per directory so the order is stable between runs.
+    Hidden directories, which hold the generated inputs of this script,
+    are not searched."""
+    files = []
+    dirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    # like ** of glob, skips .stages, .git, ...
+                    if not entry.name.startswith('.'):
+                        dirs.append(entry.path)
+                elif fnmatch.fnmatch(entry.name, pattern):
+                    files.append(entry.path)
+    except OSError as err:
+        print(f'** Warning ** could not read directory {directory}: {err}')
+    files.sort()
+    for sub in sorted(dirs):
+        files.extend(find_inputs(sub, pattern))
+    return files
+
+
+def collect_inputs(infiles, directories=None, pattern=None):
+    """Combines the explicitly given input files with the ones found via
+    --recursive/--glob, dropping duplicates but keeping the order."""
+    files = list(infiles)
+    if directories:
+        for directory in directories:
+            files.extend(find_inputs(directory, pattern or '*.in'))
+    elif pattern:
+        files.extend(sorted(glob.glob(pattern, recursive=True)))
+    return list(dict.fromkeys(files))
+
+
+@dataclass
+class PreparedJob:
+    """Result of prepare_job for one input."""
+    path: str
+    data: JobData
+    inp: QChemInput
+    jobscript: str = None
+    log: str = ''
+    digest: str = ''
+    # result of output_complete for the output of the input
+    finished: bool = None
+    output_mtime: float = 0.0
+    # digest and jobscript are the same as in the JobIndex
+    unchanged: bool = False
+    # scratch files of a job requeued by --restart are waiting
+    restarting: bool = False
+    # input_fingerprint, only computed if a result cache is configured
+    fingerprint: str = ''
+    # exception of a malformed input, see prepare_jobs(catch_errors=True)
+    error: str = None
+    # memory and scratch (MB) before place_scratch, packs run in $TMPDIR
+    requested: tuple = (None, None)
+
+
+def prepare_job(path, config, version, render=True, split_stages=False,
+                restarts=0, known_digest=None, history=None, resources=None,
+                fit=None):
+    """Parses one input and writes its jobscript, run in the worker
+    processes. Everything printed is captured and returned so that the
+    main process can print it in input order.
+
+    :known_digest: digest of the input in the JobIndex, the jobscript is
+        not rewritten if it is unchanged
+    :history: (model, margin) used to fill in missing resources
+    :resources: dict of resources overriding the input, see apply_resources
+    :fit: (node classes, mode, waste, clip) passed to fit_node
+    :returns: PreparedJob
+
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        jd = make_jobdata(path, config, version, restarts)
+        inp = read_qin(path, jd)
+        if resources:
+            apply_resources(jd, resources)
+        if history is not None:
+            fill_missing_resources(inp, jd, *history)
+        apply_defaults(inp, jd, config)
+        requested = (JobData.mem.raw(jd), JobData.scratch.raw(jd))
+        place_scratch(jd, *scratch_settings(config))
+        if fit is not None:
+            fit_node(jd, *fit)
+        job = PreparedJob(path, jd, inp, requested=requested)
+        job.digest = job_digest(inp, jd)
+        output = infile_base(path) + '.out'
+        job.finished = output_complete(output)
+        job.restarting = os.path.isfile(infile_base(path) + '.restart.tar')
+        if job.finished is not None:
+            job.output_mtime = os.path.getmtime(output)
+        if 'CACHE' in config:
+            job.fingerprint = input_fingerprint(path)
+        if not (split_stages and len(inp.stages) > 1):
+            if job.finished is not True:
+                jd.check_data()
+            if render:
+                jspath = jobscript_path(path)
+                if known_digest == job.digest and os.path.isfile(jspath):
+                    job.unchanged = True
+                    job.jobscript = jspath
+                else:
+                    job.jobscript = write_jobscript(path, jd)
+    job.log = log.getvalue()
+    return job
+
+
+def prepare_jobs(infiles, config, version, render=True, split_stages=False,
+                 restarts=0, processes=None, index=None, history=None,
+                 resources=None, fit=None, catch_errors=False):
+    """Runs prepare_job for all inputs, in a process pool if there is more
+    than a handful of them. Yields the results in input order.
+
+    :catch_errors: a malformed input yields a PreparedJob with only path
+        and error set instead of raising
+
+    """
+    # the ConfigParser itself does not pickle
+    config = {name: dict(config[name]) for name in config.sections()}
+    args = (config, version, render, split_stages, restarts, history,
+            resources, fit)
+    items = []
+    for path in infiles:
+        entry = index.get(path) if index is not None else None
+        items.append((path, entry.get('digest') if entry else None))
+
+    prepare = _prepare_job_caught if catch_errors else _prepare_job_star
+    if processes == 1 or len(infiles) < 8:
+        for item in items:
+            yield prepare(args, item)
+        return
+
+    # imported only here, multiprocessing adds to the startup of every call
+    from concurrent.futures import ProcessPoolExecutor
+    chunksize = max(1, len(infiles) // (4 * (processes or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        yield from pool.map(partial(prepare, args), items,
+                            chunksize=chunksize)
+
+
+def _prepare_job_star(args, item):
+    path, known_digest = item
+    *args, history, resources, fit = args
+    return prepare_job(path, *args, known_digest=known_digest,
+                       history=history, resources=resources, fit=fit)
+
+
+def _prepare_job_caught(args, item):
+    try:
+        return _prepare_job_star(args, item)
+    except Exception as err:
+        return PreparedJob(item[0], None, None,
+                           error=f'{type(err).__name__}: {err}')
+
+
+def needs_submission(job: PreparedJob, entry):
+    """Decides from the JobIndex entry whether the job has to be
+    (re)submitted. New or changed inputs and failed jobs are submitted,
+    finished and still queued or running jobs are not.
+
+    :returns: (submit, status of the entry or None if unknown)
+
+    """
+    if entry is None:
+        return True, None
+    if job.restarting and entry.get('status') == 'submitted':
+        # the input was rewritten by the restart of a requeued job
+        return False, None
+    if entry.get('digest') != job.digest:
+        return True, None
+    if job.output_mtime < entry.get('submitted_at', 0):
+        # output of an earlier run, the current job has not finished yet
+        return entry.get('status') != 'submitted', None
+    if job.finished:
+        return False, 'completed'
+    if job.finished is False:
+        # output was copied back without the final qchem message
+        return True, 'failed'
+    return entry.get('status') != 'submitted', None
+
+
+@dataclass
+class JobPack:
+    """Several inputs with the same thread count run by a pool of workers
+    inside one allocation."""
+    ncpus: int
+    workers: int
+    mem: int
+    scratch: int
+    jobs: list = field(default_factory=list)
+    # accumulated walltime per worker
+    loads: list = field(default_factory=list)
+
+
+def node_config(config):
+    """Cores and memory (in MB) of a compute node from the [NODE] section of
+    the config, defaults to a JUSTUS2 standard node."""
+    cores = 48
+    mem = 180 * 1024
+    if config is not None and config.has_section('NODE'):
+        cores = config['NODE'].getint('cores', cores)
+        tmp = JobData('', '')
+        tmp.mem = config['NODE'].get('mem', f'{mem}M')
+        mem = JobData.mem.raw(tmp) or mem
+    return cores, mem
+
+
+def pack_jobs(jobs, node_cores, node_mem, max_cores=4, walltime=None):
+    """Bins small jobs into full node allocations.
+
+    Jobs with at most max_cores threads and a walltime are grouped by
+    thread count and version. A pack gets as many workers as fit on a node
+    by cores and by the largest memory request, the jobs are distributed
+    longest first on the least loaded worker until a worker would exceed
+    walltime (default: the longer of 24 h and the longest job).
+
+    :jobs: PreparedJob objects
+    :returns: (list of JobPack, list of jobs not suitable for packing)
+
+    """
+    rest = []
+    groups = {}
+    for job in jobs:
+        data = job.data
+        ncpus = data.ncpus or 1
+        if ncpus > max_cores or data.time is None:
+            rest.append(job)
+            continue
+        groups.setdefault((ncpus, data.qchem_version_path), []).append(job)
+
+    packs = []
+    for (ncpus, _), group in groups.items():
+        # the requests before the scratch placement, a pack puts the
+        # scratch of all inputs in $TMPDIR
+        mem = max(job.requested[0] or node_mem * ncpus // node_cores
+                  for job in group)
+        scratch = max(job.requested[1] or 0 for job in group)
+        workers = max(1, min(node_cores // ncpus, node_mem // mem))
+        if workers == 1:
+            rest.extend(group)
+            continue
+
+        group.sort(key=lambda job: JobData.time.raw(job.data), reverse=True)
+        limit = max(walltime or datetime.timedelta(hours=24),
+                    JobData.time.raw(group[0].data))
+        pack = None
+        for job in group:
+            needed = JobData.time.raw(job.data)
+            if pack is not None:
+                worker = pack.loads.index(min(pack.loads))
+                if pack.loads[worker] + needed <= limit:
+                    pack.loads[worker] += needed
+                    pack.jobs.append(job)
+                    continue
+            pack = JobPack(ncpus, workers, mem, scratch)
+            pack.loads = [datetime.timedelta()] * workers
+            pack.loads[0] = needed
+            pack.jobs.append(job)
+            packs.append(pack)
+
+    for pack in packs:
+        # no need to reserve workers that never get a job
+        pack.workers = min(pack.workers, len(pack.jobs))
+    return packs, rest
+
+
+def write_pack_jobscript(pack: JobPack, data: JobData):
+    """Writes the jobscript and manifest of a JobPack, data supplies mail
+    settings and qchem version. Named by batch_name, so packs still queued
+    from earlier runs keep their manifest.
+
+    :returns: path of the jobscript
+
+    """
+    outdir = os.path.dirname(pack.jobs[0].path)
+    jobname = batch_name('pack', [job.path for job in pack.jobs])
+    jspath = os.path.join(outdir, jobname + '.sh')
+    manifest = os.path.abspath(os.path.join(outdir, jobname + '.manifest'))
+
+    # longest jobs first so the worker pool approximates the planned schedule
+    with open(manifest, 'w') as mf:
+        for job in pack.jobs:
+            mf.write(infile_base(job.path) + '\n')
+
+    data.jobname = jobname
+    data.ncpus = pack.ncpus * pack.workers
+    data.mem = pack.mem * pack.workers
+    if pack.scratch:
+        data.scratch = pack.scratch * pack.workers
+    data.time = max(pack.loads)
+    # the inputs share the pack scratch in $TMPDIR
+    data.scratch_dir = data.scratch_need = None
+
+    # the pack runs its inputs with its own payload and stage-out
+    template = data.template or jobscript_template()
+    jobscript = data.create_header()
+    jobscript += template.render(
+        dict(jobname=jobname, metrics='$JOBNAME.$JOBID',
+             **scratch_fields(data)),
+        payload=jobscript_pack_template.format(
+            manifest=manifest, qchem_version_path=data.qchem_version_path,
+            ncpus=pack.ncpus, workers=pack.workers))
+
+    with open(jspath, 'w') as js:
+        js.write(jobscript)
+
+    return jspath
+
+
+def send_arrays(jobs, sbatch_args, no_send, throttle=None, submitter=None):
+    """Submits the jobs as job arrays of inputs with identical resources.
+
+    :returns: list of (PreparedJob, job id, jobscript)
+
+    """
+    ret = []
+    for group in group_array_jobs(jobs):
+        paths = [job.path for job in group]
+        jspath = write_array_jobscript(paths, [job.data for job in group])
+        tasks = f'0-{len(paths) - 1}'
+        if throttle:
+            tasks += f'%{throttle}'
+        print(f'{jspath}: {len(paths)} array tasks')
+        job_id = send_job(jspath, sbatch_args, no_send, array=tasks,
+                          submitter=submitter)
+        for task, job in enumerate(group):
+            ret.append((job, f'{job_id}_{task}' if job_id else None, jspath))
+    return ret
+
+
+def send_packs(jobs, config, version, sbatch_args, no_send, max_cores=4,
+               walltime=None, submitter=None):
+    """Packs small jobs into full node allocations and submits them, the
+    remaining jobs get their own jobscript.
+
+    :returns: list of (PreparedJob, job id, jobscript)
+
+    """
+    node_cores, node_mem = node_config(config)
+    packs, rest = pack_jobs(jobs, node_cores, node_mem, max_cores, walltime)
+    ret = []
+    for pack in packs:
+        jd = make_jobdata(pack.jobs[0].path, config, version)
+        jspath = write_pack_jobscript(pack, jd)
+        print(f'{jspath}: {len(pack.jobs)} inputs on {pack.workers} workers '
+              f'with {pack.ncpus} threads each')
+        job_id = send_job(jspath, sbatch_args, no_send, submitter=submitter)
+        ret.extend((job, job_id, jspath) for job in pack.jobs)
+    for job in rest:
+        jspath = write_jobscript(job.path, job.data)
+        ret.append((job, send_job(jspath, sbatch_args, no_send,
+                                  submitter=submitter), jspath))
+    return ret
+
+
+def make_jobdata(path, config, version, restarts=0):
+    mail = config['MAIL'] if 'MAIL' in config else {}
+    jd = JobData(
+        mail=mail.get('mail', ''),
+        mail_type=mail.get('mail-type', ''),
+        qchem_version_path=version,
+    )
+    jd.jobname = os.path.basename(path).replace('.in', '')
+    jd.restarts = restarts
+    jd.stageout = StageOut.from_config(
+        config['STAGEOUT'] if 'STAGEOUT' in config else None)
+    jd.template = jobscript_template(template_dirs(config))
+    return jd
+
+
+def workflow_path(path, dependency):
+    """Path of an input named in a qsys depends_on/geometry_from line of
+    the input at path, those are relative to the directory of the input."""
+    return os.path.normpath(os.path.join(os.path.dirname(path), dependency))
+
+
+def dependencies(inp: QChemInput):
+    """Inputs the job of inp has to wait for (normalised paths)."""
+    ret = []
+    for dependency in inp.depends_on + [inp.geometry_from]:
+        if dependency:
+            dependency = workflow_path(inp.path, dependency)
+            if dependency not in ret:
+                ret.append(dependency)
+    return ret
+
+
+def send_dag(jobs, ids, index, sbatch_args, no_send, submitter=None):
+    """Submits the jobs of workflows after the jobs they depend on, each
+    one waiting for them with --dependency=afterok.
+
+    A dependency is either submitted in this run (ids), already finished
+    or still queued according to the job index. Jobs depending on anything
+    else are not submitted.
+
+    :ids: dict normalised input -> job id of the jobs of this run, the ids
+        of the workflow jobs are added
+    :returns: list of (PreparedJob, job id, jobscript)
+
+    """
+    ret = []
+    waiting = {JobIndex.key(job.path): job for job in jobs}
+    while waiting:
+        ready = [key for key, job in waiting.items()
+                 if not any(dep in waiting for dep in dependencies(job.inp))]
+        if not ready:
+            print('** Warning ** circular dependencies between '
+                  f'{", ".join(waiting)}, they are not submitted')
+            ret.extend((job, None, job.jobscript) for job in waiting.values())
+            break
+        for key in ready:
+            job = waiting.pop(key)
+            if job.jobscript is None:
+                job.jobscript = write_jobscript(job.path, job.data)
+            after = []
+            for dep in dependencies(job.inp):
+                entry = index.get(dep) or {}
+                if dep in ids:
+                    # dry runs show the input instead of the job id
+                    after.append(ids[dep] if no_send else f'<{dep}>')
+                elif output_complete(infile_base(dep) + '.out'):
+                    continue
+                elif entry.get('status') == 'submitted' and entry.get('job_id'):
+                    after.append(entry['job_id'])
+                else:
+                    print(f'** Warning ** {dep} is neither finished, queued '
+                          f'nor part of this run')
+                    after.append(None)
+            if None in after:
+                print(f'** Warning ** {job.path} is not submitted')
+                job_id = None
+            else:
+                job_id = send_job(job.jobscript, sbatch_args, no_send,
+                                  dependency=':'.join(after) or None,
+                                  submitter=submitter)
+            ids[key] = job_id
+            ret.append((job, job_id, job.jobscript))
+    return ret
+
+
+def prepare_stages(inp: QChemInput, config, version, restarts=0,
+                   history=None, fit=None):
+    """Writes the inputs of the stage groups of a multi job input and
+    prepares each one like any other input, so that every job of the
+    chain only requests the resources of its own stages.
+
+    :returns: list of PreparedJob
+
+    """
+    return [prepare_job(path, config, version, restarts=restarts,
+                        history=history, fit=fit)
+            for path in write_stage_inputs(inp)]
+
+
+def send_stages(jobscripts, sbatch_args, no_send, submitter=None):
+    """Submits the jobscripts of the stage groups of a multi job input as
+    a chain of jobs, each one waiting for the previous one (afterok).
+
+    :returns: job id of the last job or None
+
+    """
+    job_id = None
+    for jspath in jobscripts:
+        job_id = send_job(jspath, sbatch_args, no_send, dependency=job_id,
+                          submitter=submitter)
+        if no_send and job_id is None:
+            # the following stages would wait for a job that does not exist
+            break
+    return job_id
+
+
+@dataclass
+class SubmitResult:
+    """Outcome of submit() for one input."""
+    path: str
+    job_id: str = None
+    jobscript: str = None
+    # resolved slurm resources as written to the jobscript header
+    resources: dict = field(default_factory=dict)
+    # warnings printed while the input was read
+    log: str = ''
+    # why nothing was submitted, None on success
+    error: str = None
+
+
+def submit(inputs, resources=None, version=None, config=None,
+           sbatch_args=None, send=True, restarts=0, dependency=None,
+           processes=None, submitter=None):
+    """Writes the jobscripts for the qchem inputs and submits them, the
+    entry point for workflow engines importing this module. Never prompts
+    and runs sbatch --parsable without a shell. The job index is not used.
+
+    :inputs: path or list of paths of qchem inputs
+    :resources: dict overriding the resources of the inputs, e.g.
+        {'mem': '8G', 'time': '1:00:00', 'ncpus': 4}
+    :version: path, name or alias of the qchem version script (default
+        from the config)
+    :config: ConfigParser (default read_config())
+    :sbatch_args: further sbatch options as one string
+    :send: False only writes the jobscripts
+    :dependency: job id all jobs wait for (afterok)
+    :submitter: Submitter with the rate limit and retries (default
+        Submitter()), sbatch runs in its threads while the next inputs
+        are read
+    :returns: list of SubmitResult in input order, missing or malformed
+        inputs and failed submissions with the error set
+
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if config is None:
+        config = read_config()
+    path = resolve_version(version, config, interactive=False)
+    if path is None:
+        raise ValueError(f'qchem version script {version} not found')
+    version = path
+
+    if submitter is None:
+        submitter = Submitter()
+    results = {}
+    futures = []
+    infiles = []
+    for path in inputs:
+        if os.path.isfile(path):
+            infiles.append(path)
+        else:
+            results[path] = SubmitResult(path, error='input not found')
+
+    for job in prepare_jobs(infiles, config, version, restarts=restarts,
+                            processes=processes, resources=resources,
+                            fit=fit_settings(config), catch_errors=True):
+        if job.error is not None:
+            results[job.path] = SubmitResult(job.path, error=job.error)
+            continue
+        data = job.data
+        result = SubmitResult(
+            job.path, jobscript=job.jobscript, log=job.log,
+            resources=dict(time=data.time, mem=data.mem,
+                           scratch=data.scratch, ncpus=data.ncpus))
+        results[job.path] = result
+        if send:
+            command = sbatch_command(job.jobscript, sbatch_args,
+                                     dependency=dependency)
+            futures.append((result, submitter.submit(submitter.sbatch,
+                                                     command)))
+    for result, future in futures:
+        result.job_id = future.result()[0]
+        if result.job_id is None:
+            result.error = submitter.error(result.jobscript)
+    return [results[path] for path in inputs]
+
+
+def write_report(path, submitted, submitter):
+    """Writes the inputs that were submitted and those whose submission
+    failed to a json file.
+
+    :submitted: list of (PreparedJob, job id or None, jobscript)
+    :returns: number of failed inputs
+
+    """
+    report = dict(submitted=[], failed=[])
+    for job, job_id, jobscript in submitted:
+        attempts = submitter.results.get(jobscript, {}).get('attempts')
+        entry = dict(input=job.path, jobscript=jobscript, attempts=attempts)
+        if job_id is None:
+            if jobscript is None:
+                # a chain of --split-stages jobs
+                entry['error'] = 'submission of a stage failed'
+            else:
+                entry['error'] = submitter.error(jobscript)
+            report['failed'].append(entry)
+        else:
+            entry['job_id'] = job_id
+            report['submitted'].append(entry)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump(report, fp, indent=1)
+    os.replace(tmp, path)
+    return len(report['failed'])
+
+
+def main(cmd, config):
+    start = time.perf_counter()
+    infiles = collect_inputs(cmd['INFILE'], cmd['recursive'], cmd['glob'])
+    if not infiles:
+        print('** Warning ** no input files given or found')
+        return
+    sbatch_args = sbatch_options(cmd['l'])
+    no_send = cmd['no_send']
+    version = cmd['version']
+    array = cmd['array']
+    throttle = cmd['throttle']
+    split_stages = cmd['split_stages']
+    force = cmd['force']
+    pack = cmd['pack']
+    if cmd['stageout_mode'] is not None:
+        if not config.has_section('STAGEOUT'):
+            config.add_section('STAGEOUT')
+        config['STAGEOUT']['mode'] = cmd['stageout_mode']
+    if cmd['reuse'] is not None:
+        if not config.has_section('CACHE'):
+            config.add_section('CACHE')
+        config['CACHE']['reuse'] = cmd['reuse']
+    if cmd['scratch'] is not None:
+        if not config.has_section('SCRATCH'):
+            config.add_section('SCRATCH')
+        config['SCRATCH']['policy'] = cmd['scratch']
+    if cmd['live_sync'] is not None:
+        if not config.has_section('STAGEOUT'):
+            config.add_section('STAGEOUT')
+        config['STAGEOUT']['live_sync'] = str(cmd['live_sync'])
+    if array and pack:
+        print('** Warning ** --array and --pack exclude each other, using --array')
+        pack = False
+    if pack and cmd['restart']:
+        print('** Warning ** --restart is not supported for packed jobs')
+    if pack and cmd['live_sync']:
+        print('** Warning ** --live-sync is not supported for packed jobs')
+    feeder = None
+    if cmd['feed']:
+        if array or pack or split_stages:
+            print('** Warning ** --feed submits every input as its own job, '
+                  'ignoring --array, --pack and --split-stages')
+            array = pack = split_stages = False
+        feeder = Feeder()
+        feeder.watermark = cmd['feed']
+        feeder.sbatch_args = sbatch_args
+
+    interactive = not cmd['non_interactive']
+    if cmd['config']:
+        if interactive:
+            write_config()
+        else:
+            print('** Warning ** --config needs an interactive session')
+
+    version = resolve_version(version, config, interactive)
+    if version is None:
+        sys.exit('no qchem version script found, give one with --version '
+                 'or set qchem_version in the config')
+
+    split_stages = split_stages and not (array or pack)
+    history = None
+    if cmd['auto_resources']:
+        margin = 1.3
+        if config.has_option('HISTORY', 'margin'):
+            margin = config['HISTORY'].getfloat('margin')
+        history = (ResourceHistory(history_path(config)).model(), margin,
+                   autotune_classes())
+    fit = fit_settings(config, cmd['fit'])
+    # dry runs (--no-send) leave the index and the result cache untouched
+    index = JobIndex()
+    now = time.time()
+    cache, reuse = result_cache(config)
+    # fingerprint -> first input of this run with it
+    fingerprints = {}
+    n_reused = 0
+    saved = 0.0
+
+    def record(job, job_id, jobscript):
+        # failed submissions stay out of the index to be retried next time
+        if no_send and job_id is not None:
+            index.update(job.path, digest=job.digest, job_id=job_id,
+                         jobscript=jobscript, status='submitted',
+                         submitted_at=now, sbatch_args=sbatch_args)
+
+    submitter = Submitter(workers=cmd['submit_workers'],
+                          rate=cmd['submit_rate'],
+                          retries=cmd['submit_retries'])
+
+    def send_later(fn, *args, **kwargs):
+        # sbatch runs in the background while the next inputs are parsed
+        if no_send:
+            return submitter.submit(fn, *args, submitter=submitter, **kwargs)
+        return fn(*args, **kwargs)
+
+    # (PreparedJob, job id or Future, jobscript)
+    pending = []
+    deferred = []
+    dag = []
+    fed = []
+    n_jobs = 0
+    n_skipped = 0
+    for job in prepare_jobs(
+            infiles, config, version, render=not (array or pack),
+            split_stages=split_stages, restarts=cmd['restart'],
+            processes=cmd['jobs'],
+            index=None if force else index, history=history, fit=fit):
+        print(job.log, end='')
+        submit, state = needs_submission(job, index.get(job.path))
+        if state is not None and no_send:
+            index.update(job.path, status=state)
+        if cache is not None and job.fingerprint:
+            if job.finished is True:
+                if no_send:
+                    cache.add(job.fingerprint, job.path)
+            elif not force and reuse != 'off':
+                hit = cache.get(job.fingerprint) if submit else None
+                if hit is not None:
+                    n_reused += 1
+                    saved += saved_core_hours(hit, job.data.ncpus)
+                    print(f'{job.path}: reusing {hit["output"]}')
+                    if no_send:
+                        reuse_result(job.path, hit, reuse)
+                        index.update(job.path, digest=job.digest,
+                                     status='completed',
+                                     reused_from=hit['input'])
+                    continue
+                # queued or running jobs count as the first one as well
+                first = fingerprints.setdefault(job.fingerprint, job.path)
+                if submit and first != job.path:
+                    print(f'** Warning ** {job.path} is the same calculation '
+                          f'as {first}, not submitted (its results are '
+                          'reused once it finished)')
+                    n_skipped += 1
+                    continue
+        if not force and not submit:
+            n_skipped += 1
+            continue
+
+        if dependencies(job.inp):
+            dag.append(job)
+        elif split_stages and len(job.inp.stages) > 1:
+            parts = prepare_stages(job.inp, config, version, cmd['restart'],
+                                   history, fit)
+            for part in parts:
+                print(part.log, end='')
+            pending.append((job, send_later(
+                send_stages, [part.jobscript for part in parts], sbatch_args,
+                no_send), None))
+            n_jobs += len(parts)
+        elif array or pack:
+            deferred.append(job)
+        elif feeder is not None:
+            n_jobs += 1
+            fed.append(job)
+        else:
+            n_jobs += 1
+            pending.append((job, send_later(
+                send_job, job.jobscript, sbatch_args, no_send),
+                job.jobscript))
+
+    if feeder is not None and dag:
+        # workflow jobs need the job ids of the jobs they wait for, which
+        # the feeder only gets later
+        print('** Warning ** --feed does not support workflows (qsys '
+              'depends_on/geometry_from), submitting all jobs directly')
+        pending.extend((job, send_later(
+            send_job, job.jobscript, sbatch_args, no_send), job.jobscript)
+            for job in fed)
+        feeder = None
+    elif feeder is not None:
+        for job in fed:
+            feeder.add(job)
+    submitted = [
+        (job, job_id.result() if isinstance(job_id, Future) else job_id,
+         jobscript) for job, job_id, jobscript in pending]
+    submitter.shutdown()
+    if array:
+        submitted += send_arrays(deferred, sbatch_args, no_send, throttle,
+                                 submitter=submitter)
+    elif pack:
+        pack_walltime = cmd['pack_walltime']
+        if pack_walltime is not None:
+            pack_walltime = _timedelta_from_string(pack_walltime)
+        submitted += send_packs(deferred, config, version, sbatch_args,
+                                no_send, max_cores=cmd['pack_max_cores'],
+                                walltime=pack_walltime, submitter=submitter)
+    if dag:
+        ids = {JobIndex.key(job.path): job_id
+               for job, job_id, _ in submitted}
+        submitted += send_dag(dag, ids, index, sbatch_args, no_send,
+                              submitter=submitter)
+    for job, job_id, jobscript in submitted:
+        record(job, job_id, jobscript)
+    n_jobs += len({jobscript for _, _, jobscript in submitted[len(pending):]})
+
+    if feeder is not None and no_send:
+        feeder.save()
+        index.save()
+        print(f'{len(feeder.jobs)} jobs queued in {feeder.path}, '
+              f'keeping {feeder.watermark} jobs in the slurm queue '
+              f'(resume with: qchem_send_slurm.py feed)', flush=True)
+        feed(feeder, submitter, index, interval=cmd['feed_interval'])
+        return
+    index.save()
+    failed = ''
+    reused = ''
+    if n_reused:
+        reused = (f', {n_reused} inputs reused from the result cache '
+                  f'({saved:.1f} core hours saved)')
+    # unchanged re-runs write nothing
+    if no_send and submitted:
+        n_failed = write_report(cmd['report'], submitted, submitter)
+        if n_failed:
+            failed = f', {n_failed} inputs failed (see {cmd["report"]})'
+    print(f'{len(infiles)} inputs, '
+          f'{n_jobs} jobs {"submitted" if no_send else "prepared"}'
+          f'{failed}, '
+          f'{n_skipped} unchanged or finished inputs skipped'
+          f'{reused} in {time.perf_counter() - start:.1f} s')
 
 
 if __name__ == "__main__":
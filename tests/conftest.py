@@ -0,0 +1,90 @@
+import os
+import stat
+import sys
+
+import pytest
+
+# qchem_send_slurm.py is a single script in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# fails with the message in $FAKE_SBATCH_ERROR for the first
+# $FAKE_SBATCH_FAILURES calls and for the jobscripts listed in
+# $FAKE_SBATCH_STATE/reject, else prints a job id; every call is logged
+FAKE_SBATCH = '''\
+#!/bin/bash
+exec 9> "$FAKE_SBATCH_STATE/lock"
+flock 9
+N=$(cat "$FAKE_SBATCH_STATE/n" 2>/dev/null || echo 0)
+N=$((N + 1))
+echo $N > "$FAKE_SBATCH_STATE/n"
+date +%s.%N >> "$FAKE_SBATCH_STATE/calls"
+echo "$*" >> "$FAKE_SBATCH_STATE/commands"
+for LAST; do :; done
+if [ "$N" -le "${FAKE_SBATCH_FAILURES:-0}" ]; then
+    echo "$FAKE_SBATCH_ERROR" >&2
+    exit 1
+fi
+if grep -qxF "$LAST" "$FAKE_SBATCH_STATE/reject" 2>/dev/null; then
+    echo "sbatch: error: Batch job submission failed: Invalid account" >&2
+    exit 1
+fi
+echo "$((1000 + N));cluster"
+'''
+
+
+class FakeSbatch:
+    """What the fake sbatch recorded, calling it gives the call times."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def __call__(self):
+        path = self.state / 'calls'
+        if not path.exists():
+            return []
+        return [float(line) for line in path.read_text().split()]
+
+    def commands(self):
+        """Arguments of the calls, in call order."""
+        path = self.state / 'commands'
+        if not path.exists():
+            return []
+        return [line.split() for line in path.read_text().splitlines()]
+
+    def reject(self, jobscript):
+        with open(self.state / 'reject', 'a') as fp:
+            fp.write(jobscript + '\n')
+
+
+@pytest.fixture
+def fake_sbatch(tmp_path, monkeypatch):
+    state = tmp_path / 'sbatch'
+    bin_dir = state / 'bin'
+    bin_dir.mkdir(parents=True)
+    sbatch = bin_dir / 'sbatch'
+    sbatch.write_text(FAKE_SBATCH)
+    sbatch.chmod(sbatch.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_SBATCH_STATE', str(state))
+    return FakeSbatch(state)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, fake_sbatch):
+    """Submit directory with a config in $HOME naming a stand-in qchem
+    version script, non-interactive, with the fake sbatch."""
+    import qchem_send_slurm
+    home = tmp_path / 'home'
+    monkeypatch.setenv('HOME', str(home))
+    monkeypatch.setenv('QCHEM_SEND_SLURM_NONINTERACTIVE', '1')
+    version = tmp_path / 'qchem_6.1'
+    version.write_text('#!/bin/bash\n')
+    config = qchem_send_slurm.config_path()
+    os.makedirs(os.path.dirname(config))
+    with open(config, 'w') as fp:
+        fp.write(f'[PATHS]\nqchem_version = {version}\n'
+                 '[MAIL]\nmail = a@b.c\nmail-type = END,FAIL\n')
+    directory = tmp_path / 'work'
+    directory.mkdir()
+    monkeypatch.chdir(directory)
+    return directory
@@ -0,0 +1,56 @@
+import pytest
+
+from qchem_send_slurm import Submitter, read_config, submit
+
+from test_workflow import write
+
+
+def test_submit(workdir, fake_sbatch):
+    write(workdir, 'a.in')
+    write(workdir, 'b.in', 'threads 4')
+    results = submit(['a.in', 'b.in'], resources=dict(mem='8G'),
+                     sbatch_args='--partition=dev_single',
+                     submitter=Submitter(workers=1, rate=0))
+    assert [(result.path, result.job_id, result.jobscript, result.error)
+            for result in results] == [('a.in', '1001', 'a.sh', None),
+                                       ('b.in', '1002', 'b.sh', None)]
+    assert results[1].resources == dict(time='00-01:00:00', mem='8G',
+                                        scratch=None, ncpus=4)
+    assert [command[-2:] for command in fake_sbatch.commands()] == [
+        ['--partition=dev_single', 'a.sh'], ['--partition=dev_single', 'b.sh']]
+
+
+def test_errors_are_recorded_per_input(workdir, fake_sbatch):
+    write(workdir, 'a.in')
+    # a walltime that does not parse
+    write(workdir, 'bad.in', 'wt abc')
+    write(workdir, 'c.in')
+    fake_sbatch.reject('c.sh')
+    submitter = Submitter(workers=1, rate=0, retries=0)
+    results = submit(['a.in', 'missing.in', 'bad.in', 'c.in'],
+                     dependency='999', submitter=submitter)
+    assert [result.path for result in results] == [
+        'a.in', 'missing.in', 'bad.in', 'c.in']
+    ok, missing, bad, rejected = results
+    assert ok.job_id == '1001' and ok.error is None
+    assert missing.error == 'input not found'
+    assert bad.job_id is None and bad.error.startswith('ValueError')
+    assert rejected.job_id is None and 'Invalid account' in rejected.error
+    assert [command[1] for command in fake_sbatch.commands()] == [
+        '--dependency=afterok:999'] * 2
+
+
+def test_many_inputs_in_processes(workdir, fake_sbatch):
+    # more than a handful of inputs are read in a process pool
+    for i in range(10):
+        write(workdir, f'in{i}.in', 'wt abc' if i == 3 else 'wt 2:00:00')
+    results = submit([f'in{i}.in' for i in range(10)], send=False,
+                     processes=2)
+    assert [result.error is None for result in results] == [
+        i != 3 for i in range(10)]
+    assert fake_sbatch.commands() == []
+
+
+def test_unknown_version(workdir):
+    with pytest.raises(ValueError):
+        submit(['a.in'], version='orca', config=read_config())
@@ -0,0 +1,41 @@
+import configparser
+import json
+import os
+
+from qchem_send_slurm import autotune_main, autotune_variant
+
+from test_input import write_input
+
+
+def test_collect_leaves_nothing_behind(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # the recommendations are cached below ~/.cache
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    write_input(tmp_path, 'h2.in', 'jobtype opt\n')
+    runs = {}
+    for i, (threads, wall) in enumerate(((1, 100.0), (2, 55.0), (4, 32.5))):
+        variant = autotune_variant('h2.in', threads, 2)
+        job_id = str(5000 + i)
+        name = f'h2.t{threads}'
+        # written by the jobscript next to the variant and, as sbatch ran
+        # in the working directory, the slurm log and metrics there
+        with open(f'.autotune/{name}.out', 'w') as fp:
+            fp.write(f'Total job time:  {wall}s(wall), 1.0s(cpu)\n')
+        os.mkdir(f'.autotune/{name}.out.plots')
+        with open(f'{name}.o{job_id}', 'w') as fp:
+            fp.write('qsys: job identifier is ' + job_id + '\n')
+        with open(f'{name}.{job_id}.metrics.jsonl', 'w') as fp:
+            fp.write(json.dumps(dict(job=job_id, name=name, phase='qchem',
+                                     start=0.0, end=wall)) + '\n')
+        runs[str(threads)] = dict(input=variant, job_id=job_id)
+    with open('.qchem_send_slurm.autotune.json', 'w') as fp:
+        json.dump({'h2.in': runs}, fp)
+
+    autotune_main(['--collect'], configparser.ConfigParser())
+
+    assert sorted(os.listdir(tmp_path)) == ['h2.in', 'home']
+    with open(tmp_path / 'home' / '.cache' / 'qchem_send_slurm' /
+              'autotune.json') as fp:
+        classes = json.load(fp)
+    assert classes['hf/sto-3g']['timings'] == {'1': 100.0, '2': 55.0,
+                                              '4': 32.5}
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from qchem_send_slurm import (JobIndex, ResultCache, cmd_args, config_path,
+                              input_fingerprint)
+
+H2O = '''\
+$molecule
+0 1
+O  0.000000  0.000000  0.117300
+H  0.000000  0.757200 -0.469200
+H  0.000000 -0.757200 -0.469200
+$end
+
+$rem
+method b3lyp
+basis 6-31g*
+jobtype sp
+$end
+'''
+
+FINISHED = (' Total job time:  1.00s(wall), 0.90s(cpu)\n'
+            ' Thank you very much for using Q-Chem.  Have a nice day.\n')
+
+
+def fingerprint(tmp_path, text, name='h2o.in'):
+    path = tmp_path / name
+    path.write_text(text)
+    return input_fingerprint(str(path))
+
+
+@pytest.mark.parametrize('text', [
+    # comments, blank lines, whitespace and case
+    H2O.replace('$rem\n', '$rem\n! single point\n\n').replace(
+        'basis 6-31g*', '  BASIS    6-31G*   ! Pople'),
+    # $rem order
+    H2O.replace('method b3lyp\nbasis 6-31g*\n', 'basis 6-31g*\nmethod b3lyp\n'),
+    # qsys lines and resource keywords
+    H2O + '! qsys wt 2:00:00\n! qsys mem 8gb\n',
+    H2O.replace('jobtype sp\n', 'jobtype sp\nthreads 8\nmem_total 16000\n'),
+    # coordinate noise below the rounding, signed zeros
+    H2O.replace('0.117300', '0.1173000004').replace(
+        '0.000000  0.757200', '-0.000000  0.757200'),
+    # section order
+    '$rem' + H2O.split('$rem')[1] + '\n' + H2O.split('$rem')[0],
+])
+def test_equal_fingerprints(tmp_path, text):
+    assert fingerprint(tmp_path, text, 'other.in') == fingerprint(tmp_path, H2O)
+
+
+@pytest.mark.parametrize('text', [
+    H2O.replace('basis 6-31g*', 'basis cc-pvdz'),
+    H2O.replace('method b3lyp', 'method pbe0'),
+    H2O.replace('jobtype sp', 'jobtype opt'),
+    # charge and multiplicity
+    H2O.replace('0 1', '1 2'),
+    H2O.replace('0.117300', '0.118300'),
+    H2O + '\n$solvent\nsolventname water\n$end\n',
+    # a second job
+    H2O + '\n@@@\n\n' + H2O.replace('jobtype sp', 'jobtype freq'),
+])
+def test_unequal_fingerprints(tmp_path, text):
+    assert fingerprint(tmp_path, text, 'other.in') != fingerprint(tmp_path, H2O)
+
+
+def test_cache_entries_need_a_finished_output(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    fp = fingerprint(tmp_path, H2O)
+    path = str(tmp_path / 'h2o.in')
+    assert not cache.add(fp, path)
+    (tmp_path / 'h2o.out').write_text('SCF failed to converge\n')
+    assert not cache.add(fp, path)
+    (tmp_path / 'h2o.out').write_text(FINISHED)
+    assert cache.add(fp, path)
+    # the first output stays the entry
+    assert not cache.add(fp, path)
+    assert cache.get(fp)['output'] == str(tmp_path / 'h2o.out')
+    (tmp_path / 'h2o.out').unlink()
+    assert cache.get(fp) is None
+
+
+@pytest.fixture
+def cached(workdir, tmp_path):
+    """A finished h2o calculation in the result cache configured in the
+    workdir config."""
+    with open(config_path(), 'a') as fp:
+        fp.write(f'[CACHE]\ndir = {tmp_path / "cache"}\n')
+    done = tmp_path / 'done'
+    done.mkdir()
+    (done / 'h2o.in').write_text(H2O)
+    (done / 'h2o.out').write_text(FINISHED)
+    fp = input_fingerprint(str(done / 'h2o.in'))
+    assert ResultCache(str(tmp_path / 'cache')).add(fp, str(done / 'h2o.in'))
+    return done
+
+
+def test_hit_is_linked_instead_of_submitted(cached, workdir, fake_sbatch):
+    (workdir / 'water.in').write_text(H2O.replace('$rem\n', '$rem\n! again\n'))
+    cmd_args(['water.in'])
+    assert fake_sbatch.commands() == []
+    assert os.path.islink('water.out')
+    assert os.path.realpath('water.out') == str(cached / 'h2o.out')
+    entry = JobIndex().get('water.in')
+    assert entry['status'] == 'completed'
+    assert entry['reused_from'] == str(cached / 'h2o.in')
+
+
+def test_same_calculation_is_submitted_once_per_run(cached, workdir,
+                                                    fake_sbatch):
+    text = H2O.replace('basis 6-31g*', 'basis cc-pvtz')
+    (workdir / 'a.in').write_text(text)
+    (workdir / 'b.in').write_text(text.replace('jobtype sp',
+                                               'jobtype sp\n! copy'))
+    cmd_args(['a.in', 'b.in'])
+    assert [command[-1] for command in fake_sbatch.commands()] == ['a.sh']
+    assert JobIndex().get('b.in') is None
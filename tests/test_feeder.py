@@ -0,0 +1,132 @@
+import os
+import stat
+
+import pytest
+
+from qchem_send_slurm import Feeder, JobIndex, PreparedJob, Submitter
+
+# squeue prints the jobs listed in $FAKE_SLURM/queue, sbatch adds one there
+FAKE_SQUEUE = '''\
+#!/bin/bash
+echo x >> "$FAKE_SLURM/squeue_calls"
+[ -e "$FAKE_SLURM/squeue_fails" ] && exit 1
+cat "$FAKE_SLURM/queue" 2>/dev/null
+exit 0
+'''
+
+FAKE_SBATCH = '''\
+#!/bin/bash
+for LAST; do :; done
+if grep -qx "$LAST" "$FAKE_SLURM/reject" 2>/dev/null; then
+    echo "sbatch: error: Invalid account" >&2
+    exit 1
+fi
+exec 9> "$FAKE_SLURM/lock"
+flock 9
+N=$(($(cat "$FAKE_SLURM/n" 2>/dev/null || echo 0) + 1))
+echo $N > "$FAKE_SLURM/n"
+echo "$((2000 + N))|PENDING" >> "$FAKE_SLURM/queue"
+echo "$((2000 + N))"
+'''
+
+
+@pytest.fixture
+def slurm(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for name, text in (('squeue', FAKE_SQUEUE), ('sbatch', FAKE_SBATCH)):
+        script = bin_dir / name
+        script.write_text(text)
+        script.chmod(script.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_SLURM', str(tmp_path))
+    # the squeue snapshot is cached below ~/.cache
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    return tmp_path
+
+
+def make_feeder(directory, n, watermark):
+    feeder = Feeder(str(directory))
+    feeder.watermark = watermark
+    for i in range(n):
+        feeder.add(PreparedJob(f'in{i}.in', None, None,
+                               jobscript=f'in{i}.sh', digest=f'd{i}'))
+    return feeder
+
+
+def queue_lines(slurm):
+    return (slurm / 'queue').read_text().splitlines()
+
+
+def test_top_up_to_the_watermark(slurm):
+    (slurm / 'queue').write_text('1|RUNNING\n')
+    feeder = make_feeder(slurm, 5, watermark=3)
+    index = JobIndex(str(slurm))
+    submitter = Submitter(rate=0)
+
+    assert feeder.top_up(submitter, index) == 2
+    assert len(queue_lines(slurm)) == 3
+    assert [entry['input'] for entry in feeder.jobs] == ['in2.in', 'in3.in',
+                                                         'in4.in']
+    # the sbatch calls run concurrently
+    assert {index.get('in0.in')['job_id'],
+            index.get('in1.in')['job_id']} == {'2001', '2002'}
+    assert index.get('in1.in')['status'] == 'submitted'
+
+    # queue is full, nothing to do
+    assert feeder.top_up(submitter, index) == 0
+
+    # two jobs finished, seen once the cached snapshot is too old
+    (slurm / 'queue').write_text('\n'.join(queue_lines(slurm)[2:]) + '\n')
+    assert feeder.top_up(submitter, index) == 0
+    assert feeder.top_up(submitter, index, max_age=0) == 2
+    assert [entry['input'] for entry in feeder.jobs] == ['in4.in']
+    submitter.shutdown()
+
+
+def test_state_is_resumable(slurm):
+    (slurm / 'queue').write_text('')
+    feeder = make_feeder(slurm, 4, watermark=1)
+    submitter = Submitter(rate=0)
+    feeder.top_up(submitter, JobIndex(str(slurm)))
+    submitter.shutdown()
+    feeder.save()
+
+    resumed = Feeder(str(slurm))
+    assert resumed.watermark == 1
+    assert [entry['input'] for entry in resumed.jobs] == ['in1.in', 'in2.in',
+                                                          'in3.in']
+
+    resumed.jobs = []
+    resumed.save()
+    assert not os.path.exists(resumed.path)
+
+
+def test_squeue_is_cached_between_polls(slurm):
+    (slurm / 'queue').write_text('1|RUNNING\n2|PENDING\n')
+    feeder = make_feeder(slurm, 3, watermark=2)
+    index = JobIndex(str(slurm))
+    submitter = Submitter(rate=0)
+    for _ in range(3):
+        assert feeder.top_up(submitter, index, max_age=60) == 0
+    assert len((slurm / 'squeue_calls').read_text().split()) == 1
+    submitter.shutdown()
+
+
+def test_squeue_failure_submits_nothing(slurm):
+    (slurm / 'squeue_fails').write_text('')
+    feeder = make_feeder(slurm, 2, watermark=5)
+    assert feeder.top_up(Submitter(rate=0), JobIndex(str(slurm))) is None
+    assert len(feeder.jobs) == 2
+
+
+def test_rejected_jobs_are_dropped(slurm):
+    (slurm / 'queue').write_text('')
+    (slurm / 'reject').write_text('in1.sh\n')
+    feeder = make_feeder(slurm, 3, watermark=5)
+    submitter = Submitter(rate=0)
+    assert feeder.top_up(submitter, JobIndex(str(slurm))) == 2
+    submitter.shutdown()
+    assert feeder.jobs == []
+    assert [entry['input'] for entry in feeder.failed] == ['in1.in']
+    assert 'Invalid account' in feeder.failed[0]['error']
@@ -0,0 +1,64 @@
+import textwrap
+
+import pytest
+
+from qchem_send_slurm import (QChemInput, ResourceHistory, predict_resources,
+                              read_output)
+
+OUTPUT = '''\
+                  Welcome to Q-Chem
+--------------------------------------------------------------
+User input:
+--------------------------------------------------------------
+$molecule
+0 1
+O 0.0 0.0 0.0
+H 0.0 0.0 0.96
+H 0.93 0.0 -0.24
+$end
+
+$rem
+METHOD b3lyp
+BASIS def2-svp
+THREADS {threads}
+$end
+--------------------------------------------------------------
+ There are 12 shells and 24 basis functions
+ SCF converged
+ Total job time:  {wall:.2f}s(wall), 10.00s(cpu)
+ Thank you very much for using Q-Chem.  Have a nice day.
+'''
+
+
+def write_output(directory, name, threads, wall):
+    path = directory / name
+    path.write_text(OUTPUT.format(threads=threads, wall=wall))
+    return str(path)
+
+
+def test_read_output(tmp_path):
+    record = read_output(write_output(tmp_path, 'h2o.out', 8, 120.5))
+    assert record['method'] == 'b3lyp'
+    assert record['basis'] == 'def2-svp'
+    assert record['natoms'] == 3
+    assert record['threads'] == 8
+    assert record['nbasis'] == 24
+    assert record['wall'] == 120.5
+
+
+def test_read_output_unfinished(tmp_path):
+    path = tmp_path / 'h2o.out'
+    path.write_text(textwrap.dedent(OUTPUT).rsplit(' Thank', 1)[0])
+    assert read_output(str(path)) is None
+
+
+def test_walltime_scales_with_threads(tmp_path):
+    # the same job took 100 s on 32 threads
+    history = ResourceHistory(str(tmp_path / 'history.json'))
+    history.records['a'] = read_output(
+        write_output(tmp_path, 'a.out', 32, 100.0))
+    model = history.model()
+    inp = QChemInput('h2o.in', rem={'method': 'b3lyp', 'basis': 'def2-svp'},
+                     natoms=3)
+    assert predict_resources(inp, model, 1.0, threads=32)['wall'] == pytest.approx(100.0)
+    assert predict_resources(inp, model, 1.0, threads=4)['wall'] == pytest.approx(800.0)
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from qchem_send_slurm import JobIndex, PreparedJob, cmd_args, needs_submission
+
+from test_workflow import write
+
+SUBMITTED_AT = 1000.0
+
+
+@pytest.mark.parametrize('entry, digest, finished, mtime, restarting, expected', [
+    # new input
+    (None, 'd1', None, 0.0, False, (True, None)),
+    # changed input or resources
+    (dict(digest='d0', status='completed'), 'd1', True, 2000.0, False,
+     (True, None)),
+    # queued or running, no output yet
+    (dict(digest='d1', status='submitted'), 'd1', None, 0.0, False,
+     (False, None)),
+    # output of an earlier run while the current job is queued
+    (dict(digest='d1', status='submitted'), 'd1', False, 500.0, False,
+     (False, None)),
+    # failed before and no newer output
+    (dict(digest='d1', status='failed'), 'd1', False, 500.0, False,
+     (True, None)),
+    # finished after the submission
+    (dict(digest='d1', status='submitted'), 'd1', True, 2000.0, False,
+     (False, 'completed')),
+    (dict(digest='d1', status='completed'), 'd1', True, 2000.0, False,
+     (False, 'completed')),
+    # output without the final qchem message
+    (dict(digest='d1', status='submitted'), 'd1', False, 2000.0, False,
+     (True, 'failed')),
+    # input rewritten by the restart of a requeued job
+    (dict(digest='d0', status='submitted'), 'd1', False, 2000.0, True,
+     (False, None)),
+    (dict(digest='d0', status='failed'), 'd1', False, 2000.0, True,
+     (True, None)),
+])
+def test_needs_submission(entry, digest, finished, mtime, restarting,
+                          expected):
+    if entry is not None:
+        entry = dict(entry, submitted_at=SUBMITTED_AT)
+    job = PreparedJob('a.in', None, None, digest=digest, finished=finished,
+                      output_mtime=mtime, restarting=restarting)
+    assert needs_submission(job, entry) == expected
+
+
+def stat(path):
+    return os.stat(path).st_mtime_ns
+
+
+def test_rerun_submits_only_new_and_failed_inputs(workdir, fake_sbatch):
+    write(workdir, 'a.in')
+    write(workdir, 'b.in')
+    cmd_args(['a.in', 'b.in'])
+    assert len(fake_sbatch.commands()) == 2
+    index_mtime = stat(JobIndex.filename)
+    jobscript_mtime = stat('a.sh')
+
+    # unchanged: nothing submitted, nothing written
+    cmd_args(['a.in', 'b.in'])
+    assert len(fake_sbatch.commands()) == 2
+    assert stat(JobIndex.filename) == index_mtime
+    assert stat('a.sh') == jobscript_mtime
+    assert sorted(os.listdir(workdir)) == [
+        '.qchem_send_slurm.json', '.qchem_send_slurm.report.json',
+        'a.in', 'a.sh', 'b.in', 'b.sh']
+
+    # a finished, b failed and c new
+    (workdir / 'a.out').write_text(
+        ' Thank you very much for using Q-Chem.  Have a nice day.\n')
+    (workdir / 'b.out').write_text(' SCF failed to converge\n')
+    write(workdir, 'c.in')
+    cmd_args(['a.in', 'b.in', 'c.in'])
+    assert [command[-1] for command in fake_sbatch.commands()[2:]] == [
+        'b.sh', 'c.sh']
+    index = JobIndex()
+    assert index.get('a.in')['status'] == 'completed'
+    assert index.get('b.in')['job_id'] == '1003'
+    assert index.get('c.in')['status'] == 'submitted'
+
+    index_mtime = stat(JobIndex.filename)
+    cmd_args(['a.in'])
+    assert len(fake_sbatch.commands()) == 4
+    assert stat(JobIndex.filename) == index_mtime
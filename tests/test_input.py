@@ -0,0 +1,92 @@
+import os
+import textwrap
+
+from qchem_send_slurm import (JobData, find_inputs, read_input, read_qin,
+                              write_jobscript, write_stage_inputs)
+
+
+def write_input(directory, name, rem, qsys=''):
+    path = directory / name
+    path.write_text(textwrap.dedent('''\
+        $molecule
+        0 1
+        H 0.0 0.0 0.0
+        H 0.0 0.0 0.74
+        $end
+
+        $rem
+        method hf
+        basis sto-3g
+        ''') + rem + '$end\n' + qsys)
+    return str(path)
+
+
+def test_rem_and_qsys(tmp_path):
+    path = write_input(tmp_path, 'h2.in', 'threads 4\nmem_total 2000\n',
+                       '! qsys wt 2:00:00\n! qsys scratch 10g\n')
+    jd = JobData('', '')
+    inp = read_qin(path, jd)
+    assert inp.method == 'hf'
+    assert inp.natoms == 2
+    assert jd.ncpus == 4
+    assert JobData.mem.raw(jd) == 2100
+    assert jd.scratch == '10'
+    assert jd.time == '00-02:00:00'
+
+
+def test_qsys_overrides_rem(tmp_path):
+    path = write_input(tmp_path, 'h2.in', 'threads 4\n', '! qsys threads 8\n')
+    jd = JobData('', '')
+    read_qin(path, jd)
+    assert jd.ncpus == 8
+
+
+def test_no_threads_runs_one_thread(tmp_path):
+    path = write_input(tmp_path, 'h2.in', 'mem_total 1000\n',
+                       '! qsys wt 1:00:00\n')
+    jd = JobData('', '', '/opt/qchem/run')
+    jd.jobname = 'h2'
+    read_qin(path, jd)
+    assert jd.ncpus is None
+    with open(write_jobscript(path, jd)) as js:
+        jobscript = js.read()
+    assert '#SBATCH -n 1\n' in jobscript
+    assert '/opt/qchem/run -nt 1 ' in jobscript
+    assert 'None' not in jobscript
+
+
+def test_stage_inputs_get_the_file_qsys_lines(tmp_path):
+    path = tmp_path / 'multi.in'
+    path.write_text(textwrap.dedent('''\
+        ! qsys wt 2:00:00
+        ! qsys mem 4G
+        $molecule
+        0 1
+        H 0.0 0.0 0.0
+        H 0.0 0.0 0.74
+        $end
+        $rem
+        method hf
+        $end
+        @@@
+        $molecule
+        0 1
+        H 0.0 0.0 0.0
+        H 0.0 0.0 0.70
+        $end
+        $rem
+        method hf
+        $end
+        ! qsys wt 5:00:00
+        '''))
+    parts = write_stage_inputs(read_input(str(path)))
+    assert [os.path.relpath(part, tmp_path) for part in parts] == [
+        os.path.join('.stages', 'multi_part0.in'),
+        os.path.join('.stages', 'multi_part1.in')]
+    first, second = JobData('', ''), JobData('', '')
+    read_qin(parts[0], first)
+    read_qin(parts[1], second)
+    assert (first.mem, first.time) == ('4G', '00-02:00:00')
+    assert (second.mem, second.time) == ('4G', '00-05:00:00')
+    # generated inputs are not found again by --recursive
+    assert find_inputs(str(tmp_path)) == [str(path)]
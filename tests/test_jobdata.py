@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+
+from qchem_send_slurm import JobData
+
+
+def make_spec(i):
+    """JobData with values depending on i, set in the order qchem, qsys, cmd
+    like read_qin and the command line do."""
+    jd = JobData('', '')
+    jd.jobname = f'job{i}'
+    jd.ncpus = i % 48 + 1
+    # qchem mem_total, overwritten by qsys
+    jd.mem = 100 + i
+    jd.mem = f'{1000 + i}M'
+    jd.scratch = f'{i + 1}G'
+    jd.time = f'{i % 24:02d}:{i % 60:02d}:00'
+    return jd
+
+
+def test_10k_specs_keep_their_own_values():
+    specs = [make_spec(i) for i in range(10000)]
+    for i, jd in enumerate(specs):
+        assert jd.jobname == f'job{i}'
+        assert jd.ncpus == i % 48 + 1
+        assert JobData.mem.raw(jd) == 1000 + i
+        assert JobData.scratch.raw(jd) == (i + 1) * 1024
+        assert JobData.time.raw(jd) == datetime.timedelta(
+            hours=i % 24, minutes=i % 60)
+        assert f'#SBATCH --mem={jd.mem}\n' in jd.create_header()
+
+
+def test_unset_resources_do_not_leak_between_specs():
+    full = make_spec(1)
+    empty = JobData('', '')
+    assert JobData.mem.raw(full) is not None
+    assert empty.mem is None
+    assert empty.scratch is None
+    assert empty.time is None
+
+
+@pytest.mark.parametrize('values, expected', [
+    # qchem < qsys < cmd, the last value which is not None wins
+    ((1000, '2G', '3G'), '3G'),
+    ((1000, '2G', None), '2G'),
+    ((1000, None, None), '1000M'),
+    ((1000, '2G', '3G', '4G'), '4G'),
+])
+def test_precedence(values, expected):
+    jd = JobData('', '')
+    for value in values:
+        jd.mem = value
+    assert jd.mem == expected
+
+
+def test_no_instance_dict():
+    jd = JobData('', '')
+    assert not hasattr(jd, '__dict__')
+    with pytest.raises(AttributeError):
+        jd.unknown = 1
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from qchem_send_slurm import JobData, fit_node, parse_sinfo
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def classes():
+    # sinfo --noheader --format='%P|%c|%m|%D|%G' on JUSTUS2
+    with open(os.path.join(DATA, 'sinfo_justus2.txt')) as fp:
+        return parse_sinfo(fp.read())
+
+
+def make_job(ncpus, mem, scratch=None):
+    data = JobData('', '')
+    data.jobname = 'job'
+    data.ncpus = ncpus
+    data.mem = mem
+    if scratch is not None:
+        data.scratch = scratch
+    return data
+
+
+def test_parse_sinfo(classes):
+    by_name = {node.name: node for node in classes}
+    assert sorted(by_name) == ['long', 'single', 'single:371G', 'single:745G']
+    single = by_name['single']
+    assert (single.partition, single.cores, single.mem, single.scratch,
+            single.count) == ('single', 48, 187000, 960 * 1024, 412)
+    # plain numbers are GB
+    assert by_name['long'].scratch == 960 * 1024
+    assert by_name['single:745G'].partition == 'single'
+    # gpu nodes are left out, the cheapest class comes first
+    assert all('gpu' not in node.partition for node in classes)
+    assert [node.mem for node in classes] == sorted(node.mem
+                                                    for node in classes)
+
+
+def test_fit_picks_the_cheapest_class(classes):
+    data = make_job(8, '64G')
+    assert fit_node(data, classes, mode='adjust').name == 'single'
+    assert data.partition == 'single'
+
+    data = make_job(8, '300G')
+    assert fit_node(data, classes, mode='warn').name == 'single:371G'
+
+
+def test_fit_warns_just_above_a_class(classes, capsys):
+    # 190G is 4 % above the 187000M nodes
+    data = make_job(48, '190G')
+    assert fit_node(data, classes, mode='warn').name == 'single:371G'
+    assert 'just above' in capsys.readouterr().out
+    assert JobData.mem.raw(data) == 190 * 1024
+
+
+def test_fit_adjusts_memory_to_a_cheaper_class(classes):
+    data = make_job(48, '190G')
+    assert fit_node(data, classes, mode='adjust').name == 'single'
+    assert JobData.mem.raw(data) == 187000
+    assert data.partition == 'single'
+    assert '#SBATCH --partition=single\n' in data.create_header()
+
+
+def test_fit_adjusts_threads_of_a_job_wasting_a_node(classes, capsys):
+    # 2 threads but 81 % of the memory of a 380000M node
+    data = make_job(2, '300G')
+    fit_node(data, classes, mode='warn')
+    assert 'consider 39 threads' in capsys.readouterr().out
+    assert data.ncpus == 2
+    fit_node(data, classes, mode='adjust')
+    assert data.ncpus == 39
+
+
+def test_fit_scratch(classes):
+    data = make_job(8, '64G', scratch='1500G')
+    assert fit_node(data, classes).name == 'single:371G'
+
+
+def test_no_fitting_class(classes, capsys):
+    assert fit_node(make_job(8, '2000G'), classes) is None
+    assert 'fits on no node class' in capsys.readouterr().out
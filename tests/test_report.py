@@ -0,0 +1,170 @@
+import datetime
+import os
+import stat
+import subprocess
+
+import pytest
+
+import qchem_send_slurm
+from qchem_send_slurm import (JobData, JobPack, PreparedJob, _peak_scratch_mb,
+                              _slurm_seconds, parse_sacct_usage, sacct_snapshot,
+                              sacct_usage, write_array_jobscript,
+                              write_pack_jobscript)
+
+from test_input import write_input
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+# one completed job per id of the -j argument, every call appends the
+# length of that argument to $FAKE_SACCT_CALLS
+FAKE_SACCT = '''\
+#!/bin/bash
+for LAST; do :; done
+echo ${#LAST} >> "$FAKE_SACCT_CALLS"
+tr ',' '\\n' <<< "$LAST" | sed 's/$/|COMPLETED|00:10:00|01:00:00|00:09:00|1|1000M|/'
+'''
+
+
+@pytest.fixture(scope='module')
+def jobs():
+    # sacct --noheader --parsable2 --format=<sacct_usage_format>
+    with open(os.path.join(DATA, 'sacct_parsable2.txt')) as fp:
+        return parse_sacct_usage(fp.read())
+
+
+def test_plain_job(jobs):
+    job = jobs['4242001']
+    assert job['state'] == 'COMPLETED'
+    assert job['elapsed'] == 2 * 3600 + 10 * 60 + 33
+    assert job['timelimit'] == 4 * 3600
+    assert job['cpu'] == 16 * 3600 + 3 * 60 + 12
+    assert job['ncpus'] == 8
+    assert job['reqmem'] == 16000
+    # MaxRSS of the .batch step, not of .extern
+    assert job['maxrss'] == pytest.approx(12873440 / 1024)
+
+
+def test_steps_are_merged_into_their_job(jobs):
+    assert not any('.' in job_id for job_id in jobs)
+    # the largest MaxRSS of .batch and .0
+    assert jobs['4242400']['maxrss'] == 1700
+
+
+def test_array_tasks(jobs):
+    done, timeout = jobs['4242100_0'], jobs['4242100_1']
+    assert done['state'] == 'COMPLETED'
+    assert done['reqmem'] == 8 * 1024
+    assert done['maxrss'] == pytest.approx(5 * 1024)
+    assert timeout['state'] == 'TIMEOUT'
+    assert timeout['elapsed'] > timeout['timelimit']
+    assert timeout['maxrss'] == pytest.approx(7.5 * 1024)
+    pending = jobs['4242100_[2-3]']
+    assert pending['state'] == 'PENDING'
+    assert pending['maxrss'] is None
+
+
+def test_running_job(jobs):
+    job = jobs['4242200']
+    assert job['state'] == 'RUNNING'
+    assert job['timelimit'] == 86400
+    assert job['reqmem'] == 180 * 1024
+    assert job['maxrss'] is None
+
+
+def test_pack_job(jobs):
+    # one allocation running several inputs on 48 cores
+    job = jobs['4242300']
+    assert job['ncpus'] == 48
+    assert job['cpu'] == 8 * 86400 + 4 * 3600 + 11 * 60 + 42
+    assert job['cpu'] / (job['elapsed'] * job['ncpus']) == pytest.approx(
+        0.811, abs=1e-3)
+    assert job['maxrss'] == pytest.approx(70312000 / 1024)
+
+
+def test_cancelled_job_with_memory_per_cpu(jobs):
+    job = jobs['4242400']
+    assert job['state'] == 'CANCELLED'
+    # 2000Mc on 2 cpus
+    assert job['reqmem'] == 4000
+
+
+@pytest.mark.parametrize('string, seconds', [
+    ('1-02:03:04', 93784),
+    ('02:03:04', 7384),
+    ('03:04.567', 184.567),
+    ('UNLIMITED', None),
+    ('Partition_Limit', None),
+    ('', None),
+])
+def test_slurm_seconds(string, seconds):
+    assert _slurm_seconds(string) == pytest.approx(seconds)
+
+
+def run_metric(jobscript, env, before_metric=''):
+    """Runs the METRICS line of the prologue of jobscript and writes one
+    qchem record with 2 MB peak scratch to it."""
+    with open(jobscript) as fp:
+        lines = fp.read().splitlines()
+    metrics = [line for line in lines if line.startswith('METRICS=')]
+    script = '\n'.join(
+        [f'{key}={value}' for key, value in env.items()] + metrics +
+        [before_metric,
+         'echo \'{"phase": "qchem", "peak_scratch_bytes": 2097152}\' >> "$METRICS"'])
+    subprocess.run(['bash', '-c', script], check=True)
+
+
+def test_array_task_metrics_are_found_by_the_index_job_id(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    paths = [os.path.basename(write_input(tmp_path, name, ''))
+             for name in ('a.in', 'b.in')]
+    jspath = write_array_jobscript(paths, [JobData('', '')] * 2)
+    run_metric(jspath, dict(SUBMIT_WORKDIR=tmp_path, INFILE='b',
+                            JOBNAME=jspath[:-3], JOBID=5005,
+                            SLURM_ARRAY_JOB_ID=5004, SLURM_ARRAY_TASK_ID=1))
+    # the index stores array tasks as <array id>_<task>
+    assert _peak_scratch_mb('.', 'b.in', '5004_1') == pytest.approx(2.0)
+    assert _peak_scratch_mb('.', 'a.in', '5004_0') is None
+
+
+def test_pack_metrics_are_found_per_input(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobs = [PreparedJob(os.path.basename(write_input(tmp_path, name, '')),
+                        JobData('', ''), None) for name in ('a.in', 'b.in')]
+    pack = JobPack(1, 2, 1000, 0)
+    pack.jobs = jobs
+    pack.loads = [datetime.timedelta(hours=1)] * 2
+    jspath = write_pack_jobscript(pack, JobData('', ''))
+    with open(jspath) as fp:
+        per_input = [line.strip() for line in fp
+                     if line.strip().startswith('METRICS=')][-1]
+    run_metric(jspath, dict(SUBMIT_WORKDIR=tmp_path, SLURM_SUBMIT_DIR=tmp_path,
+                            INFILE='a', JOBNAME=jspath[:-3], JOBID=6001),
+               per_input)
+    assert _peak_scratch_mb('.', 'a.in', '6001') == pytest.approx(2.0)
+
+
+def test_many_job_ids_are_split_into_several_sacct_calls(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    sacct = bin_dir / 'sacct'
+    sacct.write_text(FAKE_SACCT)
+    sacct.chmod(sacct.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_SACCT_CALLS', str(tmp_path / 'calls'))
+    # array tasks of 8 digit job ids, 168 KiB joined
+    job_ids = [f'{12345678 + i // 1000}_{i % 1000}' for i in range(12000)]
+    usage = sacct_usage(job_ids)
+    assert set(usage) == set(job_ids)
+    calls = [int(n) for n in (tmp_path / 'calls').read_text().split()]
+    assert len(calls) == 12
+    assert max(calls) < 128 * 1024
+
+
+def test_sacct_errors_are_not_fatal(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+
+    def too_long(*args, **kwargs):
+        raise OSError(7, 'Argument list too long')
+    monkeypatch.setattr(qchem_send_slurm, 'run', too_long)
+    assert sacct_usage(['1', '2']) == {}
+    assert sacct_snapshot(['1', '2']) is None
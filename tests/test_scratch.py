@@ -0,0 +1,58 @@
+import subprocess
+
+from qchem_send_slurm import (JobData, PreparedJob, jobscript_template,
+                              pack_jobs, place_scratch, scratch_fields)
+
+
+def make_data(mem, scratch):
+    jd = JobData('', '')
+    jd.ncpus = 1
+    jd.mem = mem
+    jd.scratch = scratch
+    jd.time = '01:00:00'
+    return jd
+
+
+def run_stage_out(tmp_path, data, prologue=''):
+    """Runs the scratch lines of the prologue, an optional site override
+    and the cleanup of stage_out with $SLURM_JOB_ID 1 and $TMPDIR in
+    tmp_path, returns the directories left in tmp_path."""
+    fields = scratch_fields(data)
+    fields['scratch_dir'] = fields['scratch_dir'].replace('/dev/shm', str(tmp_path))
+    fields['scratch_cleanup'] = fields['scratch_cleanup'].replace('/dev/shm', str(tmp_path))
+    stage_out = jobscript_template().stages['stage_out']
+    cleanup = stage_out[0].split('# $TMPDIR is cleaned up')[1].split('}')[0]
+    script = (f'SLURM_JOB_ID=1\nTMPDIR={tmp_path}/tmp\n'
+              f'NODE_SCRATCHDIR={fields["scratch_dir"]}\n'
+              f'SCRATCH_CLEANUP={fields["scratch_cleanup"]}\n{prologue}\n'
+              'mkdir -p "$NODE_SCRATCHDIR"\n#' + cleanup)
+    subprocess.run(['bash', '-c', script], check=True)
+    return sorted(p.name for p in tmp_path.iterdir())
+
+
+def test_stage_out_removes_the_placed_directory(tmp_path):
+    data = make_data('4G', '1G')
+    assert place_scratch(data) == 'shm'
+    assert run_stage_out(tmp_path, data) == []
+
+
+def test_stage_out_keeps_tmpdir_and_site_directories(tmp_path):
+    (tmp_path / 'a').mkdir()
+    assert run_stage_out(tmp_path / 'a', make_data('4G', None)) == ['tmp']
+    data = make_data('4G', '1G')
+    place_scratch(data)
+    (tmp_path / 'b').mkdir()
+    site = f'NODE_SCRATCHDIR={tmp_path}/b/site'
+    assert run_stage_out(tmp_path / 'b', data, site) == ['site']
+
+
+def test_packs_request_the_scratch_of_placed_inputs():
+    jobs = []
+    for i in range(4):
+        data = make_data('4G', '1G')
+        requested = (JobData.mem.raw(data), JobData.scratch.raw(data))
+        assert place_scratch(data) == 'shm'
+        jobs.append(PreparedJob(f'in{i}.in', data, None, requested=requested))
+    packs, rest = pack_jobs(jobs, node_cores=48, node_mem=192000)
+    assert rest == []
+    assert [(pack.mem, pack.scratch) for pack in packs] == [(4096, 1024)]
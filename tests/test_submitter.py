@@ -0,0 +1,54 @@
+import time
+
+from qchem_send_slurm import Submitter, sbatch_command
+
+
+def test_retries_socket_timeouts(fake_sbatch, monkeypatch):
+    monkeypatch.setenv('FAKE_SBATCH_FAILURES', '2')
+    monkeypatch.setenv('FAKE_SBATCH_ERROR',
+                       'sbatch: error: Socket timed out on send/recv operation')
+    submitter = Submitter(rate=0, retries=3, backoff=0.01)
+    job_id, _ = submitter.sbatch(sbatch_command('job.sh'))
+    assert job_id == '1003'
+    assert len(fake_sbatch()) == 3
+    assert submitter.results['job.sh'] == dict(job_id='1003', attempts=3,
+                                               error=None)
+
+
+def test_gives_up_after_the_retries(fake_sbatch, monkeypatch):
+    monkeypatch.setenv('FAKE_SBATCH_FAILURES', '10')
+    monkeypatch.setenv('FAKE_SBATCH_ERROR',
+                       'sbatch: error: Socket timed out on send/recv operation')
+    submitter = Submitter(rate=0, retries=2, backoff=0.01)
+    job_id, _ = submitter.sbatch(sbatch_command('job.sh'))
+    assert job_id is None
+    assert len(fake_sbatch()) == 3
+    assert 'Socket timed out' in submitter.error('job.sh')
+
+
+def test_no_retry_of_permanent_errors(fake_sbatch, monkeypatch):
+    monkeypatch.setenv('FAKE_SBATCH_FAILURES', '1')
+    monkeypatch.setenv('FAKE_SBATCH_ERROR',
+                       'sbatch: error: Invalid account or account/partition combination specified')
+    submitter = Submitter(rate=0, retries=3, backoff=0.01)
+    job_id, _ = submitter.sbatch(sbatch_command('job.sh'))
+    assert job_id is None
+    assert len(fake_sbatch()) == 1
+    assert submitter.results['job.sh']['attempts'] == 1
+
+
+def test_rate_limit(fake_sbatch):
+    rate = 20.0
+    submitter = Submitter(workers=4, rate=rate, retries=0)
+    start = time.monotonic()
+    futures = [submitter.submit(submitter.sbatch,
+                                sbatch_command(f'job{i}.sh'))
+               for i in range(10)]
+    job_ids = sorted(future.result()[0] for future in futures)
+    submitter.shutdown()
+    elapsed = time.monotonic() - start
+    assert job_ids == sorted(str(1000 + i) for i in range(1, 11))
+    # 10 calls at 20 per second take at least 9 intervals
+    assert elapsed >= 9 / rate * 0.95
+    calls = sorted(fake_sbatch())
+    assert calls[-1] - calls[0] >= 9 / rate * 0.8
@@ -0,0 +1,92 @@
+import configparser
+import os
+import shutil
+
+import pytest
+
+from qchem_send_slurm import (JobData, PreparedJob, classify_failure,
+                              scaled_resources)
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'triage')
+
+
+@pytest.fixture
+def logs(tmp_path):
+    # <name>.out and the slurm log <name>.o<job id> of failed jobs
+    shutil.copytree(DATA, tmp_path / 'triage')
+    return tmp_path / 'triage'
+
+
+@pytest.mark.parametrize('name, job_id, failure', [
+    ('timeout', '4243001', 'walltime'),
+    ('oom', '4243002', 'memory'),
+    ('diskfull', '4243003', 'scratch'),
+    ('scf', '4243004', 'scf'),
+    ('crash', '4243005', 'crash'),
+])
+def test_classify_from_output_and_log(logs, name, job_id, failure):
+    assert classify_failure(str(logs / f'{name}.in'), job_id) == failure
+
+
+def test_the_slurm_state_comes_first(logs):
+    path = str(logs / 'crash.in')
+    assert classify_failure(path, '4243005', 'OUT_OF_MEMORY') == 'memory'
+    assert classify_failure(path, '4243005', 'TIMEOUT') == 'walltime'
+    assert classify_failure(path, '4243005', 'FAILED') == 'crash'
+
+
+def test_latest_log_without_job_id(logs):
+    assert classify_failure(str(logs / 'timeout.in')) == 'walltime'
+
+
+def make_job(mem='16G', scratch='100G', time='12:00:00'):
+    data = JobData('', '')
+    data.mem = mem
+    data.scratch = scratch
+    data.time = time
+    return PreparedJob('h2o.in', data, None)
+
+
+def make_config(**options):
+    config = configparser.ConfigParser()
+    config['TRIAGE'] = options
+    return config
+
+
+@pytest.mark.parametrize('failure, expected', [
+    ('memory', dict(mem=24576)),
+    ('scratch', dict(scratch=204800)),
+    ('walltime', dict(time=86400)),
+    ('crash', {}),
+])
+def test_default_factors(failure, expected):
+    assert scaled_resources(make_job(), {}, failure, make_config()) == expected
+
+
+def test_configured_factor_and_earlier_scaling():
+    config = make_config(time_factor='1.5')
+    # the last resubmission already doubled the memory
+    entry = dict(scaled=dict(mem=32768))
+    assert scaled_resources(make_job(), entry, 'walltime', config) == dict(
+        mem=32768, time=64800)
+    assert scaled_resources(make_job(), entry, 'memory', config) == dict(
+        mem=49152)
+
+
+def test_scaling_stops_at_the_limits():
+    config = make_config(max_mem='180G', max_walltime='1-06:00:00',
+                         max_scratch='1800G')
+    job = make_job(mem='150G')
+    assert scaled_resources(job, {}, 'memory', config) == dict(mem=184320)
+    assert scaled_resources(job, dict(scaled=dict(mem=184320)), 'memory',
+                            config) is None
+    assert scaled_resources(job, {}, 'walltime', config) == dict(time=86400)
+    assert scaled_resources(job, dict(scaled=dict(time=86400)), 'walltime',
+                            config) == dict(time=108000)
+    assert scaled_resources(job, dict(scaled=dict(time=108000)), 'walltime',
+                            config) is None
+
+
+def test_nothing_to_scale():
+    job = make_job(mem=None)
+    assert scaled_resources(job, {}, 'memory', make_config()) is None
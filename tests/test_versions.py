@@ -0,0 +1,106 @@
+import configparser
+import os
+
+import pytest
+
+import qchem_send_slurm
+from qchem_send_slurm import VersionRegistry, cmd_args, resolve_version
+
+SCRIPTS = ('qchem_5.4.2', 'qchem_6.0.1', 'qchem_6.1', 'qchem_dev')
+
+
+@pytest.fixture
+def versions(tmp_path, monkeypatch):
+    # the listing is cached below ~/.cache
+    monkeypatch.setenv('HOME', str(tmp_path / 'home'))
+    directory = tmp_path / 'versions'
+    directory.mkdir()
+    for name in SCRIPTS:
+        (directory / name).write_text('#!/bin/bash\n')
+    # any prompt is a failure
+    monkeypatch.setattr('builtins.input', lambda *args: pytest.fail('prompted'))
+    return directory
+
+
+def make_config(directory, **aliases):
+    config = configparser.ConfigParser()
+    config['PATHS'] = dict(qchem_version_dir=str(directory))
+    config['VERSIONS'] = aliases
+    return config
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('qchem_6.0.1', 'qchem_6.0.1'),
+    # alias of the [VERSIONS] section
+    ('stable', 'qchem_6.0.1'),
+    # part of a name
+    ('5.4', 'qchem_5.4.2'),
+    ('dev', 'qchem_dev'),
+    # typo with a single close name
+    ('qchem-dev', 'qchem_dev'),
+])
+def test_resolve(versions, name, expected):
+    registry = VersionRegistry(str(versions), dict(stable='qchem_6.0.1'))
+    assert registry.resolve(name) == str(versions / expected)
+
+
+def test_alias_to_a_path(versions, tmp_path):
+    script = tmp_path / 'qchem_custom'
+    script.write_text('#!/bin/bash\n')
+    registry = VersionRegistry(str(versions), dict(custom=str(script)))
+    assert registry.resolve('custom') == str(script)
+
+
+def test_ambiguous_names_do_not_resolve(versions):
+    registry = VersionRegistry(str(versions))
+    assert registry.lookup('qchem_6') == ['qchem_6.0.1', 'qchem_6.1']
+    # several close names, the closest first
+    assert registry.lookup('qchem_5.4.3')[0] == 'qchem_5.4.2'
+    assert registry.resolve('qchem_5.4.3') is None
+    assert registry.resolve('qchem_6') is None
+    assert registry.resolve('orca') is None
+
+
+def test_listing_is_cached_until_the_directory_changes(versions):
+    assert set(VersionRegistry(str(versions)).scripts) == set(SCRIPTS)
+    mtime = os.stat(versions).st_mtime
+    (versions / 'qchem_6.2').write_text('#!/bin/bash\n')
+    # same mtime: the cached listing is used without reading the directory
+    os.utime(versions, (mtime, mtime))
+    assert 'qchem_6.2' not in VersionRegistry(str(versions)).scripts
+    os.utime(versions, (mtime + 10, mtime + 10))
+    registry = VersionRegistry(str(versions))
+    assert 'qchem_6.2' in registry.scripts
+    assert registry.resolve('6.2') == str(versions / 'qchem_6.2')
+    (versions / 'qchem_dev').unlink()
+    os.utime(versions, (mtime + 20, mtime + 20))
+    assert 'qchem_dev' not in VersionRegistry(str(versions)).scripts
+
+
+def test_refresh_ignores_the_cache(versions):
+    mtime = os.stat(versions).st_mtime
+    VersionRegistry(str(versions))
+    (versions / 'qchem_6.2').write_text('#!/bin/bash\n')
+    os.utime(versions, (mtime, mtime))
+    assert 'qchem_6.2' in VersionRegistry(str(versions), refresh=True).scripts
+
+
+def test_non_interactive_never_prompts(versions, capsys):
+    config = make_config(versions)
+    assert resolve_version('qchem_6', config, interactive=False) is None
+    assert 'ambiguous: qchem_6.0.1, qchem_6.1' in capsys.readouterr().out
+    assert resolve_version('orca', config, interactive=False) is None
+    assert resolve_version(None, config, interactive=False) is None
+
+
+def test_strict_mode_fails_instead_of_prompting(versions, tmp_path,
+                                                monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = qchem_send_slurm.config_path()
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+        make_config(versions).write(fp)
+    (tmp_path / 'h2.in').write_text('$rem\nmethod hf\n$end\n')
+    with pytest.raises(SystemExit, match='no qchem version script found'):
+        cmd_args(['--non-interactive', '--no-send', '--version', 'qchem_6',
+                  'h2.in'])
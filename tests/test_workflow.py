@@ -0,0 +1,129 @@
+import json
+
+from qchem_send_slurm import JobIndex, cmd_args
+
+H2 = '''\
+$molecule
+0 1
+H 0.0 0.0 0.0
+H 0.0 0.0 0.74
+$end
+
+$rem
+method hf
+basis sto-3g
+jobtype {jobtype}
+$end
+'''
+
+
+def write(directory, name, *qsys, jobtype='sp', jobs=1):
+    text = '\n@@@\n\n'.join([H2.format(jobtype=jobtype)] * jobs)
+    text += ''.join(f'! qsys {line}\n' for line in ('wt 1:00:00',) + qsys)
+    (directory / name).write_text(text)
+
+
+def submissions(fake_sbatch):
+    """jobscript -> (job id, dependency or None) of the sbatch calls, the
+    fake sbatch hands out 1001, 1002, ... in call order."""
+    ret = {}
+    for n, command in enumerate(fake_sbatch.commands(), 1001):
+        after = [arg.split(':', 1)[1] for arg in command
+                 if arg.startswith('--dependency=afterok:')]
+        ret[command[-1]] = (str(n), after[0] if after else None)
+    return ret
+
+
+def test_dependency_order(workdir, fake_sbatch):
+    write(workdir, 'td.in', 'geometry_from freq.in')
+    write(workdir, 'freq.in', 'geometry_from opt.in', jobtype='freq')
+    write(workdir, 'opt.in', jobtype='opt')
+    write(workdir, 'nbo.in', 'depends_on opt.in,freq.in')
+    cmd_args(['td.in', 'nbo.in', 'freq.in', 'opt.in'])
+    jobs = submissions(fake_sbatch)
+    assert [command[-1] for command in fake_sbatch.commands()][0] == 'opt.sh'
+    assert jobs['freq.sh'][1] == jobs['opt.sh'][0]
+    assert jobs['td.sh'][1] == jobs['freq.sh'][0]
+    assert jobs['nbo.sh'][1] == f'{jobs["opt.sh"][0]}:{jobs["freq.sh"][0]}'
+    assert JobIndex().get('td.in')['job_id'] == jobs['td.sh'][0]
+
+
+def test_cycles_and_missing_dependencies_are_not_submitted(workdir,
+                                                           fake_sbatch,
+                                                           capsys):
+    write(workdir, 'a.in', 'depends_on b.in')
+    write(workdir, 'b.in', 'depends_on a.in')
+    write(workdir, 'c.in', 'depends_on missing.in')
+    write(workdir, 'd.in', 'depends_on c.in')
+    write(workdir, 'e.in')
+    cmd_args(['a.in', 'b.in', 'c.in', 'd.in', 'e.in'])
+    out = capsys.readouterr().out
+    assert 'circular dependencies between a.in, b.in' in out
+    assert 'missing.in is neither finished, queued nor part of this run' in out
+    assert list(submissions(fake_sbatch)) == ['e.sh']
+    index = JobIndex()
+    assert [path for path in ('a.in', 'b.in', 'c.in', 'd.in', 'e.in')
+            if index.get(path)] == ['e.in']
+
+
+def test_dependents_of_failed_submissions_are_skipped(workdir, fake_sbatch):
+    fake_sbatch.reject('opt.sh')
+    write(workdir, 'opt.in', jobtype='opt')
+    write(workdir, 'freq.in', 'geometry_from opt.in', jobtype='freq')
+    write(workdir, 'td.in', 'geometry_from freq.in')
+    cmd_args(['opt.in', 'freq.in', 'td.in'])
+    assert [command[-1] for command in fake_sbatch.commands()] == ['opt.sh']
+    with open('.qchem_send_slurm.report.json') as fp:
+        report = json.load(fp)
+    assert sorted(entry['input'] for entry in report['failed']) == [
+        'freq.in', 'opt.in', 'td.in']
+
+
+def test_finished_and_queued_dependencies_outside_the_run(workdir,
+                                                          fake_sbatch):
+    write(workdir, 'opt.in', jobtype='opt')
+    (workdir / 'opt.out').write_text(
+        ' Thank you very much for using Q-Chem.  Have a nice day.\n')
+    write(workdir, 'scan.in')
+    index = JobIndex()
+    index.update('scan.in', job_id='777', status='submitted')
+    index.save()
+    write(workdir, 'freq.in', 'geometry_from opt.in', jobtype='freq')
+    write(workdir, 'nbo.in', 'depends_on scan.in')
+    cmd_args(['freq.in', 'nbo.in'])
+    jobs = submissions(fake_sbatch)
+    assert jobs['freq.sh'][1] is None
+    assert jobs['nbo.sh'][1] == '777'
+
+
+def test_afterok_on_array_tasks(workdir, fake_sbatch):
+    write(workdir, 'opt1.in', jobtype='opt')
+    write(workdir, 'opt2.in', jobtype='opt')
+    write(workdir, 'freq.in', 'geometry_from opt2.in', jobtype='freq')
+    cmd_args(['--array', 'opt1.in', 'opt2.in', 'freq.in'])
+    array = [n for n, command in enumerate(fake_sbatch.commands(), 1001)
+             if '--array=0-1' in command]
+    assert len(array) == 1
+    assert submissions(fake_sbatch)['freq.sh'][1] == f'{array[0]}_1'
+
+
+def test_afterok_on_packs(workdir, fake_sbatch):
+    write(workdir, 'opt1.in', jobtype='opt')
+    write(workdir, 'opt2.in', jobtype='opt')
+    write(workdir, 'freq.in', 'geometry_from opt1.in', jobtype='freq')
+    cmd_args(['--pack', 'opt1.in', 'opt2.in', 'freq.in'])
+    jobs = submissions(fake_sbatch)
+    pack = [name for name in jobs if name.startswith('qchem_pack_')]
+    assert len(pack) == 1
+    assert jobs['freq.sh'][1] == jobs[pack[0]][0]
+
+
+def test_afterok_on_the_last_split_stage(workdir, fake_sbatch):
+    write(workdir, 'opt.in', jobtype='opt', jobs=2)
+    write(workdir, 'freq.in', 'geometry_from opt.in', jobtype='freq')
+    cmd_args(['--split-stages', 'opt.in', 'freq.in'])
+    jobs = submissions(fake_sbatch)
+    stages = sorted(name for name in jobs if name.startswith('.stages/'))
+    assert len(stages) == 2
+    assert jobs[stages[1]][1] == jobs[stages[0]][0]
+    assert jobs['freq.sh'][1] == jobs[stages[1]][0]